@@ -1,17 +1,87 @@
+import base64
 import json
-import boto3
 import os
 import psycopg2
 import uuid
 import re
+import hashlib
+import logging
+import time
+import calendar
+from contextlib import contextmanager
+from datetime import date, datetime
+import telemetry
+import aws_clients
+from bedrock_runtime import BedrockRuntime
 
-secretsmanager = boto3.client('secretsmanager')
-bedrock = boto3.client('bedrock-runtime', region_name='us-west-2') # Explicitly set region
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
 
-def get_db_credentials():
+# Default ANN search breadth, overridable per request with "ef_search"/"probes"
+HNSW_EF_SEARCH = int(os.environ.get("HNSW_EF_SEARCH", "40"))
+IVFFLAT_PROBES = int(os.environ.get("IVFFLAT_PROBES", "1"))
+# Lists of the IVFFlat index, as set on the pgvector enabler; the upper bound for "probes"
+IVFFLAT_LISTS = int(os.environ.get("IVFFLAT_LISTS", "100"))
+# Must match the pgvector enabler's VECTOR_QUANTIZATION ("none", "halfvec" or
+# "binary"). When quantized, the index orders this many candidates by the
+# quantized distance and they are re-ranked by exact distance on the stored
+# vectors; overridable per request with "rerank_candidates"
+VECTOR_QUANTIZATION = os.environ.get("VECTOR_QUANTIZATION", "none")
+RERANK_CANDIDATES = int(os.environ.get("RERANK_CANDIDATES", "100"))
+# Per-request search overrides are clamped to 1..SEARCH_PARAM_MAX (pgvector's
+# upper limit for hnsw.ef_search)
+SEARCH_PARAM_MAX = 1000
+# Fall back to an ILIKE scan of chunk text when an identifier has no document_fields hit
+IDENTIFIER_ILIKE_FALLBACK = os.environ.get("IDENTIFIER_ILIKE_FALLBACK", "false").lower() == "true"
+# Prompt token budgets for recent conversation turns and for retrieved chunks
+HISTORY_TOKEN_BUDGET = int(os.environ.get("HISTORY_TOKEN_BUDGET", "1500"))
+RETRIEVAL_TOKEN_BUDGET = int(os.environ.get("RETRIEVAL_TOKEN_BUDGET", "2000"))
+# Turns beyond the history budget are folded into the rolling summary once they add up to this many tokens
+SUMMARY_BATCH_TOKENS = int(os.environ.get("SUMMARY_BATCH_TOKENS", "500"))
+SUMMARY_MAX_TOKENS = int(os.environ.get("SUMMARY_MAX_TOKENS", "300"))
+# Upper bound on unsummarized messages read per turn
+HISTORY_MAX_MESSAGES = int(os.environ.get("HISTORY_MAX_MESSAGES", "200"))
+# Fuse full-text and vector candidates with reciprocal-rank fusion; "false" restores pure vector search
+HYBRID_RETRIEVAL = os.environ.get("HYBRID_RETRIEVAL", "true").lower() == "true"
+# Candidates taken from each side before fusion, the RRF constant and the chunks kept
+HYBRID_CANDIDATES = int(os.environ.get("HYBRID_CANDIDATES", "20"))
+RRF_K = int(os.environ.get("RRF_K", "60"))
+RETRIEVAL_TOP_K = int(os.environ.get("RETRIEVAL_TOP_K", "5"))
+# Page size of the conversation and message listings when "limit" is not given, and its maximum
+HISTORY_PAGE_SIZE = int(os.environ.get("HISTORY_PAGE_SIZE", "50"))
+HISTORY_PAGE_MAX = int(os.environ.get("HISTORY_PAGE_MAX", "200"))
+# Completion length for chat answers
+MAX_TOKENS = int(os.environ.get("MAX_TOKENS", "1024"))
+# Serve a stored answer to a question this similar (cosine) to an earlier one
+# when it was generated from exactly the same chunks; entries expire after the TTL
+ANSWER_CACHE_ENABLED = os.environ.get("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+ANSWER_CACHE_SIMILARITY = float(os.environ.get("ANSWER_CACHE_SIMILARITY", "0.95"))
+ANSWER_CACHE_TTL_HOURS = int(os.environ.get("ANSWER_CACHE_TTL_HOURS", "24"))
+# Cached Secrets Manager credentials are refetched after this many seconds
+DB_CREDENTIALS_TTL_SECONDS = int(os.environ.get("DB_CREDENTIALS_TTL_SECONDS", "300"))
+# A reused connection idle for longer than this is pinged before use
+DB_HEALTHCHECK_IDLE_SECONDS = int(os.environ.get("DB_HEALTHCHECK_IDLE_SECONDS", "30"))
+
+# Built on first use; Secrets Manager is only needed for a new connection
+secretsmanager = aws_clients.lazy('secretsmanager')
+bedrock = BedrockRuntime(region_name='us-west-2') # Explicitly set region
+
+# Connection state kept across warm invocations of this container
+_db_credentials = None
+_db_credentials_fetched_at = 0.0
+_db_connection = None
+_db_connection_used_at = 0.0
+
+def get_db_credentials(force_refresh=False):
+    global _db_credentials, _db_credentials_fetched_at
+    if (not force_refresh and _db_credentials is not None
+            and time.monotonic() - _db_credentials_fetched_at < DB_CREDENTIALS_TTL_SECONDS):
+        return _db_credentials
     secret_arn = os.environ['DB_SECRET_ARN']
     response = secretsmanager.get_secret_value(SecretId=secret_arn)
-    return json.loads(response['SecretString'])
+    _db_credentials = json.loads(response['SecretString'])
+    _db_credentials_fetched_at = time.monotonic()
+    return _db_credentials
 
 def get_db_connection(credentials):
     return psycopg2.connect(
@@ -22,112 +92,788 @@ def get_db_connection(credentials):
         database='sdr'
     )
 
-def generate_embedding(text):
-    response = bedrock.invoke_model(
-        modelId='amazon.titan-embed-text-v1',
-        body=json.dumps({'inputText': text})
+def _discard_db_connection():
+    global _db_connection
+    if _db_connection is not None and not _db_connection.closed:
+        try:
+            _db_connection.close()
+        except psycopg2.Error:
+            pass
+    _db_connection = None
+
+def _db_connection_is_healthy(conn):
+    if conn.closed:
+        return False
+    if time.monotonic() - _db_connection_used_at < DB_HEALTHCHECK_IDLE_SECONDS:
+        return True
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+def acquire_db_connection():
+    global _db_connection
+    if _db_connection is not None and _db_connection_is_healthy(_db_connection):
+        return _db_connection
+    _discard_db_connection()
+    try:
+        _db_connection = get_db_connection(get_db_credentials())
+    except psycopg2.OperationalError:
+        # The secret may have been rotated since it was cached
+        logger.warning("Database connection failed, refreshing credentials and retrying.")
+        _db_connection = get_db_connection(get_db_credentials(force_refresh=True))
+    return _db_connection
+
+@contextmanager
+def db_connection():
+    # Yields the warm connection; any transaction left open is rolled back on
+    # exit and a connection that failed at the driver level is dropped.
+    global _db_connection_used_at
+    conn = acquire_db_connection()
+    try:
+        yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        _discard_db_connection()
+        raise
+    finally:
+        if not conn.closed:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                _discard_db_connection()
+        _db_connection_used_at = time.monotonic()
+
+EMBEDDING_MODEL_ID = 'amazon.titan-embed-text-v1'
+
+def embedding_cache_key(text):
+    # Shares embedding_cache with EmbeddingGenerator, keyed by model and normalized text hash
+    text = " ".join(text.split())
+    return text, hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def generate_embedding(cur, text):
+    text, digest = embedding_cache_key(text)
+    cur.execute(
+        """
+        UPDATE embedding_cache
+        SET hit_count = hit_count + 1, last_used_at = now()
+        WHERE model_id = %s AND content_hash = %s
+        RETURNING embedding::text
+        """,
+        (EMBEDDING_MODEL_ID, digest)
     )
-    response_body = json.loads(response['body'].read())
-    return response_body['embedding']
+    row = cur.fetchone()
+    if row:
+        logger.info("Embedding cache hit for query.")
+        return json.loads(row[0])
 
-def extract_identifier(query):
-    # Regex to find numbers, could be improved for specific formats
-    match = re.search(r'\d+', query)
-    return match.group(0) if match else None
+    logger.info("Embedding cache miss for query.")
+    embedding = bedrock.embed(EMBEDDING_MODEL_ID, text)
+    cur.execute(
+        """
+        INSERT INTO embedding_cache (model_id, content_hash, embedding) VALUES (%s, %s, %s::vector)
+        ON CONFLICT (model_id, content_hash) DO UPDATE SET last_used_at = now()
+        """,
+        (EMBEDDING_MODEL_ID, digest, embedding)
+    )
+    return embedding
 
-def handler(event, context):
-    credentials = get_db_credentials()
-    conn = get_db_connection(credentials)
-    
-    body = json.loads(event['body'])
-    query = body['query']
-    
-    conversation_id = (event.get('pathParameters') or {}).get('conversation_id')
+def request_int(body, name, default, maximum):
+    # A per-request override clamped to 1..maximum, or the default when absent.
+    # Raises ValueError (answered with a 400) when it is not an integer.
+    value = body.get(name)
+    if value is None:
+        return default
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError(f'"{name}" must be an integer')
+    try:
+        value = int(value)
+    except ValueError:
+        raise ValueError(f'"{name}" must be an integer') from None
+    return min(max(value, 1), maximum)
+
+def rerank_candidates(body):
+    return request_int(body, 'rerank_candidates', RERANK_CANDIDATES, SEARCH_PARAM_MAX)
+
+def search_params(body):
+    # (ef_search, probes) for this request, validated and clamped
+    ef_search = request_int(body, 'ef_search', HNSW_EF_SEARCH, SEARCH_PARAM_MAX)
+    if VECTOR_QUANTIZATION != 'none':
+        # An HNSW scan returns at most ef_search rows
+        ef_search = min(max(ef_search, rerank_candidates(body)), SEARCH_PARAM_MAX)
+    probes = request_int(body, 'probes', IVFFLAT_PROBES, IVFFLAT_LISTS)
+    return ef_search, probes
+
+def check_request(body):
+    # Rejects malformed search overrides and filters before the turn touches the
+    # database; returns the explicit filters for prepare_turn
+    if not isinstance(body, dict):
+        raise ValueError('Request body must be a JSON object')
+    search_params(body)
+    return request_filters(body)
+
+def set_search_params(cur, body):
+    # SET LOCAL only lasts for the current transaction
+    ef_search, probes = search_params(body)
+    cur.execute("SELECT set_config('hnsw.ef_search', %s, true), set_config('ivfflat.probes', %s, true)",
+                (str(ef_search), str(probes)))
+
+# Distance on the quantized vectors, written exactly like the index expressions
+# of the pgvector enabler so the planner uses the index
+QUANTIZED_DISTANCES = {
+    'halfvec': "(embedding::halfvec(1536)) <-> ({query_vector})::halfvec(1536)",
+    'binary': "(binary_quantize(embedding)::bit(1536)) <~> binary_quantize({query_vector})",
+}
+
+def nearest_sql(columns, query_vector, where, limit):
+    # Rows of document_embeddings nearest to query_vector by exact L2 distance,
+    # as "columns, distance". With a quantized index the candidates come from
+    # the quantized distance and are re-ranked on the full-precision vectors.
+    if VECTOR_QUANTIZATION == 'none':
+        return f"""SELECT {columns}, embedding <-> {query_vector} AS distance
+        FROM document_embeddings
+        WHERE {where}
+        ORDER BY distance
+        LIMIT {limit}"""
+    quantized_distance = QUANTIZED_DISTANCES[VECTOR_QUANTIZATION].format(query_vector=query_vector)
+    return f"""SELECT {columns}, embedding <-> {query_vector} AS distance
+        FROM (
+            SELECT {columns}, embedding
+            FROM document_embeddings
+            WHERE {where}
+            ORDER BY {quantized_distance}
+            LIMIT GREATEST(%(rerank_candidates)s, {limit})
+        ) candidates
+        ORDER BY distance
+        LIMIT {limit}"""
+
+HYBRID_SEARCH_SQL = """
+WITH query_embedding AS (
+    SELECT COALESCE(
+        %(embedding)s::vector,
+        (SELECT embedding FROM embedding_cache WHERE model_id = %(model_id)s AND content_hash = %(digest)s)
+    ) AS embedding
+),
+lexical AS (
+    SELECT id, row_number() OVER (ORDER BY text_rank DESC, id) AS rank, all_terms
+    FROM (
+        SELECT id,
+               ts_rank_cd(chunk_tsv, to_tsquery('english', %(any_terms)s)) AS text_rank,
+               chunk_tsv @@ websearch_to_tsquery('english', %(query)s) AS all_terms
+        FROM document_embeddings
+        WHERE chunk_tsv @@ to_tsquery('english', %(any_terms)s){filters}
+        ORDER BY text_rank DESC, id
+        LIMIT %(candidates)s
+    ) matches
+),
+semantic AS (
+    SELECT id, row_number() OVER (ORDER BY distance, id) AS rank
+    FROM (
+        -- A scalar subquery keeps the ANN index usable for the ordering
+        {nearest}
+    ) nearest
+)
+SELECT e.chunk_text,
+       COALESCE(1.0 / (%(rrf_k)s + l.rank), 0) + COALESCE(1.0 / (%(rrf_k)s + s.rank), 0) AS score,
+       l.rank AS lexical_rank,
+       s.rank AS semantic_rank,
+       COALESCE(l.all_terms, false) AS all_terms,
+       e.id
+FROM lexical l
+FULL OUTER JOIN semantic s ON s.id = l.id
+JOIN document_embeddings e ON e.id = COALESCE(l.id, s.id)
+ORDER BY score DESC, e.id
+LIMIT %(k)s
+"""
+
+def filter_clause(filters):
+    # " AND ..." conditions for the given filters; named parameters match the filter keys
+    return "".join(f" AND {condition}" for name, condition in FILTER_CONDITIONS.items() if filters.get(name))
+
+def hybrid_search(cur, query, embedding=None, filters=None, rerank=None):
+    # Full-text (GIN) and nearest-neighbour candidates fused with reciprocal-rank
+    # fusion in one statement. Without an embedding argument the ANN side uses
+    # the cached query embedding if there is one, and is skipped otherwise.
+    # Filters apply to both candidate lists, before their LIMIT.
+    # Returns (chunk_text, score, lexical_rank, semantic_rank, all_terms, id) rows.
+    filters = filters or {}
+    _, digest = embedding_cache_key(query)
+    terms = re.findall(r'\w+', query.lower())
+    where = filter_clause(filters)
+    nearest = nearest_sql("id", "(SELECT embedding FROM query_embedding)",
+                          f"(SELECT embedding FROM query_embedding) IS NOT NULL{where}", "%(candidates)s")
+    cur.execute(HYBRID_SEARCH_SQL.format(filters=where, nearest=nearest), {
+        **filters,
+        'query': query,
+        'any_terms': ' | '.join(terms),
+        'embedding': embedding,
+        'model_id': EMBEDDING_MODEL_ID,
+        'digest': digest,
+        'candidates': HYBRID_CANDIDATES,
+        'rrf_k': RRF_K,
+        'k': RETRIEVAL_TOP_K,
+        'rerank_candidates': rerank or RERANK_CANDIDATES,
+    })
+    return cur.fetchall()
+
+def vector_search(cur, query_embedding, body, filters=None):
+    filters = filters or {}
+    set_search_params(cur, body)
+    nearest = nearest_sql("id, chunk_text", "%(embedding)s::vector", f"true{filter_clause(filters)}", "%(k)s")
+    cur.execute(f"""
+    SELECT id, chunk_text
+    FROM ({nearest}) nearest
+    ORDER BY distance;
+    """, {**filters, 'embedding': query_embedding, 'k': RETRIEVAL_TOP_K, 'rerank_candidates': rerank_candidates(body)})
+    return cur.fetchall()
+
+def retrieve_chunks(cur, query, body, filters=None):
+    # Returns (chunk_id, chunk_text) pairs like every retrieval path, and the
+    # query embedding when one was fetched here (None when hybrid retrieval
+    # used the cached embedding inside its SQL or did without one)
+    if not HYBRID_RETRIEVAL:
+        query_embedding = generate_embedding(cur, query)
+        return vector_search(cur, query_embedding, body, filters), query_embedding
+    set_search_params(cur, body)
+    rerank = rerank_candidates(body)
+    query_embedding = None
+    rows = hybrid_search(cur, query, filters=filters, rerank=rerank)
+    lexical_only = all(row[3] is None for row in rows)
+    if not rows or (lexical_only and not any(row[4] for row in rows)):
+        # No cached query embedding and no chunk matching every query term
+        query_embedding = generate_embedding(cur, query)
+        rows = hybrid_search(cur, query, query_embedding, filters, rerank)
+    elif lexical_only:
+        logger.info("Full-text match on every query term, skipping the query embedding.")
+    logger.info("Hybrid retrieval scores: " + json.dumps([
+        {'score': round(float(score), 5), 'lexical_rank': lexical_rank, 'semantic_rank': semantic_rank}
+        for _, score, lexical_rank, semantic_rank, _, _ in rows
+    ]))
+    return [(row[5], row[0]) for row in rows], query_embedding
+
+# Northwind order IDs are five digits in the 10248-11077 range, optionally written "#10718"
+ORDER_ID_PATTERN = re.compile(r'(?<![\d.,-])#?(1[01]\d{3})(?![\d.,-]\d)')
+# Customer IDs are five-letter codes (e.g. KOENE) and only recognised after "customer"
+CUSTOMER_ID_PATTERN = re.compile(r'\bcustomer(?:\s+id)?\s*[:#]?\s*([a-z]{5})\b', re.IGNORECASE)
+CUSTOMER_ID_STOPWORDS = {'where', 'which', 'whose', 'order', 'total', 'named', 'about'}
+DOCUMENT_TYPE_HINTS = [
+    (re.compile(r'\bshipping\s+orders?\b|\bshipments?\b', re.IGNORECASE), 'shipping_order'),
+    (re.compile(r'\bpurchase\s+orders?\b|\bPOs?\b'), 'purchase_order'),
+    (re.compile(r'\binvoices?\b', re.IGNORECASE), 'invoice'),
+    (re.compile(r'\b(?:inventory|stock)\s+reports?\b', re.IGNORECASE), 'inventory_report'),
+]
+# Metadata filters on document_embeddings, from the request's "filters" object or
+# inferred from the question. document_type is the partition key, so filtering
+# on it only scans (and ANN-searches) that type's partition.
+FILTER_CONDITIONS = {
+    'document_type': "document_type = %(document_type)s",
+    # The stored customer is the ID, else the customer or ship name. Other
+    # documents naming the same customer link its ID and names, so a filter on
+    # either matches documents that stored the other.
+    'customer': """(customer = %(customer)s OR customer IN (
+        SELECT alias.field_value
+        FROM document_fields named
+        JOIN document_fields alias ON alias.document_id = named.document_id
+            AND alias.field_name IN ('customer_id', 'customer_name', 'ship_name')
+        WHERE named.field_name IN ('customer_id', 'customer_name', 'ship_name')
+          AND named.field_value = %(customer)s
+    ))""",
+    'date_from': "document_date >= %(date_from)s",
+    'date_to': "document_date <= %(date_to)s",
+}
+ISO_DATE_PATTERN = re.compile(r'\b(\d{4})-(\d{2})-(\d{2})\b')
+MONTHS = {name.lower(): number for number, name in enumerate(calendar.month_name) if name}
+MONTH_PATTERN = re.compile(
+    r'\b(?:(' + '|'.join(MONTHS) + r')\s+((?:19|20)\d{2})|((?:19|20)\d{2})-(\d{2}))\b', re.IGNORECASE
+)
+# A bare number like 2000 is only a year after a date preposition ("in 2017",
+# "during 1997") and not when it is followed by a quantity ("for 2000 units")
+YEAR_PATTERN = re.compile(
+    r'\b(?:in|during|for|from|since|year)\s+((?:19|20)\d{2})\b'
+    r'(?![\d.,]\d|\s*(?:units?|items?|pieces?|boxes|cases|dollars|usd|eur|%))',
+    re.IGNORECASE
+)
+
+def normalize_field_value(value):
+    # Must match EmbeddingGenerator's normalization of stored document_fields
+    return str(value).strip().lstrip('#').lower()
+
+def parse_identifiers(query):
+    fields = []
+    for match in ORDER_ID_PATTERN.finditer(query):
+        fields.append(('order_id', match.group(1)))
+    for match in CUSTOMER_ID_PATTERN.finditer(query):
+        if match.group(1).lower() not in CUSTOMER_ID_STOPWORDS:
+            fields.append(('customer_id', normalize_field_value(match.group(1))))
+    document_type = next((doc_type for pattern, doc_type in DOCUMENT_TYPE_HINTS if pattern.search(query)), None)
+    return fields, document_type
+
+def infer_date_range(query):
+    # (date_from, date_to) for the first day, month or year mentioned, else (None, None)
+    match = ISO_DATE_PATTERN.search(query)
+    if match:
+        try:
+            day = date(*map(int, match.groups()))
+            return day, day
+        except ValueError:
+            pass
+    match = MONTH_PATTERN.search(query)
+    if match:
+        month_name, year, iso_year, iso_month = match.groups()
+        year, month = (int(year), MONTHS[month_name.lower()]) if month_name else (int(iso_year), int(iso_month))
+        if 1 <= month <= 12:
+            return date(year, month, 1), date(year, month, calendar.monthrange(year, month)[1])
+    match = YEAR_PATTERN.search(query)
+    if match:
+        year = int(match.group(1))
+        return date(year, 1, 1), date(year, 12, 31)
+    return None, None
+
+def infer_filters(query, fields, document_type):
+    filters = {'document_type': document_type}
+    filters['customer'] = next((value for name, value in fields if name == 'customer_id'), None)
+    filters['date_from'], filters['date_to'] = infer_date_range(query)
+    return {name: value for name, value in filters.items() if value}
+
+def request_filters(body):
+    # Explicit filters: {"document_type", "customer", "date_from", "date_to"}; dates are ISO strings.
+    # Raises ValueError (answered with a 400) for anything else.
+    filters = {}
+    requested = body.get('filters') or {}
+    if not isinstance(requested, dict):
+        raise ValueError('"filters" must be an object')
+    for name, value in requested.items():
+        if name not in FILTER_CONDITIONS or value in (None, ''):
+            continue
+        if name in ('date_from', 'date_to'):
+            try:
+                filters[name] = date.fromisoformat(str(value))
+            except ValueError:
+                raise ValueError(f'"filters.{name}" must be an ISO date (YYYY-MM-DD)') from None
+        elif name == 'customer':
+            filters[name] = normalize_field_value(value)
+        else:
+            filters[name] = str(value)
+    return filters
+
+def lookup_chunks_by_fields(cur, fields, document_type=None):
+    # Exact B-tree lookups on document_fields, then the matching documents' chunks
+    sql = """
+    SELECT e.id, e.chunk_text
+    FROM document_fields f
+    JOIN document_embeddings e ON e.document_id = f.document_id
+    WHERE (f.field_name, f.field_value) IN %s
+    """
+    params = [tuple(fields)]
+    if document_type:
+        sql += " AND f.document_type = %s"
+        params.append(document_type)
+    sql += " ORDER BY e.document_id, e.id"
+    cur.execute(sql, params)
+    results = cur.fetchall()
+    if not results and document_type:
+        # The type hint may be wrong (e.g. "invoice" for a shipping order); retry without it
+        return lookup_chunks_by_fields(cur, fields)
+    return results
+
+def ilike_chunks(cur, identifier):
+    # Sequential scan for the identifier anywhere in the chunk text
+    cur.execute("SELECT id, chunk_text FROM document_embeddings WHERE chunk_text ILIKE %s", (f'%{identifier}%',))
+    return cur.fetchall()
+
+def estimate_tokens(text):
+    # Roughly four characters per token for English text
+    return max(1, (len(text) + 3) // 4)
+
+def trim_to_token_budget(texts, budget):
+    kept, used = [], 0
+    for text in texts:
+        tokens = estimate_tokens(text)
+        if kept and used + tokens > budget:
+            break
+        kept.append(text)
+        used += tokens
+    return kept
+
+def save_message(cur, conversation_id, role, content, token_count):
+    # clock_timestamp() keeps the user and assistant messages of one turn in order
+    cur.execute(
+        """
+        INSERT INTO conversation_messages (conversation_id, role, content, token_count, created_at)
+        VALUES (%s, %s, %s, %s, clock_timestamp())
+        """,
+        (conversation_id, role, content, token_count)
+    )
+
+def invoke_claude(prompt, max_tokens):
+    return bedrock.complete(os.environ['BEDROCK_MODEL_ID'], prompt, max_tokens)
+
+def stream_claude(prompt, max_tokens, usage):
+    # Yields text deltas as Bedrock produces them; token usage is written into `usage`
+    return bedrock.stream(os.environ['BEDROCK_MODEL_ID'], prompt, max_tokens, usage)
+
+def format_turns(turns):
+    return "\n".join(f"{role.capitalize()}: {content}" for role, content, _, _ in turns)
+
+def summarize_turns(summary, turns):
+    prompt = (
+        "Update the running summary of a conversation between a user and a document assistant "
+        "with the new turns below. Keep order IDs, customer names, amounts and dates that were discussed. "
+        "Reply with the updated summary only.\n\n"
+        f"Current summary:\n{summary or '(none)'}\n\nNew turns:\n{format_turns(turns)}"
+    )
+    updated, _ = invoke_claude(prompt, SUMMARY_MAX_TOKENS)
+    return updated.strip()
 
-    with conn.cursor() as cur:
-        if conversation_id:
-            # Retrieve conversation history
-            cur.execute("SELECT content FROM conversation_messages WHERE conversation_id = %s ORDER BY created_at", (conversation_id,))
-            history = [row[0] for row in cur.fetchall()]
-            context = "\n".join(history)
+def load_conversation_context(cur, conversation_id):
+    # Returns (summary, recent_turns). Recent turns fit HISTORY_TOKEN_BUDGET plus at
+    # most SUMMARY_BATCH_TOKENS of slack; once the slack is used up the overflow is
+    # folded into the stored rolling summary so prompt size stays flat.
+    cur.execute("SELECT context FROM conversations WHERE id = %s", (conversation_id,))
+    row = cur.fetchone()
+    state = (row[0] if row else None) or {}
+    summary = state.get('summary', '')
+
+    cur.execute(
+        """
+        SELECT role, content, token_count, created_at
+        FROM conversation_messages
+        WHERE conversation_id = %s AND created_at > COALESCE(%s::timestamptz, '-infinity')
+        ORDER BY created_at DESC, id DESC
+        LIMIT %s
+        """,
+        (conversation_id, state.get('summarized_until'), HISTORY_MAX_MESSAGES)
+    )
+    turns = [
+        (role, content, token_count or estimate_tokens(content), created_at)
+        for role, content, token_count, created_at in cur.fetchall()
+    ]
+
+    recent, overflow, used = [], [], 0
+    for turn in turns:
+        if not overflow and used + turn[2] <= HISTORY_TOKEN_BUDGET:
+            recent.append(turn)
+            used += turn[2]
         else:
-            # Create new conversation
-            conversation_id = str(uuid.uuid4())
-            cur.execute("INSERT INTO conversations (id) VALUES (%s)", (conversation_id,))
-            context = ""
+            overflow.append(turn)
 
-        # Save user message
+    # A full read may have left older unsummarized messages behind
+    truncated = len(turns) == HISTORY_MAX_MESSAGES
+    if not truncated and sum(turn[2] for turn in overflow) <= SUMMARY_BATCH_TOKENS:
+        return summary, list(reversed(turns))
+
+    # Fold everything older than the recent turns, oldest first and one page of
+    # HISTORY_MAX_MESSAGES at a time, so no message is skipped past the cap
+    until, bound = (recent[-1][3], "<") if recent else (turns[0][3], "<=")
+    folded_until, folded = state.get('summarized_until'), 0
+    while True:
         cur.execute(
-            "INSERT INTO conversation_messages (conversation_id, role, content) VALUES (%s, %s, %s)",
-            (conversation_id, 'user', query)
+            f"""
+            SELECT role, content, token_count, created_at
+            FROM conversation_messages
+            WHERE conversation_id = %s AND created_at > COALESCE(%s::timestamptz, '-infinity')
+              AND created_at {bound} %s
+            ORDER BY created_at, id
+            LIMIT %s
+            """,
+            (conversation_id, folded_until, until, HISTORY_MAX_MESSAGES)
         )
+        page = [
+            (role, content, token_count or estimate_tokens(content), created_at)
+            for role, content, token_count, created_at in cur.fetchall()
+        ]
+        if not page:
+            break
+        summary = summarize_turns(summary, page)
+        folded_until, folded = page[-1][3], folded + len(page)
+        if len(page) < HISTORY_MAX_MESSAGES:
+            break
+    if not folded:
+        return summary, list(reversed(recent))
 
-        results = []
-        identifier = extract_identifier(query)
-        if identifier:
-            cur.execute("SELECT chunk_text FROM document_embeddings WHERE chunk_text ILIKE %s", (f'%{identifier}%',))
-            results = [row[0] for row in cur.fetchall()]
+    state.update({
+        'summary': summary,
+        'summary_tokens': estimate_tokens(summary),
+        'summarized_until': folded_until.isoformat(),
+    })
+    cur.execute(
+        "UPDATE conversations SET context = %s::jsonb, updated_at = now() WHERE id = %s",
+        (json.dumps(state), conversation_id)
+    )
+    logger.info(f"Folded {folded} messages into the summary of conversation {conversation_id}.")
+    return summary, list(reversed(recent))
 
-        if not results:
-            query_embedding = generate_embedding(query)
-            cur.execute("""
-            SELECT chunk_text
-            FROM document_embeddings
-            ORDER BY embedding <-> %s::vector
-            LIMIT 5;
-            """, (query_embedding,))
-            results = [row[0] for row in cur.fetchall()]
+def build_prompt(summary, turns, chunks, query):
+    sections = ["You are a helpful assistant. Please answer the following question based on the provided context."]
+    if summary:
+        sections.append(f"Conversation summary:\n{summary}")
+    if turns:
+        sections.append(f"Recent conversation:\n{format_turns(turns)}")
+    sections.append("Context:\n" + "\n".join(trim_to_token_budget(chunks, RETRIEVAL_TOKEN_BUDGET)))
+    sections.append(f"Question: {query}")
+    return "\n\n".join(sections)
 
-        if not results and identifier:
-            completion = f"I couldn't find invoice {identifier}."
-        else:
-            context += "\n" + "\n".join(results)
-
-            messages = [
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": f"You are a helpful assistant. Please answer the following question based on the provided context.\n\nContext:\n{context}\n\nQuestion: {query}"
-                        }
-                    ]
-                }
-            ]
-
-            bedrock_request_body = {
-                "anthropic_version": "bedrock-2023-05-31",
-                "messages": messages,
-                "max_tokens": 500
-            }
-
-            response = bedrock.invoke_model(
-                modelId=os.environ['BEDROCK_MODEL_ID'],
-                contentType="application/json",
-                accept="application/json",
-                body=json.dumps(bedrock_request_body)
-            )
-
-            response_body = json.loads(response['body'].read())
-            
-            completion = ""
-            for content_block in response_body['content']:
-                if content_block['type'] == 'text':
-                    completion += content_block['text']
-
-        # Save assistant message
+def evidence_fingerprint(chunk_ids):
+    # Changes when any retrieved chunk is replaced (re-ingested chunks get new IDs) or the model changes
+    evidence = f"{os.environ.get('BEDROCK_MODEL_ID')}:{','.join(str(chunk_id) for chunk_id in sorted(chunk_ids))}"
+    return hashlib.sha256(evidence.encode('utf-8')).hexdigest()
+
+def lookup_cached_answer(cur, question, embedding, evidence_hash):
+    # The closest earlier question answered from the same evidence, if similar
+    # enough and not expired: (answer, generation_ms, similarity) or None.
+    # Without a query embedding only the same question text is a match.
+    params = {'question': question, 'embedding': embedding, 'evidence_hash': evidence_hash,
+              'ttl_hours': ANSWER_CACHE_TTL_HOURS}
+    if embedding is None:
         cur.execute(
-            "INSERT INTO conversation_messages (conversation_id, role, content) VALUES (%s, %s, %s)",
-            (conversation_id, 'assistant', completion)
+            """
+            SELECT id, answer, generation_ms, 1.0 AS similarity
+            FROM answer_cache
+            WHERE evidence_hash = %(evidence_hash)s AND question = %(question)s
+              AND created_at > now() - make_interval(hours => %(ttl_hours)s)
+            ORDER BY created_at DESC
+            LIMIT 1
+            """,
+            params
         )
-        conn.commit()
+    else:
+        cur.execute(
+            """
+            SELECT id, answer, generation_ms, 1 - (question_embedding <=> %(embedding)s::vector) AS similarity
+            FROM answer_cache
+            WHERE evidence_hash = %(evidence_hash)s AND question_embedding IS NOT NULL
+              AND created_at > now() - make_interval(hours => %(ttl_hours)s)
+            ORDER BY question_embedding <=> %(embedding)s::vector
+            LIMIT 1
+            """,
+            params
+        )
+    row = cur.fetchone()
+    if not row or row[3] < ANSWER_CACHE_SIMILARITY:
+        return None
+    cur.execute(
+        "UPDATE answer_cache SET hit_count = hit_count + 1, last_used_at = now() WHERE id = %s", (row[0],)
+    )
+    return row[1], row[2], row[3]
+
+def store_cached_answer(cur, cache, answer, generation_ms, output_tokens):
+    cur.execute(
+        "DELETE FROM answer_cache WHERE created_at < now() - make_interval(hours => %s)", (ANSWER_CACHE_TTL_HOURS,)
+    )
+    cur.execute(
+        """
+        INSERT INTO answer_cache
+            (question, question_embedding, evidence_hash, chunk_ids, answer, generation_ms, output_tokens)
+        VALUES (%s, %s::vector, %s, %s, %s, %s, %s)
+        """,
+        (cache['question'], cache['embedding'], cache['evidence_hash'], cache['chunk_ids'],
+         answer, round(generation_ms), output_tokens)
+    )
+
+def check_answer_cache(cur, query, query_embedding, results, fields, summary, turns):
+    # Returns (cached answer or None, cache state for finish_turn). Only turns
+    # that do not depend on earlier ones are cached: no conversation history in
+    # the prompt, or a question naming an order or customer ID. The query
+    # embedding is the one retrieval already fetched; no embedding is requested
+    # here, so without one the lookup matches the question text exactly.
+    if not ANSWER_CACHE_ENABLED or not results or ((summary or turns) and not fields):
+        return None, None
+    chunk_ids = [chunk_id for chunk_id, _ in results]
+    cache = {
+        'question': embedding_cache_key(query)[0],
+        'embedding': query_embedding,
+        'evidence_hash': evidence_fingerprint(chunk_ids),
+        'chunk_ids': chunk_ids,
+    }
+    with telemetry.timed("AnswerCacheLookupLatency"):
+        hit = lookup_cached_answer(cur, cache['question'], cache['embedding'], cache['evidence_hash'])
+    telemetry.put_metric("AnswerCacheHit", 1 if hit else 0)
+    if not hit:
+        return None, cache
+    answer, generation_ms, similarity = hit
+    logger.info(f"Answer cache hit (similarity {similarity:.4f}), skipping {generation_ms} ms of generation.")
+    telemetry.put_metric("AnswerCacheLatencySaved", generation_ms, "Milliseconds")
+    return answer, {**cache, 'hit': True}
+
+def prepare_turn(cur, body, conversation_id, explicit=None):
+    # Records the user message and retrieves context. Returns the conversation
+    # ID, either a prompt for Claude or a ready-made completion, and the answer
+    # cache state to pass to finish_turn (None when the turn is not cached).
+    # `explicit` holds the request's filters as parsed by check_request.
+    query = body['query']
+
+    if conversation_id:
+        # Rolling summary plus the recent turns that fit the history budget
+        summary, turns = load_conversation_context(cur, conversation_id)
+    else:
+        # Create new conversation
+        conversation_id = str(uuid.uuid4())
+        cur.execute("INSERT INTO conversations (id) VALUES (%s)", (conversation_id,))
+        summary, turns = "", []
+
+    # Save user message
+    save_message(cur, conversation_id, 'user', query, estimate_tokens(query))
+
+    results, query_embedding = [], None
+    fields, document_type = parse_identifiers(query)
+    identifier = fields[0][1] if fields else None
+    if fields:
+        results = lookup_chunks_by_fields(cur, fields, document_type)
+        logger.info(f"Field index lookup for {fields} (type hint: {document_type}) returned {len(results)} chunks.")
+    if fields and not results and IDENTIFIER_ILIKE_FALLBACK:
+        results = ilike_chunks(cur, identifier)
 
+    if not results:
+        explicit = explicit or {}
+        filters = {**infer_filters(query, fields, document_type), **explicit}
+        results, query_embedding = retrieve_chunks(cur, query, body, filters)
+        if not results and filters != explicit:
+            # An inferred filter may be wrong (e.g. a year that is not an order date); keep only explicit ones
+            logger.info(f"No chunks matched filters {filters}; retrying with {explicit}.")
+            results, query_embedding = retrieve_chunks(cur, query, body, explicit)
+
+    if not results and identifier:
+        return conversation_id, None, f"I couldn't find {(document_type or 'document').replace('_', ' ')} {identifier}.", None
+
+    answer, cache = check_answer_cache(cur, query, query_embedding, results, fields, summary, turns)
+    if answer is not None:
+        return conversation_id, None, answer, cache
+    return conversation_id, build_prompt(summary, turns, [text for _, text in results], query), None, cache
+
+def finish_turn(cur, conversation_id, completion, usage, cache=None, generation_ms=None):
+    completion_tokens = usage.get('output_tokens') or estimate_tokens(completion)
+    if 'input_tokens' in usage:
+        logger.info(f"Prompt tokens: {usage['input_tokens']}, completion tokens: {completion_tokens}")
+    # Save assistant message
+    save_message(cur, conversation_id, 'assistant', completion, completion_tokens)
+    # Orders the conversation listing by last activity
+    cur.execute("UPDATE conversations SET updated_at = now() WHERE id = %s", (conversation_id,))
+    if cache and not cache.get('hit') and generation_ms is not None:
+        store_cached_answer(cur, cache, completion, generation_ms, completion_tokens)
+
+def encode_cursor(timestamp, row_id):
+    # Opaque keyset cursor: the (timestamp, id) of the last row of a page
+    return base64.urlsafe_b64encode(json.dumps([timestamp.isoformat(), str(row_id)]).encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor):
+    # Raises ValueError for a cursor this handler did not issue
+    try:
+        timestamp, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return datetime.fromisoformat(timestamp), str(uuid.UUID(row_id))
+    except (TypeError, ValueError):
+        raise ValueError("Invalid cursor") from None
+
+def page_limit(params):
+    try:
+        limit = int(params.get('limit') or HISTORY_PAGE_SIZE)
+    except ValueError:
+        raise ValueError("Invalid limit") from None
+    return max(1, min(limit, HISTORY_PAGE_MAX))
+
+def list_conversations(cur, limit, cursor=None):
+    # Most recently active first. Keyset pagination on conversations_updated_at_idx
+    # reads limit + 1 index entries whatever the page number.
+    after = "WHERE (updated_at, id) < (%s::timestamptz, %s::uuid)" if cursor else ""
+    cur.execute(f"""
+        SELECT id, topic, status, created_at, updated_at
+        FROM conversations
+        {after}
+        ORDER BY updated_at DESC, id DESC
+        LIMIT %s
+        """, (*(cursor or ()), limit + 1))
+    rows = cur.fetchall()
     return {
-        'statusCode': 200,
-        'headers': {
-            'Access-Control-Allow-Origin': '*',
-            'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token',
-            'Access-Control-Allow-Methods': 'OPTIONS,POST,GET'
-        },
-        'body': json.dumps({'response': completion, 'conversation_id': conversation_id})
+        'conversations': [
+            {'conversation_id': str(row_id), 'topic': topic, 'status': status,
+             'created_at': created_at.isoformat(), 'updated_at': updated_at.isoformat()}
+            for row_id, topic, status, created_at, updated_at in rows[:limit]
+        ],
+        'next_cursor': encode_cursor(rows[limit - 1][4], rows[limit - 1][0]) if len(rows) > limit else None,
     }
+
+def list_messages(cur, conversation_id, limit, cursor=None):
+    # The newest page first, older pages through next_cursor; each page is in
+    # chronological order. Served from conversation_messages_conversation_created_idx.
+    # Returns None for an unknown conversation.
+    cur.execute("SELECT 1 FROM conversations WHERE id = %s", (conversation_id,))
+    if cur.fetchone() is None:
+        return None
+    before = "AND (created_at, id) < (%s::timestamptz, %s::uuid)" if cursor else ""
+    cur.execute(f"""
+        SELECT id, role, content, token_count, created_at
+        FROM conversation_messages
+        WHERE conversation_id = %s {before}
+        ORDER BY created_at DESC, id DESC
+        LIMIT %s
+        """, (conversation_id, *(cursor or ()), limit + 1))
+    rows = cur.fetchall()
+    return {
+        'conversation_id': conversation_id,
+        'messages': [
+            {'message_id': str(row_id), 'role': role, 'content': content,
+             'token_count': token_count, 'created_at': created_at.isoformat()}
+            for row_id, role, content, token_count, created_at in reversed(rows[:limit])
+        ],
+        'next_cursor': encode_cursor(rows[limit - 1][4], rows[limit - 1][0]) if len(rows) > limit else None,
+    }
+
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token',
+    'Access-Control-Allow-Methods': 'OPTIONS,POST,GET'
+}
+
+def response(body, status_code=200):
+    return {'statusCode': status_code, 'headers': CORS_HEADERS, 'body': json.dumps(body)}
+
+def history_handler(event):
+    # GET /conversations and GET /conversations/{conversation_id}/messages
+    params = event.get('queryStringParameters') or {}
+    conversation_id = (event.get('pathParameters') or {}).get('conversation_id')
+    try:
+        limit = page_limit(params)
+        cursor = decode_cursor(params['cursor']) if params.get('cursor') else None
+    except ValueError as e:
+        return response({'message': str(e)}, 400)
+    if conversation_id:
+        try:
+            conversation_id = str(uuid.UUID(conversation_id))
+        except ValueError:
+            return response({'message': 'Conversation not found'}, 404)
+
+    with db_connection() as conn, conn.cursor() as cur:
+        if conversation_id is None:
+            return response(list_conversations(cur, limit, cursor))
+        page = list_messages(cur, conversation_id, limit, cursor)
+    if page is None:
+        return response({'message': 'Conversation not found'}, 404)
+    return response(page)
+
+def handler(event, context):
+    if event.get('httpMethod') == 'GET':
+        return history_handler(event)
+    body = json.loads(event['body'])
+    conversation_id = (event.get('pathParameters') or {}).get('conversation_id')
+    try:
+        explicit = check_request(body)
+    except ValueError as e:
+        return response({'message': str(e)}, 400)
+
+    with telemetry.invocation("chat-query-handler", conversation_id=conversation_id), \
+            db_connection() as conn, conn.cursor() as cur:
+        conversation_id, prompt, completion, cache = prepare_turn(cur, body, conversation_id, explicit)
+        usage, generation_ms = {}, None
+        if prompt is not None:
+            started = time.perf_counter()
+            completion, usage = invoke_claude(prompt, MAX_TOKENS)
+            generation_ms = (time.perf_counter() - started) * 1000
+        finish_turn(cur, conversation_id, completion, usage, cache, generation_ms)
+        conn.commit()
+
+    return response({
+        'response': completion,
+        'conversation_id': conversation_id,
+        'cached': bool(cache and cache.get('hit'))
+    })
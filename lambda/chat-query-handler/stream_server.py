@@ -0,0 +1,136 @@
+import json
+import logging
+import os
+import re
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import app
+
+# Streaming entry point for ChatQueryHandler. Python Lambdas cannot stream a
+# response natively, so this runs behind the AWS Lambda Web Adapter in
+# response_stream mode (see Dockerfile.stream) and writes Server-Sent Events:
+#   event: start  {"conversation_id": ...}
+#   event: token  {"text": ...}            one per Bedrock text delta
+#   event: done   {"conversation_id": ..., "response": ..., "cached": ...}
+#   event: error  {"message": ...}
+# The assistant message is persisted once the stream completes.
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+PORT = int(os.environ.get("PORT", "8080"))
+STREAM_PATH = re.compile(r'^/chat(?:/(?P<conversation_id>[0-9a-fA-F-]{36}))?/stream/?$')
+
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token',
+    'Access-Control-Allow-Methods': 'OPTIONS,POST,GET'
+}
+
+
+class ChatStreamHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _send_headers(self, status, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        for name, value in CORS_HEADERS.items():
+            self.send_header(name, value)
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self._send_headers(status, 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _write_chunk(self, data):
+        # A client that disconnects mid-stream must not stop generation, so the
+        # assistant message is still persisted
+        if self.client_gone:
+            return
+        try:
+            self.wfile.write(f"{len(data):X}\r\n".encode('ascii') + data + b"\r\n")
+            self.wfile.flush()
+        except OSError:
+            self.client_gone = True
+
+    def _send_event(self, event, payload):
+        self._write_chunk(f"event: {event}\ndata: {json.dumps(payload)}\n\n".encode('utf-8'))
+
+    def do_OPTIONS(self):
+        self._send_headers(204, 'text/plain')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_GET(self):
+        # Readiness check used by the Lambda Web Adapter
+        self._send_json(200, {'status': 'ok'})
+
+    def do_POST(self):
+        match = STREAM_PATH.match(self.path.split('?', 1)[0])
+        if not match:
+            self._send_json(404, {'message': 'Not Found'})
+            return
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            body = json.loads(self.rfile.read(length) or b'{}')
+            body['query']
+        except (ValueError, KeyError, TypeError):
+            self._send_json(400, {'message': 'Request body must be JSON with a "query" field'})
+            return
+        try:
+            explicit = app.check_request(body)
+        except ValueError as e:
+            self._send_json(400, {'message': str(e)})
+            return
+
+        self.client_gone = False
+        self._send_headers(200, 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        try:
+            with app.telemetry.invocation("chat-query-handler", conversation_id=match.group('conversation_id')), \
+                    app.db_connection() as conn, conn.cursor() as cur:
+                conversation_id, prompt, completion, cache = app.prepare_turn(cur, body, match.group('conversation_id'), explicit)
+                # Persist the user turn before generation so the transaction is short
+                conn.commit()
+                self._send_event('start', {'conversation_id': conversation_id})
+
+                usage, generation_ms = {}, None
+                if prompt is None:
+                    # A fixed reply or a cached answer, sent in one piece
+                    self._send_event('token', {'text': completion})
+                else:
+                    parts = []
+                    started = time.perf_counter()
+                    for text in app.stream_claude(prompt, app.MAX_TOKENS, usage):
+                        parts.append(text)
+                        self._send_event('token', {'text': text})
+                    completion = "".join(parts)
+                    generation_ms = (time.perf_counter() - started) * 1000
+
+                app.finish_turn(cur, conversation_id, completion, usage, cache, generation_ms)
+                conn.commit()
+            self._send_event('done', {
+                'conversation_id': conversation_id,
+                'response': completion,
+                'cached': bool(cache and cache.get('hit')),
+            })
+        except Exception as e:
+            logger.error(f"Error streaming chat response: {e}", exc_info=True)
+            self._send_event('error', {'message': 'Error generating response'})
+        finally:
+            self._write_chunk(b"")
+
+    def log_message(self, format, *args):
+        logger.info(format % args)
+
+
+if __name__ == "__main__":
+    # Single-threaded on purpose: one request per Lambda execution environment
+    # and app.py keeps a single warm database connection.
+    HTTPServer(("0.0.0.0", PORT), ChatStreamHandler).serve_forever()
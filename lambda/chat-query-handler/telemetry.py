@@ -0,0 +1,179 @@
+import json
+import math
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Document-level tracing and hot-path metrics for the pipeline Lambdas. The
+# classifier starts a trace ID per uploaded document and every invoke payload
+# carries it on as "trace_id". Within an invocation, timed() and put_metric()
+# collect values (Bedrock calls, PDF parsing, DB queries, S3 operations, token
+# counts, payload sizes) that are written when the invocation ends as
+# CloudWatch Embedded Metric Format (EMF) records on stdout. CloudWatch Logs
+# turns them into metrics in the METRICS_NAMESPACE namespace with a Function
+# dimension; trace and document IDs stay plain properties of the record, so
+# Logs Insights can follow one document across stages without creating
+# high-cardinality metrics.
+#
+# The chat handler records its metrics (answer cache, Bedrock calls, latency)
+# the same way, with one trace per chat turn.
+#
+# Identical copies of this module live in lambda/classifier, lambda/extractor,
+# lambda/router, lambda/embedding-generator and lambda/chat-query-handler;
+# `make check-shared` verifies they match.
+
+NAMESPACE = os.environ.get("METRICS_NAMESPACE", "SmartDocumentRouter")
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "true").lower() == "true"
+TRACE_ID_KEY = "trace_id"
+# CloudWatch accepts at most 100 values per metric in one EMF record
+MAX_VALUES_PER_RECORD = 100
+
+_current = ContextVar("telemetry_invocation", default=None)
+
+
+class Invocation:
+    def __init__(self, function_name, trace_id, properties):
+        self.function_name = function_name
+        self.trace_id = trace_id
+        self.properties = properties
+        # name -> (unit, [values]); worker threads may add values concurrently
+        self.metrics = {}
+        self._lock = threading.Lock()
+
+    def put(self, name, value, unit):
+        with self._lock:
+            self.metrics.setdefault(name, (unit, []))[1].append(value)
+
+    def records(self):
+        timestamp = int(time.time() * 1000)
+        batches = max((math.ceil(len(values) / MAX_VALUES_PER_RECORD) for _, values in self.metrics.values()), default=0)
+        for batch in range(batches):
+            window = slice(batch * MAX_VALUES_PER_RECORD, (batch + 1) * MAX_VALUES_PER_RECORD)
+            metrics = {name: (unit, values[window]) for name, (unit, values) in self.metrics.items() if values[window]}
+            yield {
+                "_aws": {
+                    "Timestamp": timestamp,
+                    "CloudWatchMetrics": [{
+                        "Namespace": NAMESPACE,
+                        "Dimensions": [["Function"]],
+                        "Metrics": [{"Name": name, "Unit": unit} for name, (unit, _) in metrics.items()],
+                    }],
+                },
+                "Function": self.function_name,
+                TRACE_ID_KEY: self.trace_id,
+                **self.properties,
+                **{name: values if len(values) > 1 else values[0] for name, (_, values) in metrics.items()},
+            }
+
+
+def _print_record(record):
+    print(json.dumps(record, default=str), flush=True)
+
+
+_exporter = _print_record
+
+
+def set_exporter(exporter):
+    # exporter(record) receives every EMF record; returns the previous exporter
+    global _exporter
+    previous, _exporter = _exporter, exporter
+    return previous
+
+
+class MemoryExporter:
+    # Keeps EMF records in memory so tests and local benchmarks can inspect them
+
+    def __init__(self):
+        self.records = []
+        self._lock = threading.Lock()
+
+    def __call__(self, record):
+        with self._lock:
+            self.records.append(record)
+
+    def values(self, metric, function_name=None, trace_id=None):
+        found = []
+        for record in self.records:
+            if metric not in record:
+                continue
+            if function_name is not None and record["Function"] != function_name:
+                continue
+            if trace_id is not None and record[TRACE_ID_KEY] != trace_id:
+                continue
+            value = record[metric]
+            found.extend(value if isinstance(value, list) else [value])
+        return found
+
+
+def new_trace_id():
+    return uuid.uuid4().hex
+
+
+@contextmanager
+def invocation(function_name, trace_id=None, **properties):
+    # Collects the metrics of one document's pass through a function and
+    # exports them on exit, also when the body raises
+    current = Invocation(function_name, trace_id or new_trace_id(), properties)
+    token = _current.set(current)
+    started = time.perf_counter()
+    try:
+        yield current
+    except Exception:
+        current.put("Errors", 1, "Count")
+        raise
+    finally:
+        current.put("Duration", (time.perf_counter() - started) * 1000, "Milliseconds")
+        _current.reset(token)
+        if METRICS_ENABLED:
+            for record in current.records():
+                _exporter(record)
+
+
+def put_metric(name, value, unit="Count"):
+    # No-op outside invocation(), e.g. when scripts call handler helpers directly
+    current = _current.get()
+    if current is not None:
+        current.put(name, value, unit)
+
+
+def set_property(name, value):
+    current = _current.get()
+    if current is not None:
+        current.properties[name] = value
+
+
+@contextmanager
+def timed(metric):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        put_metric(metric, (time.perf_counter() - started) * 1000, "Milliseconds")
+
+
+def bind(function):
+    # Runs function in worker threads as part of the caller's invocation
+    current = _current.get()
+
+    def run(*args, **kwargs):
+        token = _current.set(current)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _current.reset(token)
+
+    return run
+
+
+def invoke_payload(payload):
+    # JSON for lambda_client.invoke carrying the current trace ID; its size is recorded
+    current = _current.get()
+    if current is not None:
+        payload = {**payload, TRACE_ID_KEY: current.trace_id}
+    body = json.dumps(payload)
+    put_metric("PayloadBytes", len(body.encode("utf-8")), "Bytes")
+    return body
+
@@ -1,85 +1,354 @@
 import json
 import logging
 import os
-import boto3
+import hashlib
 import io
-import PyPDF2
+import time
+from contextlib import contextmanager
+from local_classifier import LocalClassifier
+from text_store import put_text
+import extraction
+import telemetry
+import aws_clients
+from bedrock_runtime import BedrockRuntime
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-s3_client = boto3.client('s3')
-bedrock_runtime_client = boto3.client('bedrock-runtime')
-lambda_client = boto3.client('lambda')
+# Built on first use; Bedrock and Secrets Manager are not needed on every path
+bedrock = BedrockRuntime()
+s3_client = aws_clients.lazy('s3')
+lambda_client = aws_clients.lazy('lambda')
+secretsmanager = aws_clients.lazy('secretsmanager')
 
 # Environment variables for Bedrock model ID and Extractor Lambda ARN
 BEDROCK_MODEL_ID = os.environ.get("BEDROCK_MODEL_ID", "anthropic.claude-instant-v1")
 EXTRACTOR_LAMBDA_ARN = os.environ.get("EXTRACTOR_LAMBDA_ARN")
+# "two_step" hands the document to the extractor; "single_pass" classifies and
+# extracts here, with at most one Bedrock request, and invokes the router and
+# embedding generator directly
+PIPELINE_MODE = os.environ.get("PIPELINE_MODE", "two_step")
+ROUTER_LAMBDA_ARN = os.environ.get("ROUTER_LAMBDA_ARN")
+EMBEDDING_GENERATOR_LAMBDA_ARN = os.environ.get("EMBEDDING_GENERATOR_LAMBDA_ARN")
+# Bucket for compressed text artifacts; when unset the text is passed inline as before
+TEXT_ARTIFACT_BUCKET = os.environ.get("TEXT_ARTIFACT_BUCKET")
+# Bedrock is only asked when the local classifier is less confident than this
+LOCAL_CLASSIFIER_THRESHOLD = float(os.environ.get("LOCAL_CLASSIFIER_THRESHOLD", "0.9"))
+LOCAL_CLASSIFIER_MODEL_PATH = os.environ.get(
+    "LOCAL_CLASSIFIER_MODEL_PATH", os.path.join(os.path.dirname(__file__), "classifier_model.json")
+)
+# Share of a document's words and bigrams the model must know before its label
+# is trusted; below it the document is out of domain (receipts, contracts, ...)
+LOCAL_CLASSIFIER_MIN_COVERAGE = float(os.environ.get("LOCAL_CLASSIFIER_MIN_COVERAGE", "0.4"))
 
-def lambda_handler(event, context):
-    for record in event['Records']:
-        bucket_name = record['s3']['bucket']['name']
-        object_key = record['s3']['object']['key']
+# Document registry in Postgres; when DB_SECRET_ARN is unset every delivery is processed as before
+DOCUMENT_REGISTRY_ENABLED = bool(os.environ.get("DB_SECRET_ARN"))
+# A document left in 'processing' this long (e.g. a failed extractor) may be claimed again
+DOCUMENT_CLAIM_TIMEOUT_MINUTES = int(os.environ.get("DOCUMENT_CLAIM_TIMEOUT_MINUTES", "15"))
+# Cached Secrets Manager credentials are refetched after this many seconds
+DB_CREDENTIALS_TTL_SECONDS = int(os.environ.get("DB_CREDENTIALS_TTL_SECONDS", "300"))
+# A reused connection idle for longer than this is pinged before use
+DB_HEALTHCHECK_IDLE_SECONDS = int(os.environ.get("DB_HEALTHCHECK_IDLE_SECONDS", "30"))
+
+local_classifier = LocalClassifier.load(LOCAL_CLASSIFIER_MODEL_PATH, min_coverage=LOCAL_CLASSIFIER_MIN_COVERAGE)
 
-        logger.info(f"Processing document {object_key} from bucket {bucket_name}")
+# Connection state kept across warm invocations of this container
+_db_credentials = None
+_db_credentials_fetched_at = 0.0
+_db_connection = None
+_db_connection_used_at = 0.0
 
+def get_db_credentials(force_refresh=False):
+    global _db_credentials, _db_credentials_fetched_at
+    if (not force_refresh and _db_credentials is not None
+            and time.monotonic() - _db_credentials_fetched_at < DB_CREDENTIALS_TTL_SECONDS):
+        return _db_credentials
+    secret_arn = os.environ['DB_SECRET_ARN']
+    response = secretsmanager.get_secret_value(SecretId=secret_arn)
+    _db_credentials = json.loads(response['SecretString'])
+    _db_credentials_fetched_at = time.monotonic()
+    return _db_credentials
+
+def get_db_connection(credentials):
+    # psycopg2 is only imported when the document registry is used
+    import psycopg2
+    return psycopg2.connect(
+        host=os.environ['DB_CLUSTER_ENDPOINT'],
+        port=5432,
+        user=credentials['username'],
+        password=credentials['password'],
+        database=credentials['dbname']
+    )
+
+def _discard_db_connection():
+    global _db_connection
+    import psycopg2
+    if _db_connection is not None and not _db_connection.closed:
         try:
-            # Get the document content from S3
+            _db_connection.close()
+        except psycopg2.Error:
+            pass
+    _db_connection = None
+
+def _db_connection_is_healthy(conn):
+    import psycopg2
+    if conn.closed:
+        return False
+    if time.monotonic() - _db_connection_used_at < DB_HEALTHCHECK_IDLE_SECONDS:
+        return True
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+def acquire_db_connection():
+    global _db_connection
+    import psycopg2
+    if _db_connection is not None and _db_connection_is_healthy(_db_connection):
+        return _db_connection
+    _discard_db_connection()
+    try:
+        _db_connection = get_db_connection(get_db_credentials())
+    except psycopg2.OperationalError:
+        # The secret may have been rotated since it was cached
+        logger.warning("Database connection failed, refreshing credentials and retrying.")
+        _db_connection = get_db_connection(get_db_credentials(force_refresh=True))
+    return _db_connection
+
+@contextmanager
+def db_connection():
+    # Yields the warm connection; any transaction left open is rolled back on
+    # exit and a connection that failed at the driver level is dropped.
+    global _db_connection_used_at
+    import psycopg2
+    conn = acquire_db_connection()
+    try:
+        yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        _discard_db_connection()
+        raise
+    finally:
+        if not conn.closed:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                _discard_db_connection()
+        _db_connection_used_at = time.monotonic()
+
+def claim_document(conn, object_key, content_hash):
+    # Registers the upload and returns None if it should be processed, or the
+    # reason to skip it: a repeated delivery, a claim still in progress, or the
+    # same bytes already embedded under another key.
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT document_id FROM documents
+            WHERE content_hash = %s AND document_id <> %s AND status = 'embedded'
+            LIMIT 1
+            """,
+            (content_hash, object_key)
+        )
+        original = cur.fetchone()
+        if original:
+            cur.execute(
+                """
+                INSERT INTO documents (document_id, content_hash, status, duplicate_of)
+                VALUES (%s, %s, 'duplicate', %s)
+                ON CONFLICT (document_id) DO UPDATE
+                SET content_hash = EXCLUDED.content_hash, status = 'duplicate',
+                    duplicate_of = EXCLUDED.duplicate_of, updated_at = now()
+                """,
+                (object_key, content_hash, original[0])
+            )
+            # The key may previously have held different content; its chunks go, with the chat answers cached from them
+            cur.execute(
+                """
+                WITH removed AS (DELETE FROM document_embeddings WHERE document_id = %s RETURNING id)
+                DELETE FROM answer_cache WHERE chunk_ids && ARRAY(SELECT id FROM removed)
+                """,
+                (object_key,)
+            )
+            cur.execute("DELETE FROM document_fields WHERE document_id = %s", (object_key,))
+            conn.commit()
+            return f"duplicate of {original[0]}"
+
+        cur.execute(
+            """
+            INSERT INTO documents (document_id, content_hash) VALUES (%s, %s)
+            ON CONFLICT (document_id) DO UPDATE
+            SET content_hash = EXCLUDED.content_hash, status = 'processing',
+                duplicate_of = NULL, updated_at = now()
+            WHERE documents.content_hash <> EXCLUDED.content_hash
+               OR documents.status IN ('failed', 'duplicate')
+               OR (documents.status = 'processing'
+                   AND documents.updated_at < now() - make_interval(mins => %s))
+            RETURNING document_id
+            """,
+            (object_key, content_hash, DOCUMENT_CLAIM_TIMEOUT_MINUTES)
+        )
+        claimed = cur.fetchone()
+        if claimed:
+            conn.commit()
+            return None
+        cur.execute("SELECT status FROM documents WHERE document_id = %s", (object_key,))
+        status = cur.fetchone()[0]
+    conn.commit()
+    return f"already {status}"
+
+def mark_document_failed(object_key):
+    # Best effort; lets a retried delivery claim the document immediately
+    try:
+        with db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "UPDATE documents SET status = 'failed', updated_at = now() WHERE document_id = %s",
+                    (object_key,)
+                )
+            conn.commit()
+    except Exception as e:
+        logger.warning(f"Could not mark {object_key} as failed in the document registry: {e}")
+
+def classify_with_bedrock(document_content):
+    # Prepare prompt for Bedrock classification
+    prompt = f"Human: Document types: [\"invoice\", \"receipt\", \"shipping_order\", \"purchase_order\", \"contract\", \"inventory_report\", \"unknown\"]\nClassify this document clearly into one type, if it is not one of the types, return \"unknown\". Do not return any other text than the type.\n\nDocument Content:\n{document_content}\nAssistant:"
+    logger.info(f"Prompt prepared: {prompt[:100]}...") # Log first 100 chars of prompt
+
+    # Invoke Bedrock for classification
+    completion, _ = bedrock.complete(BEDROCK_MODEL_ID, prompt, max_tokens=100, temperature=0.1)
+    logger.info("Bedrock invocation successful.")
+    return completion.strip().lower()
+
+def classify_locally(document_content):
+    # The local classifier's label, or None when it is not confident enough
+    started = time.perf_counter()
+    label, confidence = local_classifier.predict(document_content)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    telemetry.put_metric("LocalClassifierLatency", elapsed_ms, "Milliseconds")
+    if label and confidence >= LOCAL_CLASSIFIER_THRESHOLD:
+        logger.info(f"Local classifier: {label} (confidence {confidence:.3f}, {elapsed_ms:.2f} ms), skipping Bedrock.")
+        return label
+    logger.info(f"Local classifier not confident ({label}, {confidence:.3f}, {elapsed_ms:.2f} ms), falling back to Bedrock.")
+    return None
+
+def classify_document(document_content):
+    return classify_locally(document_content) or classify_with_bedrock(document_content)
+
+def classify_and_extract(document_content):
+    # Single-pass mode: a confident local label only needs the extraction (and
+    # the LLM only for fields the templates miss); otherwise one combined request
+    label = classify_locally(document_content)
+    if label:
+        fields = extraction.fields_for(label)
+        return label, extraction.extract_document_fields(bedrock, BEDROCK_MODEL_ID, label, document_content, fields)
+    return extraction.classify_and_extract(bedrock, BEDROCK_MODEL_ID, document_content)
+
+def store_text(document_content, page_offsets):
+    # Reference to the text in the artifact bucket, or None to pass it inline
+    if not TEXT_ARTIFACT_BUCKET:
+        return None
+    with telemetry.timed("S3Latency"):
+        return put_text(s3_client, TEXT_ARTIFACT_BUCKET, document_content, page_offsets)
+
+def process_document(bucket_name, object_key):
+    logger.info(f"Processing document {object_key} from bucket {bucket_name}")
+    claimed = False
+
+    try:
+        # Get the document content from S3
+        with telemetry.timed("S3Latency"):
             response = s3_client.get_object(Bucket=bucket_name, Key=object_key)
             # Read the PDF content as bytes
             pdf_content = response['Body'].read()
-            
-            # Use PyPDF2 to extract text
+        telemetry.put_metric("PdfBytes", len(pdf_content), "Bytes")
+
+        if DOCUMENT_REGISTRY_ENABLED:
+            content_hash = hashlib.sha256(pdf_content).hexdigest()
+            with telemetry.timed("DbLatency"), db_connection() as conn:
+                skip_reason = claim_document(conn, object_key, content_hash)
+            if skip_reason:
+                logger.info(f"Skipping {object_key} ({content_hash[:12]}): {skip_reason}.")
+                telemetry.set_property("skipped", skip_reason)
+                return
+            claimed = True
+
+        # Use PyPDF2 to extract text; imported here so duplicate deliveries never load it
+        import PyPDF2
+        with telemetry.timed("PdfParseLatency"):
             pdf_file = io.BytesIO(pdf_content)
             reader = PyPDF2.PdfReader(pdf_file)
             document_content = ""
+            page_offsets = []
             for page_num in range(len(reader.pages)):
+                page_offsets.append(len(document_content))
                 document_content += reader.pages[page_num].extract_text() or ""
-            
-            logger.info(f"Document content extracted (first 100 chars): {document_content[:100]}...")
-
-            # Prepare prompt for Bedrock classification
-            prompt = f"Human: Document types: [\"invoice\", \"receipt\", \"shipping_order\", \"purchase_order\", \"contract\", \"inventory_report\", \"unknown\"]\nClassify this document clearly into one type, if it is not one of the types, return \"unknown\". Do not return any other text than the type.\n\nDocument Content:\n{document_content}\nAssistant:"
-            logger.info(f"Prompt prepared: {prompt[:100]}...") # Log first 100 chars of prompt
-
-            # Invoke Bedrock for classification
-            bedrock_response = bedrock_runtime_client.invoke_model(
-                modelId=BEDROCK_MODEL_ID,
-                contentType="application/json",
-                accept="application/json",
-                body=json.dumps({
-                    "prompt": prompt,
-                    "max_tokens_to_sample": 100,
-                    "temperature": 0.1,
-                })
-            )
-            logger.info("Bedrock invocation successful.")
+        telemetry.put_metric("PdfPages", len(page_offsets))
 
-            response_body = json.loads(bedrock_response['body'].read())
-            classification = response_body['completion'].strip().lower()
+        logger.info(f"Document content extracted (first 100 chars): {document_content[:100]}...")
 
+        if PIPELINE_MODE == "single_pass":
+            classification, extracted_data = classify_and_extract(document_content)
+            telemetry.set_property("document_type", classification)
             logger.info(f"Document {object_key} classified as: {classification}")
+            logger.info(f"Extracted data for {object_key}: {json.dumps(extracted_data)}")
 
-            # Invoke Extractor Lambda
-            if EXTRACTOR_LAMBDA_ARN:
-                payload = {
-                    "bucket_name": bucket_name,
-                    "object_key": object_key,
-                    "document_type": classification,
-                    "document_content": document_content # Pass extracted content
-                }
-                lambda_client.invoke(
-                    FunctionName=EXTRACTOR_LAMBDA_ARN,
-                    InvocationType='Event',  # Asynchronous invocation
-                    Payload=json.dumps(payload)
-                )
-                logger.info(f"Invoked Extractor Lambda for {object_key}")
+            document_text_ref = store_text(document_content, page_offsets) if EMBEDDING_GENERATOR_LAMBDA_ARN else None
+            extraction.invoke_downstream(
+                lambda_client,
+                ROUTER_LAMBDA_ARN,
+                EMBEDDING_GENERATOR_LAMBDA_ARN,
+                bucket_name,
+                object_key,
+                classification,
+                extracted_data,
+                document_text_ref=document_text_ref,
+                document_content=document_content,
+            )
+            return
+
+        classification = classify_document(document_content)
+        telemetry.set_property("document_type", classification)
+
+        logger.info(f"Document {object_key} classified as: {classification}")
+
+        # Invoke Extractor Lambda
+        if EXTRACTOR_LAMBDA_ARN:
+            payload = {
+                "bucket_name": bucket_name,
+                "object_key": object_key,
+                "document_type": classification,
+            }
+            document_text_ref = store_text(document_content, page_offsets)
+            if document_text_ref:
+                # Pass extracted content by reference
+                payload["document_text_ref"] = document_text_ref
             else:
-                logger.warning("EXTRACTOR_LAMBDA_ARN not set. Skipping Extractor Lambda invocation.")
+                payload["document_content"] = document_content # Pass extracted content
+            lambda_client.invoke(
+                FunctionName=EXTRACTOR_LAMBDA_ARN,
+                InvocationType='Event',  # Asynchronous invocation
+                Payload=telemetry.invoke_payload(payload)
+            )
+            logger.info(f"Invoked Extractor Lambda for {object_key}")
+        else:
+            logger.warning("EXTRACTOR_LAMBDA_ARN not set. Skipping Extractor Lambda invocation.")
+
+    except Exception as e:
+        logger.error(f"Error processing document {object_key}: {e}", exc_info=True) # Log full traceback
+        if claimed:
+            mark_document_failed(object_key)
+        raise e
+
+def lambda_handler(event, context):
+    for record in event['Records']:
+        bucket_name = record['s3']['bucket']['name']
+        object_key = record['s3']['object']['key']
 
-        except Exception as e:
-            logger.error(f"Error processing document {object_key}: {e}", exc_info=True) # Log full traceback
-            raise e
+        # Each uploaded document starts a trace that the downstream payloads carry on
+        with telemetry.invocation("classifier", document_id=object_key):
+            process_document(bucket_name, object_key)
 
     return {
         'statusCode': 200,
@@ -0,0 +1,204 @@
+import json
+import logging
+import re
+import time
+
+from field_lists import DEFAULT_FIELDS, FIELDS_BY_TYPE, fields_for  # noqa: F401
+from templates import extract_fields, validate_values
+import telemetry
+
+# Field extraction shared by the extractor and the classifier's single-pass
+# mode. Two-step: the classifier labels the document and the extractor runs
+# extract_document_fields(), which asks the LLM only for fields the templates
+# miss. Single-pass: the classifier calls classify_and_extract(), which asks
+# one question returning both the type and that type's fields as JSON, and
+# hands the result straight to the router and embedding generator with
+# invoke_downstream(). The document text goes to Bedrock once and the
+# extractor hop is skipped.
+#
+# Identical copies of this module live in lambda/extractor and
+# lambda/classifier; `make check-shared` verifies they match.
+
+logger = logging.getLogger()
+
+# Labels the classifier may assign
+DOCUMENT_TYPES = ["invoice", "receipt", "shipping_order", "purchase_order", "contract", "inventory_report", "unknown"]
+
+# Output budget of the extraction and the combined request
+EXTRACTION_MAX_TOKENS = 500
+
+# Extraction counters kept across warm invocations, for the fallback rate in the logs
+extraction_stats = {"documents": 0, "llm_fallbacks": 0}
+
+
+def parse_json_completion(completion):
+    # The JSON object in a completion, also when wrapped in a ``` or ```json block; None if there is none
+    json_match = re.search(r"```(?:json)?\s*(.*?)```", completion, re.DOTALL)
+    json_string = json_match.group(1).strip() if json_match else completion
+    try:
+        return json.loads(json_string)
+    except json.JSONDecodeError as e:
+        logger.error(f"Failed to decode JSON from Bedrock completion: {e}")
+        return None
+
+
+def extract_with_llm(bedrock, model_id, document_content, fields_to_extract):
+    # Construct dynamic prompt
+    prompt = (
+        f"Human: Extract the following fields as structured JSON. It is very important that you do not reply with anything else than the JSON output: {fields_to_extract}.\n\n"
+        f"Document:\n{document_content}\nAssistant:"
+    )
+    logger.info(f"Extraction prompt prepared: {prompt[:100]}...")
+
+    # Call Bedrock
+    completion, _ = bedrock.complete(model_id, prompt, max_tokens=EXTRACTION_MAX_TOKENS, temperature=0.1)
+    logger.info("Bedrock extraction invocation successful.")
+
+    bedrock_completion = completion.strip()
+    logger.info(f"Bedrock raw completion: {bedrock_completion}")
+
+    parsed = parse_json_completion(bedrock_completion)
+    if not isinstance(parsed, dict):
+        return {
+            "error": "JSONDecodeError",
+            "raw_completion": bedrock_completion,
+        }
+    return parsed
+
+
+def _log_extraction(document_type, method, missing, started, template_ms):
+    extraction_stats["documents"] += 1
+    extraction_stats["llm_fallbacks"] += method != "template"
+    logger.info(json.dumps({
+        "message": "Extraction finished",
+        "document_type": document_type,
+        "method": method,
+        "missing_fields": missing,
+        "template_latency_ms": round(template_ms, 3),
+        "total_latency_ms": round((time.perf_counter() - started) * 1000, 3),
+        "llm_fallback_rate": round(extraction_stats["llm_fallbacks"] / extraction_stats["documents"], 4),
+    }))
+
+
+def extract_document_fields(bedrock, model_id, document_type, document_content, fields_to_extract):
+    # Template rules first; the LLM is only asked when required fields are missing
+    started = time.perf_counter()
+    extracted_data, missing = extract_fields(document_type, document_content, fields_to_extract)
+    template_ms = (time.perf_counter() - started) * 1000
+    telemetry.put_metric("TemplateExtractionLatency", template_ms, "Milliseconds")
+
+    method = "template"
+    if missing:
+        method = "template+llm" if extracted_data else "llm"
+        llm_values = extract_with_llm(bedrock, model_id, document_content, fields_to_extract)
+        if llm_values.get("error") == "JSONDecodeError":
+            # Kept next to the template values so the failed reply can be inspected
+            llm_data = llm_values
+        else:
+            # The LLM's values pass the template validators, like in single-pass mode
+            llm_data, rejected = validate_values(llm_values, missing)
+            if rejected:
+                logger.info(f"Dropped LLM values failing validation: {rejected}")
+        # Validated template values win over the LLM's
+        extracted_data = {**llm_data, **extracted_data}
+
+    _log_extraction(document_type, method, missing, started, template_ms)
+    return extracted_data
+
+
+def combined_prompt(document_content, missing_by_type):
+    # Only fields the templates could not find are asked for, per candidate
+    # type, so the reply stays short when the templates cover the document
+    field_lists = "".join(
+        f"{document_type}: {', '.join(missing)}\n" for document_type, missing in missing_by_type.items() if missing
+    )
+    return (
+        f"Human: Classify the document as one of {', '.join(DOCUMENT_TYPES)}"
+        + (f" and extract these fields of its type (none for types not listed):\n{field_lists}" if field_lists else ".\n")
+        + "Reply with only JSON: {\"document_type\": ..., \"fields\": {...}}, null for missing fields.\n\n"
+        f"Document:\n{document_content}\nAssistant:"
+    )
+
+
+def classify_and_extract(bedrock, model_id, document_content):
+    # One Bedrock request for the type and the fields its templates miss.
+    # Returns (document_type, extracted_data). The templates run for every
+    # candidate type first; the reply's type must be one of DOCUMENT_TYPES, its
+    # field values are checked with the template validators and template
+    # matches win over them, like in the two-step path.
+    started = time.perf_counter()
+    template_results = {
+        document_type: extract_fields(document_type, document_content, fields_for(document_type))
+        for document_type in DOCUMENT_TYPES
+    }
+    template_ms = (time.perf_counter() - started) * 1000
+    telemetry.put_metric("TemplateExtractionLatency", template_ms, "Milliseconds")
+
+    prompt = combined_prompt(
+        document_content, {document_type: missing for document_type, (_, missing) in template_results.items()}
+    )
+    logger.info(f"Combined classification and extraction prompt prepared: {prompt[:100]}...")
+    completion, _ = bedrock.complete(model_id, prompt, max_tokens=EXTRACTION_MAX_TOKENS, temperature=0.1)
+    bedrock_completion = completion.strip()
+    logger.info(f"Bedrock raw completion: {bedrock_completion}")
+
+    parsed = parse_json_completion(bedrock_completion)
+    if not isinstance(parsed, dict):
+        # Same shape as a failed two-step extraction; the type is recovered if the reply names one
+        named = [document_type for document_type in DOCUMENT_TYPES if document_type in bedrock_completion.lower()]
+        return (named[0] if named else "unknown"), {
+            "error": "JSONDecodeError",
+            "raw_completion": bedrock_completion,
+        }
+
+    document_type = str(parsed.get("document_type") or "").strip().lower()
+    if document_type not in DOCUMENT_TYPES:
+        logger.warning(f"Combined reply has an unexpected document type {document_type!r}; using unknown.")
+        document_type = "unknown"
+    template_data, missing = template_results[document_type]
+    llm_values = parsed.get("fields") if isinstance(parsed.get("fields"), dict) else {}
+    llm_data, rejected = validate_values(llm_values, missing)
+    if rejected:
+        logger.info(f"Dropped LLM values failing validation: {rejected}")
+
+    _log_extraction(document_type, "single_pass", missing, started, template_ms)
+    return document_type, {**llm_data, **template_data}
+
+
+def invoke_downstream(lambda_client, router_arn, embedding_generator_arn, bucket_name, object_key,
+                      document_type, extracted_data, document_text_ref=None, document_content=None):
+    # Async invokes of the router and the embedding generator with the extracted fields
+    if router_arn:
+        lambda_client.invoke(
+            FunctionName=router_arn,
+            InvocationType="Event",
+            Payload=telemetry.invoke_payload(
+                {
+                    "bucket_name": bucket_name,
+                    "object_key": object_key,
+                    "document_type": document_type,
+                    "extracted_data": extracted_data,
+                }
+            ),
+        )
+        logger.info(f"Invoked Router Lambda for {object_key}")
+
+    if embedding_generator_arn:
+        lambda_client.invoke(
+            FunctionName=embedding_generator_arn,
+            InvocationType="Event",
+            Payload=telemetry.invoke_payload(
+                {
+                    "document_id": object_key,
+                    "document_type": document_type,
+                    "extracted_data": extracted_data,
+                    # Forward the reference rather than the text when we have one
+                    **(
+                        {"text_ref": document_text_ref}
+                        if document_text_ref
+                        else {"extracted_text": document_content}
+                    ),
+                }
+            ),
+        )
+        logger.info(f"Invoked Embedding Generator Lambda for {object_key}")
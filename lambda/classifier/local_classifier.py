@@ -0,0 +1,90 @@
+import json
+import math
+import re
+from collections import Counter
+
+# Multinomial naive Bayes over word unigrams and bigrams. Trained offline by
+# scripts/train_classifier.py from data/company-document-text.csv and shipped
+# as a small JSON artifact next to app.py. Pure Python so the Lambda image
+# needs no extra dependencies.
+
+TOKEN_PATTERN = re.compile(r"[a-z]+")
+
+# Labels in the training CSV mapped to the document types used by the pipeline
+CSV_LABELS = {
+    "invoice": "invoice",
+    "purchase Order": "purchase_order",
+    "ShippingOrder": "shipping_order",
+    "report": "inventory_report",
+}
+
+
+def features(text):
+    # Digits and punctuation vary per document; the template words do not
+    words = TOKEN_PATTERN.findall(text.lower())
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+def train(samples, max_features=400, alpha=1.0):
+    # samples: iterable of (text, label). Keeps the max_features most frequent
+    # features overall so the artifact stays a few KB.
+    counts = {}
+    documents = Counter()
+    for text, label in samples:
+        documents[label] += 1
+        counts.setdefault(label, Counter()).update(features(text))
+
+    vocabulary = Counter()
+    for label_counts in counts.values():
+        vocabulary.update(label_counts)
+    kept = [feature for feature, _ in vocabulary.most_common(max_features)]
+
+    total_documents = sum(documents.values())
+    model = {"priors": {}, "log_likelihoods": {}}
+    for label, label_counts in counts.items():
+        total = sum(label_counts[feature] for feature in kept) + alpha * (len(kept) + 1)
+        model["priors"][label] = math.log(documents[label] / total_documents)
+        model["log_likelihoods"][label] = {
+            feature: round(math.log((label_counts[feature] + alpha) / total), 4) for feature in kept
+        }
+    return model
+
+
+class LocalClassifier:
+    # The model only knows the CSV labels and is overconfident on anything
+    # else: a receipt or a contract scores > 0.99 for one of them. Documents
+    # whose features are mostly outside the vocabulary are out of domain and
+    # get no local label. Templated documents cover 0.6 or more, whether
+    # extracted from the PDFs or the CSV; receipts, contracts, memos and
+    # statements cover 0.1 or less.
+
+    def __init__(self, model, min_features=5, min_coverage=0.4):
+        self.priors = model["priors"]
+        self.log_likelihoods = model["log_likelihoods"]
+        self.min_features = min_features
+        self.min_coverage = min_coverage
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        with open(path) as f:
+            return cls(json.load(f), **kwargs)
+
+    def predict(self, text):
+        # Returns (label, confidence). Confidence is the posterior probability of
+        # the winning label, or 0.0 when too few known features were seen to
+        # judge or the document is out of domain.
+        vocabulary = next(iter(self.log_likelihoods.values()))
+        text_features = features(text)
+        observed = Counter(feature for feature in text_features if feature in vocabulary)
+        known = sum(observed.values())
+        if known < self.min_features or known < self.min_coverage * len(text_features):
+            return None, 0.0
+
+        scores = {}
+        for label, prior in self.priors.items():
+            likelihoods = self.log_likelihoods[label]
+            scores[label] = prior + sum(likelihoods[feature] * count for feature, count in observed.items())
+
+        best = max(scores, key=scores.get)
+        normalizer = sum(math.exp(score - scores[best]) for score in scores.values())
+        return best, 1.0 / normalizer
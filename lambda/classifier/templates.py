@@ -0,0 +1,181 @@
+import re
+from datetime import date
+
+# Deterministic field extraction for the fixed layouts of our company
+# documents. Each document type maps field names to rules; a rule takes the
+# document text and returns the raw value or None. Values are then checked by
+# the per-field validators, so a rule that matches garbage counts as missing
+# and the caller can fall back to the LLM.
+#
+# Rules accept both PyPDF2 output ("Order ID: 10251\n...") and the flattened,
+# lower-cased text in data/company-document-text.csv ("order id  10251 ...").
+#
+# Identical copies of this module live in lambda/extractor and lambda/classifier
+# (for the single-pass mode); `make check-shared` verifies they match.
+
+ORDER_ID = r"(\d{5})"
+CUSTOMER_ID = r"([A-Za-z]{5})\b"
+DATE = r"(\d{4}-\d{2}-\d{2})"
+PERIOD = r"(\d{4}-\d{2})\b"
+# "670.8" in PDF text, "670 8" once the CSV stripped the decimal point
+AMOUNT = r"(\d+(?:[. ]\d+)?)"
+
+
+def _label(label):
+    return r"\s*".join(re.escape(word) for word in label.split()) + r"\s*:?\s*"
+
+
+def labelled(label, value, until=None):
+    # Value following "<label>:" on the same line, optionally cut at the next label
+    if until:
+        value = rf"(.+?)(?=\s*(?:\n|{_label(until)}|$))"
+    pattern = re.compile(_label(label) + value, re.IGNORECASE)
+
+    def rule(text):
+        match = pattern.search(text)
+        return match.group(1).strip() if match else None
+    return rule
+
+
+def last_labelled(label, value):
+    # Last occurrence wins, e.g. the grand total after per-line totals
+    pattern = re.compile(_label(label) + value, re.IGNORECASE)
+
+    def rule(text):
+        matches = pattern.findall(text)
+        return matches[-1] if matches else None
+    return rule
+
+
+PURCHASE_ORDER_HEADER = re.compile(
+    r"order\s*id\s+order\s*date\s+customer\s*name\s+(\d{5})\s+(\d{4}-\d{2}-\d{2})\s+(.+?)(?=\s*(?:\n|products|$))",
+    re.IGNORECASE,
+)
+LINE_ITEM = re.compile(r"^\s*\d+ .+? (\d+) (\d+(?:\.\d+)?)\s*$", re.MULTILINE)
+
+
+def purchase_order_header(group):
+    def rule(text):
+        match = PURCHASE_ORDER_HEADER.search(text)
+        return match.group(group).strip() if match else None
+    return rule
+
+
+def line_items_total(text):
+    # Purchase orders list "<id> <product> <quantity> <unit price>" without a total
+    items = LINE_ITEM.findall(text)
+    if not items:
+        return None
+    return sum(int(quantity) * float(price) for quantity, price in items)
+
+
+stock_report_period = labelled("stock report for", PERIOD)
+
+
+def stock_report_title(text):
+    period = stock_report_period(text)
+    return f"Stock Report for {period}" if period else None
+
+
+def _amount(value):
+    value = float(str(value).replace(" ", "."))
+    if value < 0:
+        raise ValueError("negative amount")
+    return round(value, 2)
+
+
+def _date(value):
+    return date.fromisoformat(value).isoformat()
+
+
+def _matching(pattern, transform=str):
+    compiled = re.compile(pattern)
+
+    def validate(value):
+        if not compiled.fullmatch(str(value)):
+            raise ValueError(f"{value!r} does not match {pattern}")
+        return transform(str(value))
+    return validate
+
+
+def _text(value):
+    value = " ".join(str(value).split())
+    if not value:
+        raise ValueError("empty value")
+    return value
+
+
+VALIDATORS = {
+    "order_id": _matching(r"\d{5}"),
+    "customer_id": _matching(r"[A-Za-z]{5}", str.upper),
+    "order_date": _date,
+    "total_amount": _amount,
+    "report_period": _matching(r"\d{4}-\d{2}"),
+}
+
+TEMPLATES = {
+    "invoice": {
+        "order_id": labelled("order id", ORDER_ID),
+        "customer_id": labelled("customer id", CUSTOMER_ID),
+        # Invoices only carry the customer's contact name
+        "customer_name": labelled("contact name", None, until="address"),
+        "total_amount": last_labelled("total price", AMOUNT),
+        "order_date": labelled("order date", DATE),
+    },
+    "shipping_order": {
+        "order_id": labelled("order id", ORDER_ID),
+        "customer_id": labelled("customer id", CUSTOMER_ID),
+        "ship_name": labelled("ship name", None, until="ship address"),
+        "ship_address": labelled("ship address", None, until="ship city"),
+        "total_amount": last_labelled("total price", AMOUNT),
+        "order_date": labelled("order date", DATE),
+    },
+    "purchase_order": {
+        "order_id": purchase_order_header(1),
+        "order_date": purchase_order_header(2),
+        "customer_name": purchase_order_header(3),
+        "total_amount": line_items_total,
+    },
+    "inventory_report": {
+        "report_title": stock_report_title,
+        "report_period": stock_report_period,
+    },
+}
+
+
+def register_template(document_type, rules):
+    # Adds or overrides rules for a document type
+    TEMPLATES.setdefault(document_type, {}).update(rules)
+
+
+def extract_fields(document_type, text, fields):
+    # Returns (values, missing) for the requested fields. A field is missing
+    # when there is no rule for it, the rule finds nothing or validation fails.
+    rules = TEMPLATES.get(document_type, {})
+    values, missing = {}, []
+    for field in fields:
+        rule = rules.get(field)
+        raw = rule(text) if rule else None
+        if raw is None:
+            missing.append(field)
+            continue
+        try:
+            values[field] = VALIDATORS.get(field, _text)(raw)
+        except ValueError:
+            missing.append(field)
+    return values, missing
+
+
+def validate_values(values, fields):
+    # Checks values from elsewhere (the LLM) with the same validators. Returns
+    # (valid, rejected); keys outside `fields` and empty values are dropped.
+    valid, rejected = {}, []
+    for field in fields:
+        raw = values.get(field)
+        if raw is None or isinstance(raw, (dict, list, bool)):
+            continue
+        try:
+            valid[field] = VALIDATORS.get(field, _text)(raw)
+        except ValueError:
+            rejected.append(field)
+    return valid, rejected
@@ -0,0 +1,51 @@
+import gzip
+import hashlib
+import json
+from functools import lru_cache
+
+# Content-addressed store for extracted document text. The classifier writes
+# the text once as a gzip-compressed JSON object keyed by its sha256, and the
+# downstream Lambdas receive a small reference instead of the text itself, which
+# keeps async invoke payloads far below the 256 KB limit.
+#
+# Identical copies of this module live in lambda/classifier, lambda/extractor
+# and lambda/embedding-generator; `make check-shared` verifies they match.
+
+TEXT_STORE_PREFIX = "text-artifacts/"
+
+
+def put_text(s3_client, bucket, text, page_offsets=None):
+    # Returns a reference dict; the object is only uploaded if it does not exist yet
+    digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    key = f"{TEXT_STORE_PREFIX}{digest}.json.gz"
+    try:
+        s3_client.head_object(Bucket=bucket, Key=key)
+    except Exception as e:
+        # A botocore ClientError, matched by its response so that importing this
+        # module does not load botocore ahead of the lazily built client
+        if getattr(e, "response", {}).get("Error", {}).get("Code") not in ("404", "NoSuchKey", "NotFound"):
+            raise
+        body = gzip.compress(json.dumps({"text": text, "page_offsets": page_offsets}).encode("utf-8"))
+        s3_client.put_object(
+            Bucket=bucket,
+            Key=key,
+            Body=body,
+            ContentType="application/json",
+            ContentEncoding="gzip",
+        )
+    return {"bucket": bucket, "key": key, "sha256": digest, "length": len(text)}
+
+
+@lru_cache(maxsize=8)
+def _load(s3_client, bucket, key):
+    response = s3_client.get_object(Bucket=bucket, Key=key)
+    return json.loads(gzip.decompress(response["Body"].read()))
+
+
+def get_text(s3_client, ref):
+    return _load(s3_client, ref["bucket"], ref["key"])["text"]
+
+
+def get_page_offsets(s3_client, ref):
+    # Character offsets at which each page starts, if the writer recorded them
+    return _load(s3_client, ref["bucket"], ref["key"])["page_offsets"]
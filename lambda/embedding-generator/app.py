@@ -1,23 +1,65 @@
 import json
-import boto3
 import os
 import psycopg2
+import psycopg2.extras
 import logging
+import hashlib
+import time
+from datetime import date
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from text_store import get_text
+from chunking import TOKENIZER, chunk_document
+from field_lists import fields_for
+import telemetry
+import aws_clients
+from bedrock_runtime import BedrockRuntime
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-secretsmanager = boto3.client('secretsmanager')
-bedrock = boto3.client('bedrock-runtime', region_name='us-west-2')
+# Built on first use; Bedrock is skipped for cached chunks, S3 for inline text
+secretsmanager = aws_clients.lazy('secretsmanager')
+bedrock = BedrockRuntime(region_name='us-west-2')
+s3 = aws_clients.lazy('s3')
 
-def get_db_credentials():
+# Titan embedding model; also the model_id of the embedding_cache entries
+BEDROCK_MODEL_ID = os.environ.get("BEDROCK_MODEL_ID", "amazon.titan-embed-text-v1")
+# Number of concurrent Bedrock embedding requests per document
+EMBEDDING_CONCURRENCY = int(os.environ.get("EMBEDDING_CONCURRENCY", "8"))
+# Chunk size budget in tokens and overlap when a window has to split running text
+CHUNK_MAX_TOKENS = int(os.environ.get("CHUNK_MAX_TOKENS", "256"))
+CHUNK_OVERLAP_TOKENS = int(os.environ.get("CHUNK_OVERLAP_TOKENS", "32"))
+# Longer field values (e.g. a report summary) are not indexed in document_fields
+FIELD_VALUE_MAX_CHARS = int(os.environ.get("FIELD_VALUE_MAX_CHARS", "200"))
+# Rows per multi-row INSERT statement
+INSERT_PAGE_SIZE = int(os.environ.get("INSERT_PAGE_SIZE", "500"))
+# Cached embeddings not used for this many days are evicted
+EMBEDDING_CACHE_TTL_DAYS = int(os.environ.get("EMBEDDING_CACHE_TTL_DAYS", "30"))
+# Cached Secrets Manager credentials are refetched after this many seconds
+DB_CREDENTIALS_TTL_SECONDS = int(os.environ.get("DB_CREDENTIALS_TTL_SECONDS", "300"))
+# A reused connection idle for longer than this is pinged before use
+DB_HEALTHCHECK_IDLE_SECONDS = int(os.environ.get("DB_HEALTHCHECK_IDLE_SECONDS", "30"))
+
+# Connection state kept across warm invocations of this container
+_db_credentials = None
+_db_credentials_fetched_at = 0.0
+_db_connection = None
+_db_connection_used_at = 0.0
+
+def get_db_credentials(force_refresh=False):
+    global _db_credentials, _db_credentials_fetched_at
+    if (not force_refresh and _db_credentials is not None
+            and time.monotonic() - _db_credentials_fetched_at < DB_CREDENTIALS_TTL_SECONDS):
+        return _db_credentials
     logger.info("Attempting to retrieve DB credentials.")
     secret_arn = os.environ['DB_SECRET_ARN']
     try:
         response = secretsmanager.get_secret_value(SecretId=secret_arn)
-        credentials = json.loads(response['SecretString'])
+        _db_credentials = json.loads(response['SecretString'])
+        _db_credentials_fetched_at = time.monotonic()
         logger.info("Successfully retrieved DB credentials.")
-        return credentials
+        return _db_credentials
     except Exception as e:
         logger.error(f"Error retrieving DB credentials: {e}")
         raise
@@ -38,122 +80,322 @@ def get_db_connection(credentials):
         logger.error(f"Error connecting to the database: {e}")
         raise
 
-def create_table_if_not_exists(conn):
-    logger.info("Attempting to create table if not exists.")
+def _discard_db_connection():
+    global _db_connection
+    if _db_connection is not None and not _db_connection.closed:
+        try:
+            _db_connection.close()
+        except psycopg2.Error:
+            pass
+    _db_connection = None
+
+def _db_connection_is_healthy(conn):
+    if conn.closed:
+        return False
+    if time.monotonic() - _db_connection_used_at < DB_HEALTHCHECK_IDLE_SECONDS:
+        return True
     try:
         with conn.cursor() as cur:
-            cur.execute("""
-            CREATE EXTENSION IF NOT EXISTS vector;
-            CREATE TABLE IF NOT EXISTS document_embeddings (
-                id SERIAL PRIMARY KEY,
-                document_id VARCHAR(255) NOT NULL,
-                chunk_text TEXT NOT NULL,
-                embedding vector(1536)
-            );
-            """)
-            conn.commit()
-        logger.info("Table creation/check completed successfully.")
-    except Exception as e:
-        logger.error(f"Error creating table: {e}")
-        raise
-    
-    
-    
-    
+            cur.execute("SELECT 1")
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        logger.warning("Cached database connection failed its health check, reconnecting.")
+        return False
+
+def acquire_db_connection():
+    global _db_connection
+    if _db_connection is not None and _db_connection_is_healthy(_db_connection):
+        return _db_connection
+    _discard_db_connection()
     try:
-        with conn.cursor() as cur:
-            cur.execute("""
-            CREATE TABLE IF NOT EXISTS conversations (
-                id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
-                system_name TEXT DEFAULT 'SmartDocumentRouter', -- Optional LLM/system role
-                topic TEXT,             -- e.g., "ACME April Invoice Audit"
-                purpose TEXT,           -- e.g., "invoice QA", "policy review"
-                metadata JSONB,         -- e.g., {"document_ids": [...], "tags": ["invoice"]}
-                context JSONB,          -- Optional running state (for summarization, etc.)
-                status TEXT NOT NULL DEFAULT 'active',  -- 'active', 'archived', 'closed'
-                created_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
-                updated_at TIMESTAMP WITH TIME ZONE DEFAULT now()
-            );
-            """)
-            conn.commit()
-        logger.info("Table `conversations` creation/check completed successfully.")
-    except Exception as e:
-        logger.error(f"Error creating table `conversations` : {e}")
-        raise
+        _db_connection = get_db_connection(get_db_credentials())
+    except psycopg2.OperationalError:
+        # The secret may have been rotated since it was cached
+        logger.warning("Database connection failed, refreshing credentials and retrying.")
+        _db_connection = get_db_connection(get_db_credentials(force_refresh=True))
+    return _db_connection
 
+@contextmanager
+def db_connection():
+    # Yields the warm connection; any transaction left open is rolled back on
+    # exit and a connection that failed at the driver level is dropped.
+    global _db_connection_used_at
+    conn = acquire_db_connection()
     try:
-        with conn.cursor() as cur:
-            cur.execute("""
-            CREATE TABLE IF NOT EXISTS conversation_messages (
-                id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
-                conversation_id UUID NOT NULL REFERENCES conversations(id) ON DELETE CASCADE,
-                role TEXT NOT NULL CHECK (role IN ('user', 'system', 'assistant')),
-                content TEXT NOT NULL,
-                document_refs JSONB,  -- Optional: linked document IDs or extracted fields
-                token_count INT,      -- For prompt budget accounting
-                embedding VECTOR(1536),  -- pgvector must be enabled
-                created_at TIMESTAMP WITH TIME ZONE DEFAULT now()
-            );
-            """)
-            conn.commit()
-        logger.info("Table `conversation_messages` creation/check completed successfully.")
-    except Exception as e:
-        logger.error(f"Error creating table `conversation_messages` : {e}")
+        yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        _discard_db_connection()
         raise
+    finally:
+        if not conn.closed:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                _discard_db_connection()
+        _db_connection_used_at = time.monotonic()
 
-def chunk_text(text, chunk_size=256, overlap=20):
-    tokens = text.split()
-    chunks = []
-    for i in range(0, len(tokens), chunk_size - overlap):
-        chunks.append(" ".join(tokens[i:i + chunk_size]))
-    return chunks
+def chunk_text(text, document_type=None):
+    # Line items and header blocks are kept whole for known document types
+    return list(chunk_document(text, document_type, CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS))
 
 def generate_embedding(text):
     logger.info("Attempting to generate embedding.")
     try:
-        response = bedrock.invoke_model(
-            modelId=os.environ['BEDROCK_MODEL_ID'],
-            body=json.dumps({'inputText': text})
-        )
-        response_body = json.loads(response['body'].read())
+        embedding = bedrock.embed(BEDROCK_MODEL_ID, text)
         logger.info("Successfully generated embedding.")
-        return response_body['embedding']
+        return embedding
     except Exception as e:
         logger.error(f"Error generating embedding: {e}")
         raise
 
-def handler(event, context):
-    logger.info(f"Received event: {json.dumps(event)}")
-    try:
-        credentials = get_db_credentials()
-        conn = get_db_connection(credentials)
-        create_table_if_not_exists(conn)
+def normalize_text(text):
+    return " ".join(text.split())
+
+def content_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def get_cached_embeddings(conn, model_id, hashes):
+    if not hashes:
+        return {}
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            UPDATE embedding_cache
+            SET hit_count = hit_count + 1, last_used_at = now()
+            WHERE model_id = %s AND content_hash = ANY(%s)
+            RETURNING content_hash, embedding::text
+            """,
+            (model_id, list(hashes))
+        )
+        cached = {row[0]: json.loads(row[1]) for row in cur.fetchall()}
+    conn.commit()
+    return cached
+
+def put_cached_embeddings(conn, model_id, embeddings_by_hash):
+    if not embeddings_by_hash:
+        return
+    rows = [(model_id, digest, embedding) for digest, embedding in embeddings_by_hash.items()]
+    with conn.cursor() as cur:
+        psycopg2.extras.execute_values(
+            cur,
+            """
+            INSERT INTO embedding_cache (model_id, content_hash, embedding) VALUES %s
+            ON CONFLICT (model_id, content_hash) DO UPDATE SET last_used_at = now()
+            """,
+            rows,
+            template="(%s, %s, %s::vector)",
+            page_size=INSERT_PAGE_SIZE
+        )
+    conn.commit()
 
-        document_id = event['document_id']
-        text = event['extracted_text']
+def evict_expired_embeddings(conn):
+    with conn.cursor() as cur:
+        cur.execute(
+            "DELETE FROM embedding_cache WHERE last_used_at < now() - make_interval(days => %s)",
+            (EMBEDDING_CACHE_TTL_DAYS,)
+        )
+        evicted = cur.rowcount
+    conn.commit()
+    if evicted:
+        logger.info(f"Evicted {evicted} embedding cache entries unused for {EMBEDDING_CACHE_TTL_DAYS} days.")
+    return evicted
+
+def generate_embeddings(conn, chunks):
+    # Embeddings come back in the same order as the chunks. Identical chunks
+    # are looked up in embedding_cache first and only misses go to Bedrock.
+    if not chunks:
+        return [], {'cache_hits': 0, 'cache_misses': 0}
+    model_id = BEDROCK_MODEL_ID
+    normalized = [normalize_text(chunk) for chunk in chunks]
+    hashes = [content_hash(text) for text in normalized]
+
+    with telemetry.timed("DbLatency"):
+        embeddings_by_hash = get_cached_embeddings(conn, model_id, set(hashes))
+    hits = len(embeddings_by_hash)
+
+    missing = {}
+    for digest, text in zip(hashes, normalized):
+        if digest not in embeddings_by_hash:
+            missing.setdefault(digest, text)
+
+    if missing:
+        workers = max(1, min(EMBEDDING_CONCURRENCY, len(missing)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            generated = dict(zip(missing, executor.map(telemetry.bind(generate_embedding), missing.values())))
+        with telemetry.timed("DbLatency"):
+            put_cached_embeddings(conn, model_id, generated)
+        embeddings_by_hash.update(generated)
+
+    stats = {'cache_hits': hits, 'cache_misses': len(missing)}
+    telemetry.put_metric("EmbeddingCacheHits", hits)
+    telemetry.put_metric("EmbeddingCacheMisses", len(missing))
+    logger.info(f"Embedding cache for {len(chunks)} chunks: {hits} hits, {len(missing)} misses.")
+    return [embeddings_by_hash[digest] for digest in hashes], stats
+
+def document_metadata(extracted_data):
+    # (document_date, customer) stored on every chunk for retrieval filters.
+    # Report periods ("2017-03") are dated to the first day of the month.
+    extracted_data = extracted_data or {}
+    document_date = None
+    for name, suffix in (('order_date', ''), ('report_period', '-01')):
+        value = extracted_data.get(name)
+        if isinstance(value, str) and value.strip():
+            try:
+                document_date = date.fromisoformat(value.strip() + suffix)
+                break
+            except ValueError:
+                pass
+    customer = next(
+        (
+            normalize_field_value(extracted_data[name])
+            for name in ('customer_id', 'customer_name', 'ship_name')
+            if isinstance(extracted_data.get(name), str) and extracted_data[name].strip()
+        ),
+        None
+    )
+    return document_date, customer
+
+def insert_embeddings(cur, document_id, document_type, chunks, embeddings, extracted_data=None):
+    document_date, customer = document_metadata(extracted_data)
+    rows = [
+        (document_id, document_type or 'unknown', document_date, customer, chunk, embedding)
+        for chunk, embedding in zip(chunks, embeddings)
+    ]
+    psycopg2.extras.execute_values(
+        cur,
+        """
+        INSERT INTO document_embeddings (document_id, document_type, document_date, customer, chunk_text, embedding)
+        VALUES %s
+        """,
+        rows,
+        page_size=INSERT_PAGE_SIZE
+    )
+
+def normalize_field_value(value):
+    # Must match ChatQueryHandler's normalization of identifiers parsed from questions
+    return str(value).strip().lstrip('#').lower()
+
+def indexed_fields(document_type, extracted_data):
+    # (field_name, normalized value) pairs for document_fields: only the
+    # extraction fields of the type, with scalar values short enough for the
+    # B-tree. LLM diagnostics (error, raw_completion) and free text are skipped.
+    extracted_data = extracted_data or {}
+    pairs = []
+    for name in fields_for(document_type):
+        value = extracted_data.get(name)
+        if isinstance(value, (str, int, float)) and str(value).strip():
+            value = normalize_field_value(value)
+            if len(value) <= FIELD_VALUE_MAX_CHARS:
+                pairs.append((name, value))
+    return pairs
 
-        chunks = chunk_text(text)
-        logger.info(f"Generated {len(chunks)} chunks.")
+def replace_document_fields(cur, document_id, document_type, extracted_data):
+    rows = [(document_id, document_type, name, value) for name, value in indexed_fields(document_type, extracted_data)]
+    cur.execute("DELETE FROM document_fields WHERE document_id = %s", (document_id,))
+    if rows:
+        psycopg2.extras.execute_values(
+            cur,
+            "INSERT INTO document_fields (document_id, document_type, field_name, field_value) VALUES %s",
+            rows
+        )
+    return len(rows)
 
+def store_document(conn, document_id, document_type, chunks, embeddings, extracted_data=None):
+    # Replaces the document's chunks (and fields, when given) and marks it
+    # embedded in the registry in one transaction, so a re-delivered or changed
+    # document never leaves duplicate or half-replaced rows behind.
+    logger.info(f"Replacing embeddings for document {document_id} with {len(chunks)} chunks in a single transaction.")
+    try:
         with conn.cursor() as cur:
-            for i, chunk in enumerate(chunks):
-                logger.info(f"Processing chunk {i+1}/{len(chunks)} for document {document_id}")
-                embedding = generate_embedding(chunk)
-                cur.execute(
-                    "INSERT INTO document_embeddings (document_id, chunk_text, embedding) VALUES (%s, %s, %s)",
-                    (document_id, chunk, embedding)
-                )
-            conn.commit()
-        logger.info(f"Successfully generated and stored {len(chunks)} embeddings for document {document_id}")
-        conn.close()
-
-        return {
-            'statusCode': 200,
-            'body': json.dumps(f'Successfully generated and stored {len(chunks)} embeddings for document {document_id}')
-        }
+            # Serializes concurrent replacements of the same document
+            cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (document_id,))
+            cur.execute("DELETE FROM document_embeddings WHERE document_id = %s RETURNING id", (document_id,))
+            replaced_ids = [row[0] for row in cur.fetchall()]
+            replaced = len(replaced_ids)
+            if replaced_ids:
+                # Cached chat answers built on the old chunks could no longer be served; drop them now
+                cur.execute("DELETE FROM answer_cache WHERE chunk_ids && %s::integer[]", (replaced_ids,))
+                if cur.rowcount:
+                    logger.info(f"Invalidated {cur.rowcount} cached answers for document {document_id}.")
+            insert_embeddings(cur, document_id, document_type, chunks, embeddings, extracted_data)
+            if extracted_data is not None:
+                fields = replace_document_fields(cur, document_id, document_type, extracted_data)
+                logger.info(f"Stored {fields} indexed fields for document {document_id}.")
+            cur.execute(
+                """
+                UPDATE documents
+                SET status = 'embedded', document_type = COALESCE(%s, document_type), updated_at = now()
+                WHERE document_id = %s
+                """,
+                (document_type, document_id)
+            )
+        conn.commit()
+        if replaced:
+            logger.info(f"Replaced {replaced} existing chunks for document {document_id}.")
+        return replaced
     except Exception as e:
-        logger.error(f"Unhandled error in EmbeddingGenerator: {e}", exc_info=True)
-        return {
-            'statusCode': 500,
-            'body': json.dumps(f'Error processing document: {e}')
-        }
\ No newline at end of file
+        conn.rollback()
+        logger.error(f"Error storing document {document_id}: {e}")
+        raise
+
+def handler(event, context):
+    logger.info(f"Received event: {json.dumps(event)}")
+    with telemetry.invocation(
+        "embedding-generator",
+        trace_id=event.get(telemetry.TRACE_ID_KEY),
+        document_id=event.get('document_id'),
+        document_type=event.get('document_type'),
+    ):
+        try:
+            document_id = event['document_id']
+            if 'text_ref' in event:
+                with telemetry.timed("S3Latency"):
+                    text = get_text(s3, event['text_ref'])
+            else:
+                text = event['extracted_text']
+
+            with telemetry.timed("ChunkingLatency"):
+                chunks = chunk_text(text, event.get('document_type'))
+            telemetry.put_metric("Chunks", len(chunks))
+            logger.info(f"Generated {len(chunks)} chunks ({TOKENIZER} token counts).")
+
+            with db_connection() as conn:
+                with telemetry.timed("DbLatency"):
+                    evict_expired_embeddings(conn)
+                started = time.perf_counter()
+                embeddings, cache_stats = generate_embeddings(conn, chunks)
+                embedded = time.perf_counter()
+                with telemetry.timed("DbLatency"):
+                    replaced = store_document(
+                        conn, document_id, event.get('document_type'), chunks, embeddings, event.get('extracted_data')
+                    )
+                stored = time.perf_counter()
+
+            stats = {
+                'document_id': document_id,
+                'chunks': len(chunks),
+                'replaced_chunks': replaced,
+                'concurrency': EMBEDDING_CONCURRENCY,
+                **cache_stats,
+                'embed_seconds': round(embedded - started, 3),
+                'store_seconds': round(stored - embedded, 3),
+                'total_seconds': round(stored - started, 3),
+                'chunks_per_second': round(len(chunks) / (stored - started), 2) if stored > started else None
+            }
+            logger.info(f"Successfully generated and stored {len(chunks)} embeddings for document {document_id}. Throughput: {json.dumps(stats)}")
+
+            return {
+                'statusCode': 200,
+                'body': json.dumps({
+                    'message': f'Successfully generated and stored {len(chunks)} embeddings for document {document_id}',
+                    'stats': stats
+                })
+            }
+        except Exception as e:
+            logger.error(f"Unhandled error in EmbeddingGenerator: {e}", exc_info=True)
+            telemetry.put_metric("Errors", 1)
+            return {
+                'statusCode': 500,
+                'body': json.dumps(f'Error processing document: {e}')
+            }
@@ -0,0 +1,191 @@
+import re
+from collections import deque
+from functools import lru_cache
+
+# Structure-aware chunking for embeddings. A document is split into records
+# (a header block, one record per product line or stock row, and a footer with
+# the totals) and records are packed into chunks by token count, so a line item
+# is never cut in half. Every chunk after the first starts with a short header
+# context (order ID, customer, report period) so each stays retrievable on its
+# own. Types without a registered strategy, and records that are too long,
+# fall back to overlapping token windows.
+#
+# Works on PyPDF2 output as well as on the flattened, lower-cased text in
+# data/company-document-text.csv: whitespace is normalized before matching.
+# Records are produced by generators and packed as they stream in.
+
+# Titan does not publish its tokenizer; cl100k_base is a close enough proxy
+# for budgeting. When tiktoken or its encoding file is unavailable, fall back
+# to counting word pieces of up to four characters and punctuation runs of up
+# to eight, which BPE vocabularies also merge.
+TOKENIZER_ENCODING = "cl100k_base"
+APPROXIMATE_TOKEN = re.compile(r"\w{1,4}|[^\w\s]{1,8}")
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding(TOKENIZER_ENCODING)
+except Exception:
+    _encoding = None
+
+TOKENIZER = TOKENIZER_ENCODING if _encoding else "approximate"
+
+DEFAULT_MAX_TOKENS = 256
+DEFAULT_OVERLAP_TOKENS = 32
+# Leading header tokens repeated at the start of continuation chunks
+CONTEXT_TOKENS = 32
+
+WORD = re.compile(r"\S+")
+# "-----" rules separating shipping order line items
+RULE = re.compile(r"-{5,}")
+# Column headers ending the header block of tabular documents
+TABLE_HEADER = re.compile(r"unit\s*price\s*:?", re.IGNORECASE)
+# "<product id> <name> <quantity> <unit price>"; in the CSV text "9.8" became
+# "9 8", so a price is followed by the next row, "page" or "totalprice"
+ITEM_ROW = re.compile(
+    r"\d+ [^\d]+? \d+ \d+(?:[. ]\d+)?(?= \d+ [^\W\d_]| page\b| totalprice\b| *$)",
+    re.IGNORECASE,
+)
+# "<product> <units sold> <units in stock> <unit price>"
+STOCK_ROW = re.compile(r"[^\d ][^\d]*? \d+ \d+ \d+(?:[. ]\d+)?(?= [^\W\d_]| *$)")
+
+
+@lru_cache(maxsize=65536)
+def _count(text):
+    if _encoding is not None:
+        return len(_encoding.encode_ordinary(text))
+    return len(APPROXIMATE_TOKEN.findall(text))
+
+
+def count_tokens(text):
+    return _count(text)
+
+
+def normalize(text):
+    return " ".join(text.split())
+
+
+def window_chunks(text, max_tokens=DEFAULT_MAX_TOKENS, overlap_tokens=DEFAULT_OVERLAP_TOKENS):
+    # Overlapping windows of whole words; a final window is only emitted when
+    # it holds words the previous chunk did not
+    window, window_tokens, fresh = deque(), 0, False
+    for match in WORD.finditer(text):
+        word = match.group()
+        tokens = count_tokens(" " + word)
+        if window and window_tokens + tokens > max_tokens:
+            yield " ".join(word for word, _ in window)
+            while window and window_tokens > overlap_tokens:
+                window_tokens -= window.popleft()[1]
+            fresh = False
+        window.append((word, tokens))
+        window_tokens += tokens
+        fresh = True
+    if window and fresh:
+        yield " ".join(word for word, _ in window)
+
+
+def _context(header):
+    # Leading words of the header within CONTEXT_TOKENS
+    words, tokens = [], 0
+    for match in WORD.finditer(header):
+        tokens += count_tokens(" " + match.group())
+        if tokens > CONTEXT_TOKENS:
+            break
+        words.append(match.group())
+    return " ".join(words)
+
+
+def pack_records(header, records, max_tokens=DEFAULT_MAX_TOKENS, overlap_tokens=DEFAULT_OVERLAP_TOKENS):
+    # Greedily packs whole records after the header; continuation chunks are
+    # prefixed with the header context
+    context = _context(header) if max_tokens > 2 * CONTEXT_TOKENS else ""
+    context_tokens = count_tokens(context) if context else 0
+
+    def restart():
+        return ([context] if context else []), context_tokens, False
+
+    # pending: parts holds something beyond the repeated context
+    parts, used, pending = ([header], count_tokens(header), True) if header else restart()
+    if used > max_tokens:
+        yield from window_chunks(header, max_tokens, overlap_tokens)
+        parts, used, pending = restart()
+    for record in records:
+        tokens = count_tokens(" " + record)
+        if pending and used + tokens > max_tokens:
+            yield " ".join(parts)
+            parts, used, pending = restart()
+        if used + tokens > max_tokens:
+            # A single record larger than a chunk
+            for piece in window_chunks(record, max_tokens - used, overlap_tokens):
+                yield " ".join(parts + [piece])
+            parts, used, pending = restart()
+            continue
+        parts.append(record)
+        used += tokens
+        pending = True
+    if pending:
+        yield " ".join(parts)
+
+
+def table_chunks(text, row_pattern, max_tokens=DEFAULT_MAX_TOKENS, overlap_tokens=DEFAULT_OVERLAP_TOKENS):
+    # Invoices, purchase orders and stock reports: a header up to the column
+    # headers, then one record per row. Text between rows stays with the
+    # preceding row and the totals stay with the last one.
+    header_match = TABLE_HEADER.search(text)
+    rows = row_pattern.finditer(text, header_match.end() if header_match else 0)
+    first = next(rows, None)
+    if first is None:
+        yield from window_chunks(text, max_tokens, overlap_tokens)
+        return
+
+    def records():
+        previous = first
+        for row in rows:
+            yield text[previous.start():row.start()].strip()
+            previous = row
+        yield text[previous.start():].strip()
+
+    yield from pack_records(text[:first.start()].strip(), records(), max_tokens, overlap_tokens)
+
+
+def invoice_chunks(text, max_tokens=DEFAULT_MAX_TOKENS, overlap_tokens=DEFAULT_OVERLAP_TOKENS):
+    yield from table_chunks(text, ITEM_ROW, max_tokens, overlap_tokens)
+
+
+def stock_report_chunks(text, max_tokens=DEFAULT_MAX_TOKENS, overlap_tokens=DEFAULT_OVERLAP_TOKENS):
+    yield from table_chunks(text, STOCK_ROW, max_tokens, overlap_tokens)
+
+
+def ruled_chunks(text, max_tokens=DEFAULT_MAX_TOKENS, overlap_tokens=DEFAULT_OVERLAP_TOKENS):
+    # Shipping orders: a header, then line items separated by "-----" rules;
+    # the grand total follows the last item
+    def between_rules():
+        start = 0
+        for rule in RULE.finditer(text):
+            yield text[start:rule.start()].strip()
+            start = rule.end()
+        yield text[start:].strip()
+
+    blocks = (block for block in between_rules() if block)
+    yield from pack_records(next(blocks, ""), blocks, max_tokens, overlap_tokens)
+
+
+CHUNKERS = {
+    "invoice": invoice_chunks,
+    "purchase_order": invoice_chunks,
+    "shipping_order": ruled_chunks,
+    "inventory_report": stock_report_chunks,
+}
+
+
+def register_chunker(document_type, chunker):
+    # chunker(text, max_tokens, overlap_tokens) yields chunk strings
+    CHUNKERS[document_type] = chunker
+
+
+def chunk_document(text, document_type=None, max_tokens=DEFAULT_MAX_TOKENS, overlap_tokens=DEFAULT_OVERLAP_TOKENS):
+    # Yields chunks lazily; unknown types use token windows
+    chunker = CHUNKERS.get(document_type, window_chunks)
+    text = normalize(text)
+    for chunk in chunker(text, max_tokens, overlap_tokens):
+        if chunk:
+            yield chunk
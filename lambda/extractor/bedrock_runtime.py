@@ -0,0 +1,283 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+import aws_clients
+import telemetry
+
+# Bedrock access shared by the handlers. BedrockRuntime wraps one
+# bedrock-runtime client with
+#
+#   * a token bucket pacing requests and a cap on requests in flight, both per
+#     execution environment
+#   * adaptive retry: throttling and transient errors are retried with
+#     exponential backoff and full jitter, and every throttle halves the bucket's
+#     rate, which then recovers step by step with each success
+#   * connect/read timeouts; botocore's own retries are off so attempts are
+#     only counted and paced here
+#   * request builders and response parsers per model family, so handlers call
+#     complete(), stream() or embed() instead of hand-rolling JSON
+#   * counters for calls, retries, throttles, latency and tokens, also written
+#     as telemetry metrics
+#
+# Identical copies of this module live in lambda/classifier, lambda/extractor,
+# lambda/embedding-generator and lambda/chat-query-handler; `make check-shared`
+# verifies they match.
+
+logger = logging.getLogger()
+
+# Steady request rate and burst per execution environment; the rate adapts
+# downwards on throttling and back up to this value
+BEDROCK_MAX_REQUESTS_PER_SECOND = float(os.environ.get("BEDROCK_MAX_REQUESTS_PER_SECOND", "20"))
+BEDROCK_BURST = int(os.environ.get("BEDROCK_BURST", "10"))
+BEDROCK_MAX_CONCURRENCY = int(os.environ.get("BEDROCK_MAX_CONCURRENCY", "8"))
+# Attempts per request, and the backoff before attempt n is uniform in [0, min(max, base * 2^n)]
+BEDROCK_MAX_ATTEMPTS = int(os.environ.get("BEDROCK_MAX_ATTEMPTS", "6"))
+BEDROCK_BACKOFF_BASE_SECONDS = float(os.environ.get("BEDROCK_BACKOFF_BASE_SECONDS", "0.25"))
+BEDROCK_BACKOFF_MAX_SECONDS = float(os.environ.get("BEDROCK_BACKOFF_MAX_SECONDS", "8"))
+BEDROCK_CONNECT_TIMEOUT_SECONDS = int(os.environ.get("BEDROCK_CONNECT_TIMEOUT_SECONDS", "5"))
+BEDROCK_READ_TIMEOUT_SECONDS = int(os.environ.get("BEDROCK_READ_TIMEOUT_SECONDS", "60"))
+
+# The adaptive rate never drops below this fraction of the configured rate
+MIN_RATE_FRACTION = 0.05
+THROTTLING_ERRORS = {"ThrottlingException", "TooManyRequestsException"}
+# Error codes, or botocore exception class names for timeouts and connection failures
+TRANSIENT_ERRORS = {
+    "ServiceUnavailableException",
+    "InternalServerException",
+    "ModelNotReadyException",
+    "ModelTimeoutException",
+    "ReadTimeoutError",
+    "ConnectTimeoutError",
+    "EndpointConnectionError",
+}
+
+
+class TokenBucket:
+    # Paces acquire() calls to `rate` per second with bursts of `capacity`.
+    # throttled() halves the rate; succeeded() adds back a small step.
+
+    def __init__(self, rate, capacity):
+        self.max_rate = rate
+        self.rate = rate
+        self.capacity = max(capacity, 1)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self):
+        # Blocks until a token is available; returns the seconds waited
+        if self.max_rate <= 0:
+            return 0.0
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def throttled(self):
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = max(self.rate / 2, self.max_rate * MIN_RATE_FRACTION)
+
+    def succeeded(self):
+        with self._lock:
+            if self.rate < self.max_rate:
+                self._refill(time.monotonic())
+                self.rate = min(self.max_rate, self.rate + self.max_rate * MIN_RATE_FRACTION)
+
+
+def model_family(model_id):
+    # "embedding", "messages" (Claude 3 and later) or "text" (Claude Instant / v2 text completions)
+    if "embed" in model_id:
+        return "embedding"
+    if "claude-instant" in model_id or "claude-v2" in model_id:
+        return "text"
+    return "messages"
+
+
+def completion_request(model_id, prompt, max_tokens, temperature=None):
+    if model_family(model_id) == "text":
+        # The handlers' prompts already carry the Human:/Assistant: turns
+        body = {"prompt": prompt, "max_tokens_to_sample": max_tokens}
+    else:
+        body = {
+            "anthropic_version": "bedrock-2023-05-31",
+            "messages": [{"role": "user", "content": [{"type": "text", "text": prompt}]}],
+            "max_tokens": max_tokens,
+        }
+    if temperature is not None:
+        body["temperature"] = temperature
+    return json.dumps(body)
+
+
+def parse_completion(model_id, response_body):
+    # (text, {"input_tokens", "output_tokens"} as far as the body reports them)
+    if model_family(model_id) == "text":
+        return response_body["completion"], {}
+    text = "".join(block["text"] for block in response_body["content"] if block["type"] == "text")
+    return text, response_body.get("usage") or {}
+
+
+def embedding_request(text):
+    return json.dumps({"inputText": text})
+
+
+def response_usage(response, body_usage):
+    # Token counts from the body, else from the InvokeModel response headers
+    headers = response.get("ResponseMetadata", {}).get("HTTPHeaders", {})
+    usage = dict(body_usage)
+    for key, header in (("input_tokens", "x-amzn-bedrock-input-token-count"),
+                        ("output_tokens", "x-amzn-bedrock-output-token-count")):
+        if usage.get(key) is None and headers.get(header) is not None:
+            usage[key] = int(headers[header])
+    return usage
+
+
+def _error_code(error):
+    response = getattr(error, "response", None)
+    if isinstance(response, dict) and response.get("Error", {}).get("Code"):
+        return response["Error"]["Code"]
+    return type(error).__name__
+
+
+class BedrockRuntime:
+    def __init__(self, region_name=None, max_requests_per_second=None, burst=None, max_concurrency=None,
+                 max_attempts=None):
+        client_args = {"region_name": region_name} if region_name else {}
+        self.client = aws_clients.lazy(
+            "bedrock-runtime",
+            config={
+                "connect_timeout": BEDROCK_CONNECT_TIMEOUT_SECONDS,
+                "read_timeout": BEDROCK_READ_TIMEOUT_SECONDS,
+                "retries": {"mode": "standard", "max_attempts": 1},
+            },
+            **client_args,
+        )
+        self.bucket = TokenBucket(
+            BEDROCK_MAX_REQUESTS_PER_SECOND if max_requests_per_second is None else max_requests_per_second,
+            BEDROCK_BURST if burst is None else burst,
+        )
+        self.max_concurrency = max_concurrency or BEDROCK_MAX_CONCURRENCY
+        self._in_flight = threading.BoundedSemaphore(self.max_concurrency)
+        self.max_attempts = max_attempts or BEDROCK_MAX_ATTEMPTS
+        # Kept across warm invocations of this execution environment
+        self.stats = {
+            "calls": 0, "attempts": 0, "retries": 0, "throttles": 0, "errors": 0,
+            "latency_ms": 0.0, "wait_ms": 0.0, "input_tokens": 0, "output_tokens": 0,
+        }
+        self._stats_lock = threading.Lock()
+
+    def _count(self, **increments):
+        with self._stats_lock:
+            for name, value in increments.items():
+                self.stats[name] += value
+
+    def _call(self, operation, keep_slot=False, **kwargs):
+        # One request with pacing, the in-flight cap and adaptive retry. With
+        # keep_slot the in-flight slot stays taken after a successful call and
+        # the caller releases it once it is done with the response.
+        self._count(calls=1)
+        for attempt in range(self.max_attempts):
+            waited = self.bucket.acquire()
+            queued = time.perf_counter()
+            self._in_flight.acquire()
+            started = time.perf_counter()
+            waited += started - queued
+            try:
+                response = getattr(self.client, operation)(**kwargs)
+            except Exception as e:
+                self._in_flight.release()
+                code = _error_code(e)
+                retryable = code in THROTTLING_ERRORS or code in TRANSIENT_ERRORS
+                if code in THROTTLING_ERRORS:
+                    self.bucket.throttled()
+                    self._count(throttles=1)
+                    telemetry.put_metric("BedrockThrottles", 1)
+                if not retryable or attempt == self.max_attempts - 1:
+                    self._count(attempts=1, errors=1)
+                    raise
+                backoff = random.uniform(0, min(BEDROCK_BACKOFF_MAX_SECONDS, BEDROCK_BACKOFF_BASE_SECONDS * 2 ** attempt))
+                logger.warning(f"Bedrock {operation} failed with {code} (attempt {attempt + 1}), retrying in {backoff:.2f}s.")
+                self._count(attempts=1, retries=1, wait_ms=(waited + backoff) * 1000)
+                telemetry.put_metric("BedrockRetries", 1)
+                time.sleep(backoff)
+                continue
+            if not keep_slot:
+                self._in_flight.release()
+            latency_ms = (time.perf_counter() - started) * 1000
+            self.bucket.succeeded()
+            self._count(attempts=1, latency_ms=latency_ms, wait_ms=waited * 1000)
+            telemetry.put_metric("BedrockLatency", latency_ms, "Milliseconds")
+            telemetry.put_metric("BedrockWait", waited * 1000, "Milliseconds")
+            return response
+
+    def _record_usage(self, usage):
+        input_tokens, output_tokens = usage.get("input_tokens"), usage.get("output_tokens")
+        if input_tokens is not None:
+            self._count(input_tokens=int(input_tokens))
+            telemetry.put_metric("BedrockInputTokens", int(input_tokens))
+        if output_tokens is not None:
+            self._count(output_tokens=int(output_tokens))
+            telemetry.put_metric("BedrockOutputTokens", int(output_tokens))
+
+    def complete(self, model_id, prompt, max_tokens, temperature=None):
+        # Returns (text, usage) for text-completion and Messages API models alike
+        response = self._call(
+            "invoke_model",
+            modelId=model_id,
+            contentType="application/json",
+            accept="application/json",
+            body=completion_request(model_id, prompt, max_tokens, temperature),
+        )
+        text, usage = parse_completion(model_id, json.loads(response["body"].read()))
+        usage = response_usage(response, usage)
+        self._record_usage(usage)
+        return text, usage
+
+    def stream(self, model_id, prompt, max_tokens, usage, temperature=None):
+        # Yields text deltas of a Messages API model; token usage is written into
+        # `usage`. Only opening the stream is retried, not a stream cut off midway.
+        # The in-flight slot is held until the body is consumed or the generator
+        # is closed, so open streams count against BEDROCK_MAX_CONCURRENCY.
+        response = self._call(
+            "invoke_model_with_response_stream",
+            keep_slot=True,
+            modelId=model_id,
+            contentType="application/json",
+            accept="application/json",
+            body=completion_request(model_id, prompt, max_tokens, temperature),
+        )
+        try:
+            for event in response["body"]:
+                if "chunk" not in event:
+                    continue
+                chunk = json.loads(event["chunk"]["bytes"])
+                if chunk["type"] == "message_start":
+                    usage.update(chunk["message"].get("usage") or {})
+                elif chunk["type"] == "content_block_delta" and chunk["delta"].get("type") == "text_delta":
+                    yield chunk["delta"]["text"]
+                elif chunk["type"] == "message_delta":
+                    usage.update(chunk.get("usage") or {})
+        finally:
+            self._in_flight.release()
+        self._record_usage(usage)
+
+    def embed(self, model_id, text):
+        response = self._call("invoke_model", modelId=model_id, body=embedding_request(text))
+        body = json.loads(response["body"].read())
+        self._record_usage(response_usage(response, {"input_tokens": body.get("inputTextTokenCount")}))
+        return body["embedding"]
@@ -0,0 +1,34 @@
+# Fields extracted per document type. The extractor and the classifier's
+# single-pass mode ask for these; the embedding generator indexes only these
+# in document_fields, so diagnostics such as raw_completion never reach it.
+#
+# Identical copies of this module live in lambda/extractor, lambda/classifier
+# and lambda/embedding-generator; `make check-shared` verifies they match.
+
+# Define extraction fields per document type
+FIELDS_BY_TYPE = {
+    "invoice": [
+        "order_id",
+        "customer_id",
+        "customer_name",
+        "total_amount",
+        "order_date",
+    ],
+    "shipping_order": [
+        "order_id",
+        "customer_id",
+        "ship_name",
+        "ship_address",
+        "total_amount",
+        "order_date",
+    ],
+    "purchase_order": ["order_id", "customer_name", "total_amount", "order_date"],
+    "receipt": ["vendor_name", "transaction_date", "total_amount", "payment_method"],
+    "report": ["report_title", "report_date", "author", "summary"],
+    "inventory_report": ["report_title", "report_period"],
+}
+DEFAULT_FIELDS = ["vendor_name", "document_number", "date", "amount"]
+
+
+def fields_for(document_type):
+    return FIELDS_BY_TYPE.get(document_type, DEFAULT_FIELDS)
@@ -7,42 +7,352 @@ import logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+# Vector index on document_embeddings.embedding: "hnsw", "ivfflat" or "none"
+VECTOR_INDEX_TYPE = os.environ.get("VECTOR_INDEX_TYPE", "hnsw")
+HNSW_M = int(os.environ.get("HNSW_M", "16"))
+HNSW_EF_CONSTRUCTION = int(os.environ.get("HNSW_EF_CONSTRUCTION", "64"))
+IVFFLAT_LISTS = int(os.environ.get("IVFFLAT_LISTS", "100"))
+# What the ANN index stores: "none" (full-precision vectors), "halfvec" (16-bit
+# floats, half the size) or "binary" (one bit per dimension, 1/32 of the size).
+# The table keeps full precision for re-ranking; set the same value on the chat handler.
+VECTOR_QUANTIZATION = os.environ.get("VECTOR_QUANTIZATION", "none")
+
+# ANN indexes are built on each partition of document_embeddings as "<partition>_embedding_idx";
+# a partitioned parent cannot be indexed concurrently
+VECTOR_INDEX_SUFFIX = "_embedding_idx"
+# Indexed expression and operator class per quantization; the chat handler's
+# candidate search orders by the same expression so the index is used
+VECTOR_INDEX_EXPRESSIONS = {
+    'none': ("embedding", "vector_l2_ops"),
+    'halfvec': ("(embedding::halfvec(1536))", "halfvec_l2_ops"),
+    'binary': ("(binary_quantize(embedding)::bit(1536))", "bit_hamming_ops"),
+}
+
+# Ordered schema migrations. Each entry is applied once, in its own
+# transaction, and recorded in schema_migrations. Never edit an applied
+# migration; append a new one instead.
+MIGRATIONS = [
+    (1, "create document_embeddings", """
+    CREATE EXTENSION IF NOT EXISTS vector;
+    CREATE TABLE IF NOT EXISTS document_embeddings (
+        id SERIAL PRIMARY KEY,
+        document_id VARCHAR(255) NOT NULL,
+        chunk_text TEXT NOT NULL,
+        embedding vector(1536)
+    );
+    """),
+    (2, "create conversations", """
+    CREATE TABLE IF NOT EXISTS conversations (
+        id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+        system_name TEXT DEFAULT 'SmartDocumentRouter', -- Optional LLM/system role
+        topic TEXT,             -- e.g., "ACME April Invoice Audit"
+        purpose TEXT,           -- e.g., "invoice QA", "policy review"
+        metadata JSONB,         -- e.g., {"document_ids": [...], "tags": ["invoice"]}
+        context JSONB,          -- Optional running state (for summarization, etc.)
+        status TEXT NOT NULL DEFAULT 'active',  -- 'active', 'archived', 'closed'
+        created_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+        updated_at TIMESTAMP WITH TIME ZONE DEFAULT now()
+    );
+    """),
+    (3, "create conversation_messages", """
+    CREATE TABLE IF NOT EXISTS conversation_messages (
+        id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+        conversation_id UUID NOT NULL REFERENCES conversations(id) ON DELETE CASCADE,
+        role TEXT NOT NULL CHECK (role IN ('user', 'system', 'assistant')),
+        content TEXT NOT NULL,
+        document_refs JSONB,  -- Optional: linked document IDs or extracted fields
+        token_count INT,      -- For prompt budget accounting
+        embedding VECTOR(1536),  -- pgvector must be enabled
+        created_at TIMESTAMP WITH TIME ZONE DEFAULT now()
+    );
+    """),
+    (4, "create embedding_cache", """
+    CREATE TABLE IF NOT EXISTS embedding_cache (
+        model_id TEXT NOT NULL,
+        content_hash CHAR(64) NOT NULL,  -- sha256 of the normalized text
+        embedding vector(1536) NOT NULL,
+        hit_count INT NOT NULL DEFAULT 0,
+        created_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+        last_used_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+        PRIMARY KEY (model_id, content_hash)
+    );
+    CREATE INDEX IF NOT EXISTS embedding_cache_last_used_at_idx ON embedding_cache (last_used_at);
+    """),
+    (5, "create document_fields", """
+    CREATE TABLE IF NOT EXISTS document_fields (
+        document_id VARCHAR(255) NOT NULL,
+        document_type TEXT,
+        field_name TEXT NOT NULL,   -- e.g. "order_id", "customer_id"
+        field_value TEXT NOT NULL,  -- trimmed, lower-cased, leading "#" removed
+        PRIMARY KEY (document_id, field_name)
+    );
+    CREATE INDEX IF NOT EXISTS document_fields_lookup_idx ON document_fields (field_name, field_value);
+    CREATE INDEX IF NOT EXISTS document_embeddings_document_id_idx ON document_embeddings (document_id);
+    """),
+    (6, "create documents registry", """
+    CREATE TABLE IF NOT EXISTS documents (
+        document_id VARCHAR(255) PRIMARY KEY,  -- S3 object key
+        content_hash CHAR(64) NOT NULL,        -- sha256 of the uploaded file
+        document_type TEXT,
+        status TEXT NOT NULL DEFAULT 'processing',  -- 'processing', 'embedded', 'failed', 'duplicate'
+        duplicate_of VARCHAR(255),             -- document already holding the same content
+        created_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+        updated_at TIMESTAMP WITH TIME ZONE DEFAULT now()
+    );
+    CREATE INDEX IF NOT EXISTS documents_content_hash_idx ON documents (content_hash);
+    -- Drop chunks appended again by repeated deliveries before the registry existed
+    DELETE FROM document_embeddings a USING document_embeddings b
+    WHERE a.document_id = b.document_id AND a.chunk_text = b.chunk_text AND a.id > b.id;
+    """),
+    (7, "add full-text search to document_embeddings", """
+    ALTER TABLE document_embeddings
+        ADD COLUMN IF NOT EXISTS chunk_tsv tsvector
+        GENERATED ALWAYS AS (to_tsvector('english', chunk_text)) STORED;
+    CREATE INDEX IF NOT EXISTS document_embeddings_chunk_tsv_idx ON document_embeddings USING GIN (chunk_tsv);
+    """),
+    (8, "partition document_embeddings by document type", """
+    CREATE TABLE document_embeddings_partitioned (
+        id INTEGER NOT NULL DEFAULT nextval('document_embeddings_id_seq'),
+        document_id VARCHAR(255) NOT NULL,
+        document_type TEXT NOT NULL DEFAULT 'unknown',
+        document_date DATE,  -- order date, or the first day of a report period
+        customer TEXT,       -- customer ID, else customer or ship name; normalized like document_fields
+        chunk_text TEXT NOT NULL,
+        embedding vector(1536),
+        chunk_tsv tsvector GENERATED ALWAYS AS (to_tsvector('english', chunk_text)) STORED,
+        PRIMARY KEY (id, document_type)  -- the partition key must be part of it
+    ) PARTITION BY LIST (document_type);
+    CREATE TABLE document_embeddings_invoice PARTITION OF document_embeddings_partitioned FOR VALUES IN ('invoice');
+    CREATE TABLE document_embeddings_purchase_order PARTITION OF document_embeddings_partitioned FOR VALUES IN ('purchase_order');
+    CREATE TABLE document_embeddings_shipping_order PARTITION OF document_embeddings_partitioned FOR VALUES IN ('shipping_order');
+    CREATE TABLE document_embeddings_inventory_report PARTITION OF document_embeddings_partitioned FOR VALUES IN ('inventory_report');
+    CREATE TABLE document_embeddings_other PARTITION OF document_embeddings_partitioned DEFAULT;
+
+    -- Block concurrent writers until the swap commits; rows inserted after the
+    -- copy would otherwise be dropped with the old table. Reads continue.
+    LOCK TABLE document_embeddings IN EXCLUSIVE MODE;
+    INSERT INTO document_embeddings_partitioned
+        (id, document_id, document_type, document_date, customer, chunk_text, embedding)
+    SELECT e.id, e.document_id, COALESCE(d.document_type, f.document_type, 'unknown'),
+           f.document_date, f.customer, e.chunk_text, e.embedding
+    FROM document_embeddings e
+    LEFT JOIN documents d ON d.document_id = e.document_id
+    LEFT JOIN LATERAL (
+        SELECT max(document_type) AS document_type,
+               max(CASE
+                   WHEN field_name = 'order_date' AND field_value ~ '^[0-9]{4}-[0-9]{2}-[0-9]{2}$'
+                       THEN field_value::date
+                   WHEN field_name = 'report_period' AND field_value ~ '^[0-9]{4}-[0-9]{2}$'
+                       THEN (field_value || '-01')::date
+               END) AS document_date,
+               COALESCE(max(field_value) FILTER (WHERE field_name = 'customer_id'),
+                        max(field_value) FILTER (WHERE field_name = 'customer_name'),
+                        max(field_value) FILTER (WHERE field_name = 'ship_name')) AS customer
+        FROM document_fields
+        WHERE document_id = e.document_id
+    ) f ON true;
+
+    -- Keep the id sequence when the old table goes away
+    ALTER SEQUENCE document_embeddings_id_seq OWNED BY NONE;
+    DROP TABLE document_embeddings;
+    ALTER TABLE document_embeddings_partitioned RENAME TO document_embeddings;
+    ALTER TABLE document_embeddings RENAME CONSTRAINT document_embeddings_partitioned_pkey TO document_embeddings_pkey;
+    ALTER SEQUENCE document_embeddings_id_seq OWNED BY document_embeddings.id;
+
+    CREATE INDEX document_embeddings_document_id_idx ON document_embeddings (document_id);
+    CREATE INDEX document_embeddings_chunk_tsv_idx ON document_embeddings USING GIN (chunk_tsv);
+    CREATE INDEX document_embeddings_document_date_idx ON document_embeddings (document_date)
+        WHERE document_date IS NOT NULL;
+    CREATE INDEX document_embeddings_customer_idx ON document_embeddings (customer)
+        WHERE customer IS NOT NULL;
+    """),
+    (9, "create answer_cache", """
+    CREATE TABLE IF NOT EXISTS answer_cache (
+        id BIGSERIAL PRIMARY KEY,
+        question TEXT NOT NULL,
+        question_embedding vector(1536),  -- NULL when retrieval fetched none; matched on the exact question
+        evidence_hash CHAR(64) NOT NULL,  -- sha256 of the model ID and the sorted chunk IDs answered from
+        chunk_ids INTEGER[] NOT NULL,     -- document_embeddings ids, for invalidation on re-ingest
+        answer TEXT NOT NULL,
+        generation_ms INT NOT NULL,       -- Claude latency of the original answer, saved by every hit
+        output_tokens INT,
+        hit_count INT NOT NULL DEFAULT 0,
+        created_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+        last_used_at TIMESTAMP WITH TIME ZONE DEFAULT now()
+    );
+    -- Lookups filter on the evidence first and rank the few candidates by similarity
+    CREATE INDEX IF NOT EXISTS answer_cache_evidence_hash_idx ON answer_cache (evidence_hash);
+    CREATE INDEX IF NOT EXISTS answer_cache_chunk_ids_idx ON answer_cache USING GIN (chunk_ids);
+    CREATE INDEX IF NOT EXISTS answer_cache_created_at_idx ON answer_cache (created_at);
+    """),
+    (10, "update pgvector for quantized indexes", """
+    -- halfvec and binary_quantize() need pgvector 0.7 or later
+    ALTER EXTENSION vector UPDATE;
+    """),
+    (11, "index conversation history", """
+    -- Keyset pagination of the history endpoints and the recent-turns read of each chat turn
+    CREATE INDEX IF NOT EXISTS conversation_messages_conversation_created_idx
+        ON conversation_messages (conversation_id, created_at, id);
+    CREATE INDEX IF NOT EXISTS conversations_updated_at_idx ON conversations (updated_at, id);
+    """),
+]
+
+def get_db_connection():
+    db_secret_arn = os.environ['DB_SECRET_ARN']
+    db_instance_endpoint = os.environ['DB_INSTANCE_ENDPOINT']
+    db_name = os.environ['DB_NAME']
+
+    logger.info("Retrieving DB credentials from Secrets Manager...")
+    secrets_client = boto3.client('secretsmanager')
+    secret_response = secrets_client.get_secret_value(SecretId=db_secret_arn)
+    credentials = json.loads(secret_response['SecretString'])
+    logger.info("Successfully retrieved DB credentials.")
+
+    logger.info(f"Connecting to PostgreSQL database: {db_instance_endpoint}/{db_name}...")
+    return psycopg2.connect(
+        host=db_instance_endpoint,
+        port=5432,
+        user=credentials['username'],
+        password=credentials['password'],
+        database=db_name
+    )
+
+def apply_migrations(conn):
+    with conn.cursor() as cur:
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INT PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TIMESTAMP WITH TIME ZONE DEFAULT now()
+        );
+        """)
+        conn.commit()
+
+    applied = []
+    for version, description, sql in MIGRATIONS:
+        with conn.cursor() as cur:
+            # Serialize concurrent runs; the lock is released at commit
+            cur.execute("SELECT pg_advisory_xact_lock(hashtext('schema_migrations'))")
+            cur.execute("SELECT 1 FROM schema_migrations WHERE version = %s", (version,))
+            if cur.fetchone():
+                conn.commit()
+                continue
+            logger.info(f"Applying migration {version}: {description}")
+            cur.execute(sql)
+            cur.execute(
+                "INSERT INTO schema_migrations (version, description) VALUES (%s, %s)",
+                (version, description)
+            )
+        conn.commit()
+        applied.append(version)
+    return applied
+
+def desired_vector_index(options):
+    # (index type, index parameters, quantization)
+    index_type = options.get('type', VECTOR_INDEX_TYPE).lower()
+    quantization = options.get('quantization', VECTOR_QUANTIZATION).lower()
+    if quantization not in VECTOR_INDEX_EXPRESSIONS:
+        raise ValueError(f"Unsupported vector quantization: {quantization}")
+    if index_type == 'hnsw':
+        params = {
+            'm': int(options.get('m', HNSW_M)),
+            'ef_construction': int(options.get('ef_construction', HNSW_EF_CONSTRUCTION)),
+        }
+    elif index_type == 'ivfflat':
+        params = {'lists': int(options.get('lists', IVFFLAT_LISTS))}
+    elif index_type == 'none':
+        params = {}
+    else:
+        raise ValueError(f"Unsupported vector index type: {index_type}")
+    return index_type, params, quantization
+
+def embedding_tables(conn):
+    # Leaf partitions of document_embeddings, or the table itself before migration 8
+    with conn.cursor() as cur:
+        cur.execute("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'document_embeddings'::regclass
+        ORDER BY c.relname
+        """)
+        tables = [row[0] for row in cur.fetchall()]
+    conn.commit()
+    return tables or ['document_embeddings']
+
+def ensure_table_vector_index(conn, table, index_type, params, quantization):
+    index_name = f"{table}{VECTOR_INDEX_SUFFIX}"
+    expression, opclass = VECTOR_INDEX_EXPRESSIONS[quantization]
+    with conn.cursor() as cur:
+        cur.execute("""
+        SELECT am.amname, c.reloptions, i.indisvalid,
+               (SELECT opcname FROM pg_opclass WHERE oid = i.indclass[0])
+        FROM pg_class c
+        JOIN pg_am am ON am.oid = c.relam
+        JOIN pg_index i ON i.indexrelid = c.oid
+        WHERE c.relname = %s AND i.indrelid = %s::regclass
+        """, (index_name, table))
+        row = cur.fetchone()
+    conn.commit()
+
+    wanted_options = sorted(f"{key}={value}" for key, value in params.items())
+    # An interrupted concurrent build leaves an invalid index behind; rebuild it
+    up_to_date = (row and row[2] and row[0] == index_type and sorted(row[1] or []) == wanted_options
+                  and row[3] == opclass)
+    if up_to_date or (index_type == 'none' and not row):
+        logger.info(f"Vector index {index_name} already up to date ({index_type} {quantization} {wanted_options}).")
+        return index_name, False
+
+    # CREATE/DROP INDEX CONCURRENTLY cannot run inside a transaction block
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            if row:
+                logger.info(f"Dropping vector index {index_name} ({row[0]} {row[1]}).")
+                cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name}")
+            if index_type != 'none':
+                with_clause = ", ".join(f"{key} = {value}" for key, value in params.items())
+                logger.info(f"Building {index_type} vector index {index_name} on {expression} with ({with_clause}).")
+                cur.execute(
+                    f"CREATE INDEX CONCURRENTLY {index_name} ON {table} "
+                    f"USING {index_type} ({expression} {opclass}) WITH ({with_clause})"
+                )
+    finally:
+        conn.autocommit = False
+    return index_name, True
+
+def ensure_vector_index(conn, options):
+    index_type, params, quantization = desired_vector_index(options)
+    indexes, changed = [], False
+    for table in embedding_tables(conn):
+        index_name, table_changed = ensure_table_vector_index(conn, table, index_type, params, quantization)
+        indexes.append(index_name)
+        changed = changed or table_changed
+    return {'indexes': indexes, 'type': index_type, 'params': params, 'quantization': quantization, 'changed': changed}
+
 def handler(event, context):
     logger.info(f"Received event: {json.dumps(event)}")
     try:
-        db_secret_arn = os.environ['DB_SECRET_ARN']
-        db_instance_endpoint = os.environ['DB_INSTANCE_ENDPOINT']
-        db_name = os.environ['DB_NAME']
-
-        logger.info("Retrieving DB credentials from Secrets Manager...")
-        secrets_client = boto3.client('secretsmanager')
-        secret_response = secrets_client.get_secret_value(SecretId=db_secret_arn)
-        credentials = json.loads(secret_response['SecretString'])
-        logger.info("Successfully retrieved DB credentials.")
-
-        logger.info(f"Connecting to PostgreSQL database: {db_instance_endpoint}/{db_name}...")
-        conn = psycopg2.connect(
-            host=db_instance_endpoint,
-            port=5432,
-            user=credentials['username'],
-            password=credentials['password'],
-            database=db_name
-        )
-        cursor = conn.cursor()
-        logger.info("Executing CREATE EXTENSION IF NOT EXISTS vector;...")
-        cursor.execute("CREATE EXTENSION IF NOT EXISTS vector;")
-        conn.commit()
-        cursor.close()
-        conn.close()
-        logger.info("Successfully enabled pgvector extension.")
+        conn = get_db_connection()
+        try:
+            applied = apply_migrations(conn)
+            logger.info(f"Applied migrations: {applied or 'none pending'}")
+            index = ensure_vector_index(conn, event.get('index') or {})
+        finally:
+            conn.close()
+        logger.info("Successfully migrated database schema.")
 
         return {
             'statusCode': 200,
-            'body': json.dumps('pgvector extension enabled successfully')
+            'body': json.dumps({
+                'message': 'Database schema migrated successfully',
+                'applied_migrations': applied,
+                'vector_index': index
+            })
         }
     except Exception as e:
-        logger.error(f"Error enabling pgvector extension: {e}", exc_info=True)
+        logger.error(f"Error migrating database schema: {e}", exc_info=True)
         return {
             'statusCode': 500,
-            'body': json.dumps(f'Error enabling pgvector extension: {e}')
+            'body': json.dumps(f'Error migrating database schema: {e}')
         }
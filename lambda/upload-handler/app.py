@@ -1,27 +1,186 @@
 import os
+import json
+import math
 import base64
-import boto3
+import aws_clients
 from aws_lambda_powertools import Logger
-from aws_lambda_powertools.event_handler import APIGatewayHttpResolver
 from aws_lambda_powertools.logging import correlation_paths
 from aws_lambda_powertools.utilities.typing import LambdaContext
 
 # Environment variables
 INCOMING_BUCKET_NAME = os.environ["INCOMING_BUCKET_NAME"]
+# Files up to this size get one presigned PUT, larger ones a multipart upload
+MULTIPART_THRESHOLD_BYTES = int(os.environ.get("MULTIPART_THRESHOLD_BYTES", str(16 * 1024 * 1024)))
+MULTIPART_PART_SIZE_BYTES = int(os.environ.get("MULTIPART_PART_SIZE_BYTES", str(16 * 1024 * 1024)))
+# Largest file and most files accepted by one POST /uploads
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", str(1024 ** 3)))
+MAX_BATCH_FILES = int(os.environ.get("MAX_BATCH_FILES", "100"))
+PRESIGNED_URL_EXPIRY_SECONDS = int(os.environ.get("PRESIGNED_URL_EXPIRY_SECONDS", "900"))
 
-# AWS clients
-s3_client = boto3.client("s3")
+# S3 multipart limits
+S3_MIN_PART_SIZE = 5 * 1024 * 1024
+S3_MAX_PARTS = 10000
+
+# AWS clients, built on first use. Presigned URLs use SigV4, which every region accepts
+s3_client = aws_clients.lazy("s3", config={"signature_version": "s3v4"})
 
 # Powertools
 logger = Logger()
-app = APIGatewayHttpResolver()
 
-@app.post("/upload")
-def upload_document():
+def response(body, status_code=200):
+    return {
+        "statusCode": status_code,
+        "headers": {"Content-Type": "application/json"},
+        "body": json.dumps(body),
+    }
+
+def get_header_value(event, name, default=None):
+    # HTTP API lower-cases header names; match case-insensitively like the powertools resolver
+    for key, value in (event.get("headers") or {}).items():
+        if key.lower() == name:
+            return value
+    return default
+
+def request_body(event):
+    # The JSON object of a request; ValueError (a 400) for malformed JSON or any other JSON value
+    body = event.get("body") or "{}"
+    if event.get("isBase64Encoded"):
+        body = base64.b64decode(body)
+    parsed = json.loads(body)
+    if not isinstance(parsed, dict):
+        raise ValueError("request body must be a JSON object")
+    return parsed
+
+def object_key(file_name):
+    # Same layout as POST /upload; directory parts of the name are dropped
+    return f"incoming/{os.path.basename(file_name)}"
+
+def validate_file(file):
+    name = file.get("name") if isinstance(file, dict) else None
+    size = file.get("size") if isinstance(file, dict) else None
+    if not isinstance(name, str) or not os.path.basename(name):
+        raise ValueError("each file needs a name")
+    if not isinstance(size, int) or isinstance(size, bool) or size < 0:
+        raise ValueError(f"{name}: size must be a non-negative integer")
+    if size > MAX_UPLOAD_BYTES:
+        raise ValueError(f"{name}: larger than {MAX_UPLOAD_BYTES} bytes")
+
+def plan_upload(file):
+    # A presigned PUT for small files; otherwise a multipart upload with one
+    # presigned URL per part, completed through POST /uploads/complete
+    name, size = file["name"], file["size"]
+    content_type = file.get("content_type") or "application/pdf"
+    key = object_key(name)
+    if size <= MULTIPART_THRESHOLD_BYTES:
+        url = s3_client.generate_presigned_url(
+            "put_object",
+            Params={"Bucket": INCOMING_BUCKET_NAME, "Key": key, "ContentType": content_type},
+            ExpiresIn=PRESIGNED_URL_EXPIRY_SECONDS,
+        )
+        return {"name": name, "key": key, "method": "PUT", "url": url, "headers": {"Content-Type": content_type}}
+
+    part_size = max(MULTIPART_PART_SIZE_BYTES, S3_MIN_PART_SIZE, math.ceil(size / S3_MAX_PARTS))
+    upload_id = s3_client.create_multipart_upload(
+        Bucket=INCOMING_BUCKET_NAME, Key=key, ContentType=content_type
+    )["UploadId"]
+    parts = [
+        {
+            "part_number": part_number,
+            "url": s3_client.generate_presigned_url(
+                "upload_part",
+                Params={"Bucket": INCOMING_BUCKET_NAME, "Key": key, "UploadId": upload_id, "PartNumber": part_number},
+                ExpiresIn=PRESIGNED_URL_EXPIRY_SECONDS,
+            ),
+        }
+        for part_number in range(1, math.ceil(size / part_size) + 1)
+    ]
+    return {"name": name, "key": key, "method": "MULTIPART", "upload_id": upload_id, "part_size": part_size, "parts": parts}
+
+def multipart_uploads(event):
+    # [(key, upload_id, entry)] of a /uploads/complete or /uploads/abort body
+    uploads = request_body(event).get("uploads")
+    if not isinstance(uploads, list) or not uploads:
+        raise ValueError("uploads must be a non-empty list")
+    found = []
+    for upload in uploads:
+        key = upload.get("key") if isinstance(upload, dict) else None
+        upload_id = upload.get("upload_id") if isinstance(upload, dict) else None
+        if not isinstance(key, str) or not key.startswith("incoming/") or not isinstance(upload_id, str):
+            raise ValueError("each upload needs an incoming/ key and an upload_id")
+        found.append((key, upload_id, upload))
+    return found
+
+def create_uploads(event):
+    # Batch variant: one request returns upload targets for every file
+    try:
+        files = request_body(event).get("files")
+        if not isinstance(files, list) or not files:
+            raise ValueError("files must be a non-empty list")
+        if len(files) > MAX_BATCH_FILES:
+            raise ValueError(f"at most {MAX_BATCH_FILES} files per request")
+        # Validate everything before creating any multipart upload
+        for file in files:
+            validate_file(file)
+        uploads = [plan_upload(file) for file in files]
+        logger.info(f"Issued upload URLs for {len(uploads)} files")
+        return response({"uploads": uploads, "expires_in": PRESIGNED_URL_EXPIRY_SECONDS})
+
+    except ValueError as e:
+        return response({"message": str(e)}, 400)
+    except Exception as e:
+        logger.exception(e)
+        return response({"message": "Internal Server Error"}, 500)
+
+def complete_uploads(event):
+    # Completing a multipart upload creates the object, and its S3 event starts
+    # the classifier like any other upload to incoming/
+    try:
+        uploads = multipart_uploads(event)
+        completed, failed = [], []
+        for key, upload_id, upload in uploads:
+            parts = sorted(
+                ({"PartNumber": int(part["part_number"]), "ETag": part["etag"]} for part in upload.get("parts") or []),
+                key=lambda part: part["PartNumber"],
+            )
+            try:
+                s3_client.complete_multipart_upload(
+                    Bucket=INCOMING_BUCKET_NAME,
+                    Key=key,
+                    UploadId=upload_id,
+                    MultipartUpload={"Parts": parts},
+                )
+                completed.append(key)
+            except Exception as e:
+                logger.warning(f"Could not complete upload of {key}: {e}")
+                failed.append({"key": key, "message": str(e)})
+        logger.info(f"Completed {len(completed)} multipart uploads, {len(failed)} failed")
+        return response({"completed": completed, "failed": failed})
+
+    except (ValueError, KeyError, TypeError) as e:
+        return response({"message": f"Invalid upload parts: {e}"}, 400)
+    except Exception as e:
+        logger.exception(e)
+        return response({"message": "Internal Server Error"}, 500)
+
+def abort_uploads(event):
+    # Frees the parts of multipart uploads the browser gave up on
+    try:
+        uploads = multipart_uploads(event)
+        for key, upload_id, _ in uploads:
+            s3_client.abort_multipart_upload(Bucket=INCOMING_BUCKET_NAME, Key=key, UploadId=upload_id)
+        return response({"aborted": [key for key, _, _ in uploads]})
+
+    except ValueError as e:
+        return response({"message": str(e)}, 400)
+    except Exception as e:
+        logger.exception(e)
+        return response({"message": "Internal Server Error"}, 500)
+
+def upload_document(event):
     try:
         # Get the file from the request body
-        file_content = base64.b64decode(app.current_event.body)
-        file_name = app.current_event.get_header_value("x-file-name", "default-name.pdf")
+        file_content = base64.b64decode(event.get("body") or "")
+        file_name = get_header_value(event, "x-file-name", "default-name.pdf")
 
         # Upload to S3
         s3_client.put_object(
@@ -31,12 +190,34 @@ def upload_document():
         )
 
         logger.info(f"Successfully uploaded {file_name} to {INCOMING_BUCKET_NAME}")
-        return {"message": "File uploaded successfully!"}, 200
+        return response({"message": "File uploaded successfully!"})
 
     except Exception as e:
         logger.exception(e)
-        return {"message": "Internal Server Error"}, 500
+        return response({"message": "Internal Server Error"}, 500)
+
+# (method, path) -> handler. A plain table instead of the powertools
+# APIGatewayHttpResolver, whose import pulls in every event handler and
+# validation module on each cold start.
+ROUTES = {
+    ("POST", "/upload"): upload_document,
+    ("POST", "/uploads"): create_uploads,
+    ("POST", "/uploads/complete"): complete_uploads,
+    ("POST", "/uploads/abort"): abort_uploads,
+}
+
+def route_path(event):
+    # rawPath carries a named stage ("/prod/upload"); routes are matched without it
+    path = event.get("rawPath", "")
+    stage = event.get("requestContext", {}).get("stage", "$default")
+    if stage != "$default" and path.startswith(f"/{stage}/"):
+        path = path[len(stage) + 1:]
+    return path
 
 @logger.inject_lambda_context(correlation_id_path=correlation_paths.API_GATEWAY_REST)
 def lambda_handler(event: dict, context: LambdaContext) -> dict:
-    return app.resolve(event, context)
\ No newline at end of file
+    http = event.get("requestContext", {}).get("http", {})
+    route = ROUTES.get((http.get("method"), route_path(event)))
+    if route is None:
+        return response({"statusCode": 404, "message": "Not found"}, 404)
+    return route(event)
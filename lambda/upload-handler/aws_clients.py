@@ -0,0 +1,58 @@
+import json
+import threading
+
+# boto3 clients created on first use instead of at import time. Importing
+# boto3 and building the first client costs a few hundred milliseconds of
+# every cold start, and most handlers have paths that never touch some of their
+# clients (the router only needs SES for invoices, the classifier only needs
+# Bedrock when the local model is unsure). A module declares
+#
+#     s3_client = aws_clients.lazy("s3")
+#
+# and uses it like a client; boto3 is imported and the client built by the
+# first attribute access. A `config` given as a dict is turned into a botocore
+# Config at that point too. Clients with the same service and arguments are
+# shared, and creation is locked because boto3's default session is not
+# thread-safe.
+#
+# Identical copies of this module live in lambda/classifier, lambda/extractor,
+# lambda/router, lambda/embedding-generator, lambda/chat-query-handler and
+# lambda/upload-handler; `make check-shared` verifies they match.
+
+_clients = {}
+_lock = threading.Lock()
+
+
+def client(service_name, **kwargs):
+    key = (service_name, json.dumps(kwargs, sort_keys=True, default=repr))
+    if key not in _clients:
+        with _lock:
+            if key not in _clients:
+                import boto3
+                if isinstance(kwargs.get("config"), dict):
+                    from botocore.config import Config
+                    kwargs = {**kwargs, "config": Config(**kwargs["config"])}
+                _clients[key] = boto3.client(service_name, **kwargs)
+    return _clients[key]
+
+
+def created():
+    # Service names of the clients built so far, for cold-start measurements
+    return sorted(service_name for service_name, _ in _clients)
+
+
+class LazyClient:
+    def __init__(self, service_name, **kwargs):
+        self.service_name = service_name
+        self._kwargs = kwargs
+
+    def __getattr__(self, name):
+        # Only reached for client attributes; service_name and _kwargs are set above
+        return getattr(client(self.service_name, **self._kwargs), name)
+
+    def __repr__(self):
+        return f"LazyClient({self.service_name!r})"
+
+
+def lazy(service_name, **kwargs):
+    return LazyClient(service_name, **kwargs)
@@ -0,0 +1,198 @@
+"""Compare the structure-aware chunker with the previous word-window chunker.
+
+Chunks every document in data/company-document-text.csv with both chunkers and
+reports, per document type and overall:
+
+  * chunk count and token sizes (lambda/embedding-generator/chunking.py counts)
+  * embedding calls, i.e. distinct chunk texts after embedding-cache dedupe
+  * line items cut across a chunk boundary
+  * retrieval hit rate: one query per line item, "<order id or report
+    period> <product name>", answered by BM25 over all chunks of the corpus;
+    a hit is a top-k chunk of the right document holding the whole line item
+
+Line items are found with the chunker's own row patterns, and BM25 stands in
+for Titan embeddings so the benchmark runs offline; absolute hit rates are a
+proxy, the difference between the chunkers is what matters.
+
+    python scripts/benchmark_chunking.py [--max-tokens 256] [--k 5] [--report chunking.json]
+"""
+import argparse
+import csv
+import json
+import math
+import os
+import re
+import sys
+import time
+from collections import Counter, defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for function_dir in ("embedding-generator", "classifier", "extractor"):
+    sys.path.insert(0, os.path.join(ROOT, "lambda", function_dir))
+
+import chunking  # noqa: E402
+from local_classifier import CSV_LABELS  # noqa: E402
+from templates import extract_fields  # noqa: E402
+
+DEFAULT_CSV = os.path.join(ROOT, "data", "company-document-text.csv")
+
+TERM = re.compile(r"\w+")
+SHIPPING_ITEM = re.compile(r"product:? (.+?) quantity:? \d+", re.IGNORECASE)
+ROW_NUMBERS = re.compile(r"^\d+ | \d+ \d+(?: \d+)?(?:[. ]\d+)?$")
+
+
+def baseline_chunks(text, chunk_size=256, overlap=20):
+    # The embedding generator's chunker before the structure-aware engine
+    tokens = text.split()
+    chunks = []
+    for i in range(0, len(tokens), chunk_size - overlap):
+        chunks.append(" ".join(tokens[i:i + chunk_size]))
+    return chunks
+
+
+def line_items(document_type, text):
+    # (product name, line item text) pairs
+    if document_type == "shipping_order":
+        return [(match.group(1), match.group()) for match in SHIPPING_ITEM.finditer(text)]
+    if document_type == "inventory_report":
+        pattern = chunking.STOCK_ROW
+    elif document_type in ("invoice", "purchase_order"):
+        pattern = chunking.ITEM_ROW
+    else:
+        return []
+    header = chunking.TABLE_HEADER.search(text)
+    rows = pattern.finditer(text, header.end() if header else 0)
+    return [(ROW_NUMBERS.sub("", row.group()).strip(), row.group()) for row in rows]
+
+
+def document_key(document_type, text):
+    field = "report_period" if document_type == "inventory_report" else "order_id"
+    values, _ = extract_fields(document_type, text, [field])
+    return values.get(field, "")
+
+
+class BM25:
+    def __init__(self, documents, k1=1.2, b=0.75):
+        self.k1, self.b = k1, b
+        self.postings = defaultdict(list)
+        self.lengths = []
+        for index, document in enumerate(documents):
+            terms = Counter(TERM.findall(document.lower()))
+            self.lengths.append(sum(terms.values()))
+            for term, count in terms.items():
+                self.postings[term].append((index, count))
+        self.average_length = sum(self.lengths) / max(len(self.lengths), 1)
+
+    def search(self, query, k):
+        scores = defaultdict(float)
+        total = len(self.lengths)
+        for term in set(TERM.findall(query.lower())):
+            postings = self.postings.get(term, ())
+            if not postings:
+                continue
+            idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            for index, count in postings:
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[index] / self.average_length)
+                scores[index] += idf * count * (self.k1 + 1) / (count + norm)
+        return sorted(scores, key=scores.get, reverse=True)[:k]
+
+
+def evaluate(name, chunker, documents, k):
+    started = time.perf_counter()
+    chunk_texts, chunk_owner = [], []
+    per_type = defaultdict(lambda: {"documents": 0, "chunks": 0, "line_items": 0, "split_line_items": 0, "hits": 0})
+    for index, (document_type, text, _, items) in enumerate(documents):
+        chunks = chunker(text, document_type)
+        stats = per_type[document_type]
+        stats["documents"] += 1
+        stats["chunks"] += len(chunks)
+        stats["line_items"] += len(items)
+        stats["split_line_items"] += sum(1 for _, item in items if not any(item in chunk for chunk in chunks))
+        chunk_texts.extend(chunks)
+        chunk_owner.extend([index] * len(chunks))
+    chunk_seconds = time.perf_counter() - started
+
+    index = BM25(chunk_texts)
+    hits = reciprocal_ranks = queries = 0
+    for document_index, (document_type, _, key, items) in enumerate(documents):
+        for product, item in items:
+            queries += 1
+            ranked = index.search(f"{key} {product}", k)
+            for rank, chunk_index in enumerate(ranked, 1):
+                if chunk_owner[chunk_index] == document_index and item in chunk_texts[chunk_index]:
+                    hits += 1
+                    reciprocal_ranks += 1 / rank
+                    per_type[document_type]["hits"] += 1
+                    break
+
+    sizes = sorted(chunking.count_tokens(chunk) for chunk in chunk_texts)
+    distinct = set(chunk_texts)
+    return {
+        "chunker": name,
+        "chunks": len(chunk_texts),
+        "embedding_calls": len(distinct),
+        "embedded_tokens": sum(chunking.count_tokens(chunk) for chunk in distinct),
+        "tokens_per_chunk": {
+            "mean": round(sum(sizes) / len(sizes), 1) if sizes else None,
+            "p50": sizes[len(sizes) // 2] if sizes else None,
+            "max": sizes[-1] if sizes else None,
+        },
+        "split_line_items": sum(stats["split_line_items"] for stats in per_type.values()),
+        "queries": queries,
+        f"hit_rate_at_{k}": round(hits / queries, 4) if queries else None,
+        "mrr": round(reciprocal_ranks / queries, 4) if queries else None,
+        "chunking_seconds": round(chunk_seconds, 3),
+        "per_type": {
+            document_type: {
+                **{field: value for field, value in stats.items() if field != "hits"},
+                f"hit_rate_at_{k}": round(stats["hits"] / stats["line_items"], 4) if stats["line_items"] else None,
+            }
+            for document_type, stats in sorted(per_type.items())
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--csv", default=DEFAULT_CSV)
+    parser.add_argument("--max-tokens", type=int, default=chunking.DEFAULT_MAX_TOKENS)
+    parser.add_argument("--overlap-tokens", type=int, default=chunking.DEFAULT_OVERLAP_TOKENS)
+    parser.add_argument("--k", type=int, default=5, help="retrieved chunks per query")
+    parser.add_argument("--limit", type=int, help="only use the first N documents")
+    parser.add_argument("--report", help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    with open(args.csv, newline="") as f:
+        rows = list(csv.DictReader(f))[:args.limit]
+    documents = []
+    for row in rows:
+        document_type = CSV_LABELS[row["label"]]
+        text = chunking.normalize(row["text"])
+        documents.append((document_type, text, document_key(document_type, text), line_items(document_type, text)))
+
+    report = {
+        "documents": len(documents),
+        "tokenizer": chunking.TOKENIZER,
+        "max_tokens": args.max_tokens,
+        "overlap_tokens": args.overlap_tokens,
+        "results": [
+            evaluate("word_window_256", lambda text, _: baseline_chunks(text), documents, args.k),
+            evaluate(
+                "structure_aware",
+                lambda text, document_type: list(chunking.chunk_document(
+                    text, document_type, args.max_tokens, args.overlap_tokens
+                )),
+                documents,
+                args.k,
+            ),
+        ],
+    }
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.report:
+        with open(args.report, "w") as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,186 @@
+"""Measure each Lambda's import-time (cold start init) cost locally.
+
+Every function directory under lambda/ is imported in fresh interpreters, the
+way the Lambda runtime imports app.py on a cold start, and the report gives
+per function:
+
+  * init_ms: median and min wall time of importing app.py over --runs runs
+    (after one discarded warm-up run that fills the OS file cache)
+  * clients_at_init: boto3 clients built while importing
+  * heavy_modules_at_init: which of boto3, PyPDF2, psycopg2, tiktoken and the
+    powertools event handler were loaded by the import
+  * deferred_client_ms: for clients declared with aws_clients.lazy(), the time
+    the first use of each one costs later, on the paths that need it
+  * top_imports_ms: the slowest top-level imports from `python -X importtime`
+
+With --baseline <git ref> the same is measured for lambda/ at that ref
+(extracted with git archive) and the report adds the init_ms saving per
+function:
+
+    python scripts/benchmark_cold_start.py [--runs 10] [--baseline HEAD~1] [--report cold_start.json]
+
+No AWS calls are made; clients are only constructed. Functions whose
+dependencies are not installed locally are reported with the import error.
+Absolute numbers depend on the machine; Lambda's init phase runs on a
+comparable slice of a vCPU, so the differences carry over.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+
+from lambda_modules import LAMBDA_DIR, ROOT
+
+HEAVY_MODULES = ("boto3", "PyPDF2", "psycopg2", "tiktoken", "aws_lambda_powertools.event_handler")
+
+# Read by the handlers at import time; dummy values, nothing is called
+ENVIRONMENT = {
+    "AWS_DEFAULT_REGION": "us-east-1",
+    "AWS_ACCESS_KEY_ID": "local",
+    "AWS_SECRET_ACCESS_KEY": "local",
+    "INCOMING_BUCKET_NAME": "incoming",
+    "ROUTED_BUCKET_NAME": "routed",
+    "DYNAMODB_TABLE_NAME": "documents",
+    "SNS_TOPIC_ARN": "arn:aws:sns:us-east-1:000000000000:documents",
+    "POWERTOOLS_SERVICE_NAME": "cold-start-benchmark",
+}
+
+# Runs in the fresh interpreter; prints one JSON line
+MARKER = "-- app.py --"
+CHILD = r"""
+import importlib.util, json, sys, time
+directory, heavy, MARKER = sys.argv[1], sys.argv[2].split(","), sys.argv[3]
+sys.path.insert(0, directory)
+# Brackets the app.py import in the -X importtime output, which also goes to stderr
+print(MARKER, file=sys.stderr, flush=True)
+started = time.perf_counter()
+try:
+    spec = importlib.util.spec_from_file_location("app", directory + "/app.py")
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["app"] = module
+    spec.loader.exec_module(module)
+except Exception as e:
+    print(json.dumps({"error": f"{type(e).__name__}: {e}"}))
+    sys.exit(0)
+init_ms = (time.perf_counter() - started) * 1000
+print(MARKER, file=sys.stderr, flush=True)
+
+eager = sorted(
+    value.meta.service_model.service_name for value in vars(module).values()
+    if type(value).__name__ != "LazyClient" and hasattr(getattr(value, "meta", None), "service_model")
+)
+aws_clients = sys.modules.get("aws_clients")
+eager += aws_clients.created() if aws_clients else []
+loaded = [name for name in heavy if name in sys.modules]
+
+deferred = {}
+values = list(vars(module).values())
+# Wrappers such as bedrock_runtime.BedrockRuntime hold their lazy client in .client
+values += [getattr(value, "client", None) for value in values if type(value).__name__ != "LazyClient"]
+for value in values:
+    if type(value).__name__ == "LazyClient" and value.service_name not in deferred:
+        started = time.perf_counter()
+        aws_clients.client(value.service_name, **value._kwargs)
+        deferred[value.service_name] = round((time.perf_counter() - started) * 1000, 1)
+
+print(json.dumps({"init_ms": init_ms, "clients": sorted(eager), "heavy": loaded, "deferred": deferred}))
+"""
+
+
+def run_child(directory, environment, importtime=False):
+    command = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", CHILD, directory, ",".join(HEAVY_MODULES), MARKER]
+    result = subprocess.run(command, capture_output=True, text=True, env=environment, cwd=directory, timeout=120)
+    lines = [line for line in result.stdout.splitlines() if line.startswith("{")]
+    if not lines:
+        return {"error": (result.stderr.strip().splitlines() or ["no output"])[-1]}, result.stderr
+    return json.loads(lines[-1]), result.stderr
+
+
+def top_imports(importtime_output, count):
+    # Top-level imports of app.py by cumulative time (microseconds in -X importtime output)
+    totals = {}
+    inside = False
+    for line in importtime_output.splitlines():
+        if line == MARKER:
+            inside = not inside
+        if not inside or not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # Nested imports are indented by two more spaces per level
+        if len(name) - len(name.lstrip()) == 1:
+            totals[name.strip()] = totals.get(name.strip(), 0) + int(cumulative)
+    ranked = sorted(totals.items(), key=lambda item: item[1], reverse=True)[:count]
+    return {name: round(microseconds / 1000, 1) for name, microseconds in ranked}
+
+
+def measure(directory, runs, environment, top):
+    run_child(directory, environment)
+    samples = []
+    for _ in range(runs):
+        result, _ = run_child(directory, environment)
+        if "error" in result:
+            return {"error": result["error"]}
+        samples.append(result)
+    _, importtime_output = run_child(directory, environment, importtime=True)
+    timings = [sample["init_ms"] for sample in samples]
+    return {
+        "init_ms": {"median": round(statistics.median(timings), 1), "min": round(min(timings), 1)},
+        "clients_at_init": samples[-1]["clients"],
+        "heavy_modules_at_init": samples[-1]["heavy"],
+        "deferred_client_ms": samples[-1]["deferred"],
+        "top_imports_ms": top_imports(importtime_output, top),
+    }
+
+
+def extract_baseline(ref, target):
+    # lambda/ as of a git ref, via git archive
+    archive = os.path.join(target, "lambda.tar")
+    with open(archive, "wb") as f:
+        subprocess.run(["git", "archive", ref, "lambda"], cwd=ROOT, stdout=f, check=True)
+    with tarfile.open(archive) as tar:
+        tar.extractall(target)
+    return os.path.join(target, "lambda")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--functions", help="comma-separated function directories (default: all)")
+    parser.add_argument("--runs", type=int, default=5, help="measured imports per function")
+    parser.add_argument("--top", type=int, default=5, help="slowest imports listed per function")
+    parser.add_argument("--baseline", help="git ref to compare against, e.g. HEAD~1")
+    parser.add_argument("--report", help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    functions = args.functions.split(",") if args.functions else sorted(
+        name for name in os.listdir(LAMBDA_DIR) if os.path.exists(os.path.join(LAMBDA_DIR, name, "app.py"))
+    )
+    environment = {**os.environ, **ENVIRONMENT}
+
+    report = {"python": sys.version.split()[0], "runs": args.runs, "functions": {}}
+    with tempfile.TemporaryDirectory() as scratch:
+        baseline_dir = extract_baseline(args.baseline, scratch) if args.baseline else None
+        for function in functions:
+            current = measure(os.path.join(LAMBDA_DIR, function), args.runs, environment, args.top)
+            entry = {"current": current}
+            if baseline_dir:
+                baseline = measure(os.path.join(baseline_dir, function), args.runs, environment, args.top)
+                entry["baseline"] = baseline
+                if "init_ms" in current and "init_ms" in baseline:
+                    entry["init_ms_saved"] = round(baseline["init_ms"]["median"] - current["init_ms"]["median"], 1)
+            report["functions"][function] = entry
+    if args.baseline:
+        report["baseline"] = args.baseline
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.report:
+        with open(args.report, "w") as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,207 @@
+"""Compare the two-step and single-pass classify/extract modes on sample documents.
+
+Runs the rows of data/company-document-text.csv through the classifier and
+extractor code of both pipeline modes (PIPELINE_MODE in the classifier):
+
+  * two_step: the classifier labels the document (local model, Bedrock when
+    unsure), an async invoke hands it to the extractor, which fills the fields
+    from the templates and asks Bedrock for any they miss
+  * single_pass: the classifier keeps a confident local label and runs the
+    same extraction, otherwise it asks Bedrock once for the type and fields
+
+and reports per mode the Bedrock calls, input and output tokens, the cost of
+those tokens and of the Lambda invocations before the router, the document
+type accuracy against the CSV labels and the per-document latency, plus how
+often both modes extracted the same fields.
+
+Offline (the default), Bedrock is an oracle that answers with the CSV label and
+the fields the extraction templates find, with tokens estimated at four
+characters each, so only the call pattern is measured; latency is modeled as
+--call-latency per Bedrock call plus --output-token-ms per generated token and
+--hop-latency per Lambda hop, on top of the measured local time. With --live
+the real Bedrock model in BEDROCK_MODEL_ID is called with the default AWS
+credentials and latency is measured, plus the hops:
+
+    python scripts/benchmark_single_pass.py [--documents 200] [--classifier-threshold 1.1] \\
+        [--live] [--report single_pass.json]
+
+A threshold above 1 sends every document to Bedrock, the worst case for both
+modes. Prices default to Claude Instant on-demand rates per 1,000 tokens.
+"""
+import argparse
+import ast
+import csv
+import json
+import logging
+import os
+import random
+import re
+import sys
+import time
+
+from benchmark_pipeline import milliseconds
+from lambda_modules import ROOT, load_lambda
+from local_aws import LocalBedrock, install_clients
+
+sys.path.insert(0, os.path.join(ROOT, "lambda", "classifier"))
+
+from local_classifier import CSV_LABELS  # noqa: E402
+
+DEFAULT_CSV = os.path.join(ROOT, "data", "company-document-text.csv")
+MODES = ("two_step", "single_pass")
+# Lambda request price per invocation
+LAMBDA_REQUEST_PRICE = 0.20 / 1_000_000
+
+DOCUMENT_TEXT = re.compile(r"\nDocument(?: Content)?:\n(.*)\nAssistant:$", re.DOTALL)
+EXTRACTION_FIELDS = re.compile(r"JSON output: (\[.*?\])\.\n")
+
+
+class OracleBedrock(LocalBedrock):
+    # Answers like a model that is always right: the CSV label, and the values
+    # the extraction templates find for the requested fields
+
+    def __init__(self, labels):
+        super().__init__(embedding_latency=0.0, completion_latency=0.0)
+        self.labels = labels
+
+    def complete(self, prompt):
+        import templates
+
+        match = DOCUMENT_TEXT.search(prompt)
+        text = match.group(1) if match else ""
+        document_type = self.labels.get(text, "unknown")
+        if "document_type" in prompt:
+            # Only the fields listed for the type, as the prompt asks
+            listed = re.search(rf"^{document_type}: (.*)$", prompt.split("\nDocument:\n")[0], re.MULTILINE)
+            fields = listed.group(1).split(", ") if listed else []
+            values, _ = templates.extract_fields(document_type, text, fields)
+            return json.dumps({"document_type": document_type, "fields": {field: values.get(field) for field in fields}})
+        if "Classify this document" in prompt:
+            return document_type
+        fields = EXTRACTION_FIELDS.search(prompt)
+        values, _ = templates.extract_fields(document_type, text, ast.literal_eval(fields.group(1)) if fields else [])
+        return json.dumps(values)
+
+
+def load_documents(path, limit, seed):
+    with open(path, newline="") as f:
+        rows = list(csv.DictReader(f))
+    random.Random(seed).shuffle(rows)
+    return [(" ".join(row["text"].split()), CSV_LABELS[row["label"]]) for row in rows[:limit]]
+
+
+def load_mode(mode, threshold, bedrock):
+    # Module copies per mode, since PIPELINE_MODE is read at import time
+    os.environ["PIPELINE_MODE"] = mode
+    if threshold is not None:
+        os.environ["LOCAL_CLASSIFIER_THRESHOLD"] = str(threshold)
+    classifier = load_lambda("classifier", instance=mode)
+    extractor = load_lambda("extractor", instance=mode) if mode == "two_step" else None
+    if bedrock is not None:
+        for module in (classifier, extractor):
+            if module is not None:
+                install_clients(module, {"bedrock-runtime": bedrock})
+    return classifier, extractor
+
+
+def bedrock_usage(modules):
+    totals = {"calls": 0, "input_tokens": 0, "output_tokens": 0}
+    for module in modules:
+        for name in totals:
+            totals[name] += module.bedrock.stats[name]
+    return totals
+
+
+def run_document(mode, classifier, extractor, text):
+    # (document_type, extracted_data, Lambda hops before the router)
+    if mode == "single_pass":
+        document_type, extracted_data = classifier.classify_and_extract(text)
+        return document_type, extracted_data, 1
+    document_type = classifier.classify_document(text)
+    fields = extractor.FIELDS_BY_TYPE.get(document_type, extractor.DEFAULT_FIELDS)
+    return document_type, extractor.extract_document_fields(document_type, text, fields), 2
+
+
+def run_mode(mode, documents, args, bedrock):
+    classifier, extractor = load_mode(mode, args.classifier_threshold, bedrock)
+    modules = [module for module in (classifier, extractor) if module is not None]
+    # The handlers set INFO on the root logger when imported
+    logging.getLogger().setLevel(logging.CRITICAL)
+    latencies, results, correct, invocations = [], [], 0, 0
+    before = bedrock_usage(modules)
+    for text, label in documents:
+        usage_before = bedrock_usage(modules)
+        started = time.perf_counter()
+        document_type, extracted_data, hops = run_document(mode, classifier, extractor, text)
+        elapsed = time.perf_counter() - started
+        usage = {name: value - usage_before[name] for name, value in bedrock_usage(modules).items()}
+        if not args.live:
+            elapsed += usage["calls"] * args.call_latency + usage["output_tokens"] * args.output_token_ms / 1000
+        latencies.append(elapsed + hops * args.hop_latency)
+        invocations += hops
+        correct += document_type == label
+        results.append((document_type, extracted_data))
+
+    usage = {name: value - before[name] for name, value in bedrock_usage(modules).items()}
+    token_cost = (usage["input_tokens"] * args.input_price + usage["output_tokens"] * args.output_price) / 1000
+    lambda_cost = invocations * LAMBDA_REQUEST_PRICE
+    count = len(documents)
+    report = {
+        "bedrock_calls": usage["calls"],
+        "bedrock_calls_per_document": round(usage["calls"] / count, 3),
+        "input_tokens": usage["input_tokens"],
+        "output_tokens": usage["output_tokens"],
+        "lambda_invocations": invocations,
+        "cost_usd": round(token_cost + lambda_cost, 6),
+        "cost_per_1000_documents_usd": round((token_cost + lambda_cost) / count * 1000, 4),
+        "type_accuracy": round(correct / count, 4),
+        "latency_ms": milliseconds(latencies),
+    }
+    return report, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--csv", default=DEFAULT_CSV)
+    parser.add_argument("--documents", type=int, default=200, help="number of CSV rows to compare on")
+    parser.add_argument("--seed", type=int, default=7, help="seed for sampling the rows")
+    parser.add_argument("--classifier-threshold", type=float,
+                        help="local classifier confidence needed to skip Bedrock (default: the handler's)")
+    parser.add_argument("--live", action="store_true", help="call Bedrock instead of the offline oracle")
+    parser.add_argument("--input-price", type=float, default=0.0008, help="USD per 1,000 input tokens")
+    parser.add_argument("--output-price", type=float, default=0.0024, help="USD per 1,000 output tokens")
+    parser.add_argument("--call-latency", type=float, default=0.4, help="offline: seconds per Bedrock call")
+    parser.add_argument("--output-token-ms", type=float, default=15.0, help="offline: milliseconds per output token")
+    parser.add_argument("--hop-latency", type=float, default=0.1, help="seconds per async Lambda hop")
+    parser.add_argument("--report", help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.CRITICAL)
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    documents = load_documents(args.csv, args.documents, args.seed)
+    bedrock = None if args.live else OracleBedrock({text: label for text, label in documents})
+
+    report = {"documents": len(documents), "bedrock": "live" if args.live else "oracle", "modes": {}}
+    results = {}
+    for mode in MODES:
+        report["modes"][mode], results[mode] = run_mode(mode, documents, args, bedrock)
+
+    two_step, single_pass = report["modes"]["two_step"], report["modes"]["single_pass"]
+    same_fields = sum(a[1] == b[1] for a, b in zip(results["two_step"], results["single_pass"]))
+    report["field_agreement"] = round(same_fields / len(documents), 4)
+    report["single_pass_savings"] = {
+        "bedrock_calls": two_step["bedrock_calls"] - single_pass["bedrock_calls"],
+        "input_tokens": two_step["input_tokens"] - single_pass["input_tokens"],
+        "lambda_invocations": two_step["lambda_invocations"] - single_pass["lambda_invocations"],
+        "cost_fraction": round(1 - single_pass["cost_usd"] / two_step["cost_usd"], 4) if two_step["cost_usd"] else None,
+        "p50_latency_ms": round(two_step["latency_ms"]["p50"] - single_pass["latency_ms"]["p50"], 1),
+    }
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.report:
+        with open(args.report, "w") as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
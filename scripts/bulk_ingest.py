@@ -0,0 +1,310 @@
+"""Backfill a directory of PDFs straight into Postgres.
+
+Runs the same classification, field extraction, chunking and embedding code as
+the classifier, extractor and embedding generator Lambdas, without going
+through S3 events and one Lambda invocation per document:
+
+  * PyPDF2 text extraction runs in a process pool (--extract-workers)
+  * documents are handled in batches (--batch-size); Bedrock fallbacks for
+    classification/extraction run concurrently (--llm-workers) and all chunks
+    of a batch share one embedding-cache lookup and one embedding stage
+    (--embed-concurrency); the handlers' Bedrock clients are rebuilt with
+    these worker counts as their in-flight caps
+  * rows are loaded with COPY, one transaction per batch
+  * finished files are appended to a checkpoint file so a rerun resumes
+  * documents are registered by content hash; files whose content is already
+    embedded are skipped unless --reprocess is given
+
+Routing (organized/ copies, DynamoDB metadata, notifications) is not performed.
+The Lambdas each read BEDROCK_MODEL_ID from their own environment; here the text
+model of the classification/extraction fallbacks (--llm-model-id) and the
+embedding model (--embedding-model-id) are set separately.
+
+    python scripts/bulk_ingest.py data/CompanyDocuments --dsn postgresql://... \\
+        --checkpoint ingest.checkpoint
+"""
+import argparse
+import csv
+import hashlib
+import io
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import psycopg2
+
+from lambda_modules import load_lambda
+
+logger = logging.getLogger("bulk_ingest")
+
+
+def extract_pdf(path):
+    # Runs in a worker process; text is None for files PyPDF2 cannot read
+    import PyPDF2
+
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+        reader = PyPDF2.PdfReader(io.BytesIO(data))
+        text = ""
+        for page in reader.pages:
+            text += page.extract_text() or ""
+    except Exception as e:
+        return path, None, None, str(e)
+    return path, hashlib.sha256(data).hexdigest(), text, None
+
+
+def find_pdfs(root):
+    for directory, _, files in sorted(os.walk(root)):
+        for name in sorted(files):
+            if name.lower().endswith(".pdf"):
+                yield os.path.join(directory, name)
+
+
+def load_checkpoint(path):
+    if not path or not os.path.exists(path):
+        return set()
+    with open(path) as f:
+        return {line.strip() for line in f if line.strip()}
+
+
+def batched(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def embedded_hashes(conn, hashes):
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT DISTINCT content_hash FROM documents WHERE content_hash = ANY(%s) AND status = 'embedded'",
+            (list(hashes),),
+        )
+        found = {row[0] for row in cur.fetchall()}
+    conn.commit()
+    return found
+
+
+def analyze(classifier, extractor, path, text):
+    document_type = classifier.classify_document(text)
+    fields = extractor.FIELDS_BY_TYPE.get(document_type, extractor.DEFAULT_FIELDS)
+    return document_type, extractor.extract_document_fields(document_type, text, fields)
+
+
+def copy_rows(cur, table, columns, rows):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+
+def load_batch(conn, embedder, documents):
+    # documents: list of (document_id, content_hash, document_type, fields, chunks, embeddings).
+    # Existing rows are replaced so a batch interrupted after commit but before
+    # its checkpoint write can be replayed safely.
+    document_ids = [document[0] for document in documents]
+    with conn.cursor() as cur:
+        # Cached chat answers built on the replaced chunks go with them
+        cur.execute(
+            """
+            WITH removed AS (DELETE FROM document_embeddings WHERE document_id = ANY(%s) RETURNING id)
+            DELETE FROM answer_cache WHERE chunk_ids && ARRAY(SELECT id FROM removed)
+            """,
+            (document_ids,),
+        )
+        cur.execute("DELETE FROM document_fields WHERE document_id = ANY(%s)", (document_ids,))
+        copy_rows(
+            cur,
+            "document_embeddings",
+            ("document_id", "document_type", "document_date", "customer", "chunk_text", "embedding"),
+            (
+                (document_id, document_type or "unknown", *metadata, chunk, "[" + ",".join(map(str, embedding)) + "]")
+                for document_id, _, document_type, fields, chunks, embeddings in documents
+                for metadata in [embedder.document_metadata(fields)]
+                for chunk, embedding in zip(chunks, embeddings)
+            ),
+        )
+        copy_rows(
+            cur,
+            "document_fields",
+            ("document_id", "document_type", "field_name", "field_value"),
+            (
+                (document_id, document_type, name, value)
+                for document_id, _, document_type, fields, _, _ in documents
+                for name, value in embedder.indexed_fields(document_type, fields)
+            ),
+        )
+        cur.execute(
+            """
+            INSERT INTO documents (document_id, content_hash, document_type, status)
+            SELECT document_id, content_hash, document_type, 'embedded'
+            FROM unnest(%s::varchar[], %s::char(64)[], %s::text[]) AS batch(document_id, content_hash, document_type)
+            ON CONFLICT (document_id) DO UPDATE
+            SET content_hash = EXCLUDED.content_hash, document_type = EXCLUDED.document_type,
+                status = 'embedded', duplicate_of = NULL, updated_at = now()
+            """,
+            (
+                document_ids,
+                [document[1] for document in documents],
+                [document[2] for document in documents],
+            ),
+        )
+    conn.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("source", help="directory searched recursively for PDFs")
+    parser.add_argument("--dsn", default=os.environ.get("DATABASE_URL"), help="Postgres DSN (default: $DATABASE_URL)")
+    parser.add_argument("--checkpoint", help="file listing finished PDFs; reruns skip them")
+    parser.add_argument("--document-prefix", default="incoming/",
+                        help="prepended to the file name to form document_id, matching the upload path")
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument("--extract-workers", type=int, default=os.cpu_count())
+    parser.add_argument("--llm-workers", type=int, default=8)
+    parser.add_argument("--embed-concurrency", type=int, default=16)
+    parser.add_argument("--llm-model-id", default="anthropic.claude-instant-v1",
+                        help="Bedrock text model for classification and extraction fallbacks")
+    parser.add_argument("--embedding-model-id", default="amazon.titan-embed-text-v1",
+                        help="Bedrock embedding model; must match the one the chat handler queries with")
+    parser.add_argument("--limit", type=int, help="stop after this many new documents")
+    parser.add_argument("--reprocess", action="store_true",
+                        help="re-embed files whose content is already registered as embedded")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    if not args.dsn:
+        parser.error("--dsn or DATABASE_URL is required")
+
+    classifier = load_lambda("classifier")
+    extractor = load_lambda("extractor")
+    embedder = load_lambda("embedding-generator")
+    classifier.BEDROCK_MODEL_ID = extractor.BEDROCK_MODEL_ID = args.llm_model_id
+    embedder.BEDROCK_MODEL_ID = args.embedding_model_id
+    embedder.EMBEDDING_CONCURRENCY = args.embed_concurrency
+    # The handlers' Bedrock clients cap requests in flight at BEDROCK_MAX_CONCURRENCY
+    # from import time; rebuild them so the worker counts above are not throttled by it
+    classifier.bedrock = classifier.BedrockRuntime(max_concurrency=args.llm_workers)
+    extractor.bedrock = extractor.BedrockRuntime(max_concurrency=args.llm_workers)
+    embedder.bedrock = embedder.BedrockRuntime(region_name="us-west-2", max_concurrency=args.embed_concurrency)
+    # The handlers log every step at INFO; keep the CLI output readable
+    logging.getLogger().setLevel(logging.WARNING)
+    logger.setLevel(logging.INFO)
+
+    done = load_checkpoint(args.checkpoint)
+    pending = [path for path in find_pdfs(args.source) if os.path.relpath(path, args.source) not in done]
+    if args.limit:
+        pending = pending[:args.limit]
+    logger.info(f"{len(pending)} PDFs to ingest ({len(done)} already checkpointed).")
+
+    conn = psycopg2.connect(args.dsn)
+    checkpoint = open(args.checkpoint, "a") if args.checkpoint else None
+    totals = {"documents": 0, "duplicates": 0, "chunks": 0, "cache_hits": 0, "cache_misses": 0}
+    timings = {"extract": 0.0, "analyze": 0.0, "embed": 0.0, "load": 0.0}
+    started = time.perf_counter()
+
+    try:
+        with ProcessPoolExecutor(max_workers=args.extract_workers) as pdf_pool, \
+                ThreadPoolExecutor(max_workers=args.llm_workers) as llm_pool:
+            # map() keeps the process pool busy ahead of the batch being loaded
+            extracted = pdf_pool.map(extract_pdf, pending, chunksize=4)
+            for batch_paths in batched(pending, args.batch_size):
+                stage = time.perf_counter()
+                results = [next(extracted) for _ in batch_paths]
+                timings["extract"] += time.perf_counter() - stage
+                for path, _, _, error in results:
+                    if error:
+                        logger.warning(f"Skipping {path}: {error}")
+                # Unreadable files are left out of the checkpoint so a rerun retries them
+                known = set() if args.reprocess else embedded_hashes(
+                    conn, {digest for _, digest, text, _ in results if text is not None}
+                )
+                fresh, duplicates = [], []
+                for result in results:
+                    path, digest, text, _ = result
+                    if text is None:
+                        continue
+                    if digest in known:
+                        duplicates.append(path)
+                    else:
+                        fresh.append(result)
+                        known.add(digest)
+                if duplicates:
+                    logger.info(f"Skipping {len(duplicates)} PDFs whose content is already embedded.")
+                batch_paths = [path for path, _, _, _ in fresh]
+                hashes = [digest for _, digest, _, _ in fresh]
+                texts = [text for _, _, text, _ in fresh]
+
+                stage = time.perf_counter()
+                analyses = list(llm_pool.map(
+                    lambda item: analyze(classifier, extractor, *item), zip(batch_paths, texts)
+                ))
+                timings["analyze"] += time.perf_counter() - stage
+
+                stage = time.perf_counter()
+                chunk_lists = [
+                    embedder.chunk_text(text, document_type) for text, (document_type, _) in zip(texts, analyses)
+                ]
+                all_chunks = [chunk for chunks in chunk_lists for chunk in chunks]
+                embeddings, cache_stats = embedder.generate_embeddings(conn, all_chunks)
+                timings["embed"] += time.perf_counter() - stage
+
+                stage = time.perf_counter()
+                documents, offset = [], 0
+                for path, digest, (document_type, fields), chunks in zip(batch_paths, hashes, analyses, chunk_lists):
+                    document_id = args.document_prefix + os.path.basename(path)
+                    documents.append(
+                        (document_id, digest, document_type, fields, chunks, embeddings[offset:offset + len(chunks)])
+                    )
+                    offset += len(chunks)
+                if documents:
+                    load_batch(conn, embedder, documents)
+                timings["load"] += time.perf_counter() - stage
+
+                if checkpoint:
+                    checkpoint.write("".join(
+                        os.path.relpath(path, args.source) + "\n" for path in batch_paths + duplicates
+                    ))
+                    checkpoint.flush()
+
+                totals["documents"] += len(batch_paths)
+                totals["duplicates"] += len(duplicates)
+                totals["chunks"] += len(all_chunks)
+                totals["cache_hits"] += cache_stats["cache_hits"]
+                totals["cache_misses"] += cache_stats["cache_misses"]
+                elapsed = time.perf_counter() - started
+                logger.info(
+                    f"{totals['documents']}/{len(pending)} documents, "
+                    f"{totals['documents'] / elapsed:.2f} docs/s, {totals['chunks']} chunks"
+                )
+    finally:
+        if checkpoint:
+            checkpoint.close()
+        conn.close()
+
+    elapsed = time.perf_counter() - started
+    print(json.dumps({
+        **totals,
+        "seconds": round(elapsed, 2),
+        "documents_per_second": round(totals["documents"] / elapsed, 2) if elapsed else None,
+        "stage_seconds": {stage: round(seconds, 2) for stage, seconds in timings.items()},
+        "workers": {
+            "extract": args.extract_workers,
+            # Requests actually in flight at most, after the Bedrock clients' caps
+            "llm": min(args.llm_workers, classifier.bedrock.max_concurrency, extractor.bedrock.max_concurrency),
+            "embed": min(embedder.EMBEDDING_CONCURRENCY, embedder.bedrock.max_concurrency),
+            "batch_size": args.batch_size,
+        },
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
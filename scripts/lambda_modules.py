@@ -0,0 +1,32 @@
+"""Load a Lambda's app.py as a uniquely named module for local tooling.
+
+Every function directory has its own app.py plus sibling modules, so they are
+imported by path instead of by name.
+"""
+import importlib.util
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAMBDA_DIR = os.path.join(ROOT, "lambda")
+
+
+def load_lambda(function_dir, instance=None):
+    # A distinct `instance` loads a separate copy with its own module state,
+    # like a separate execution environment of the function
+    module_name = f"{function_dir.replace('-', '_')}_app"
+    if instance is not None:
+        module_name += f"_{instance}"
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+
+    directory = os.path.join(LAMBDA_DIR, function_dir)
+    # Sibling modules (templates.py, text_store.py, ...) are imported by plain name
+    if directory not in sys.path:
+        sys.path.append(directory)
+
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(directory, "app.py"))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
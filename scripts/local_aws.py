@@ -0,0 +1,297 @@
+"""In-memory stand-ins for the AWS clients used by the Lambdas.
+
+They implement only the calls and response shapes our handlers rely on, so the
+handlers can run locally without an AWS account.
+"""
+import hashlib
+import io
+import json
+import math
+import queue
+import random
+import re
+import threading
+import time
+import uuid
+
+from botocore.exceptions import ClientError
+
+
+def _client_error(code, operation, message):
+    return ClientError({"Error": {"Code": code, "Message": message}}, operation)
+
+
+class LocalS3:
+    def __init__(self):
+        self.objects = {}
+        self.calls = {}
+        self._lock = threading.Lock()
+
+    def _count(self, operation):
+        with self._lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+
+    def _get(self, operation, bucket, key):
+        try:
+            return self.objects[(bucket, key)]
+        except KeyError:
+            raise _client_error("404", operation, f"s3://{bucket}/{key} not found") from None
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self._count("PutObject")
+        if hasattr(Body, "read"):
+            Body = Body.read()
+        if isinstance(Body, str):
+            Body = Body.encode("utf-8")
+        with self._lock:
+            self.objects[(Bucket, Key)] = {"Body": bytes(Body), **kwargs}
+        return {}
+
+    def get_object(self, Bucket, Key, **kwargs):
+        self._count("GetObject")
+        stored = self._get("GetObject", Bucket, Key)
+        return {"Body": io.BytesIO(stored["Body"]), "ContentLength": len(stored["Body"])}
+
+    def head_object(self, Bucket, Key, **kwargs):
+        self._count("HeadObject")
+        stored = self._get("HeadObject", Bucket, Key)
+        return {"ContentLength": len(stored["Body"])}
+
+    def copy_object(self, Bucket, CopySource, Key, **kwargs):
+        self._count("CopyObject")
+        source_bucket, source_key = CopySource.lstrip("/").split("/", 1)
+        stored = self._get("CopyObject", source_bucket, source_key)
+        with self._lock:
+            self.objects[(Bucket, Key)] = dict(stored)
+        return {}
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        self._count("DeleteObject")
+        with self._lock:
+            self.objects.pop((Bucket, Key), None)
+        return {}
+
+
+class LocalDynamoDB:
+    def __init__(self):
+        self.tables = {}
+        self._lock = threading.Lock()
+
+    def put_item(self, TableName, Item, **kwargs):
+        with self._lock:
+            self.tables.setdefault(TableName, []).append(Item)
+        return {}
+
+
+class LocalSNS:
+    def __init__(self):
+        self.messages = []
+        self._lock = threading.Lock()
+
+    def publish(self, TopicArn, Message, Subject=None, **kwargs):
+        with self._lock:
+            self.messages.append({"TopicArn": TopicArn, "Subject": Subject, "Message": Message})
+        return {"MessageId": str(uuid.uuid4())}
+
+
+class LocalSES:
+    def __init__(self):
+        self.emails = []
+        self._lock = threading.Lock()
+
+    def send_email(self, Source, Destination, Message, **kwargs):
+        with self._lock:
+            self.emails.append({"Source": Source, "Destination": Destination, "Message": Message})
+        return {"MessageId": str(uuid.uuid4())}
+
+
+EMBEDDING_TERM = re.compile(r"\w+")
+
+
+def hashed_embedding(text, dimensions=1536):
+    # Deterministic stand-in for Titan: signed feature hashing of words and
+    # word bigrams, L2-normalized
+    terms = EMBEDDING_TERM.findall(text.lower())
+    features = terms + [f"{a} {b}" for a, b in zip(terms, terms[1:])]
+    vector = [0.0] * dimensions
+    for feature in features:
+        digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+        bucket = int.from_bytes(digest[:4], "little") % dimensions
+        vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+    norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+    return [round(value / norm, 6) for value in vector]
+
+
+class LocalBedrock:
+    # invoke_model with a configurable latency per request kind, a concurrency limit above which
+    # requests are throttled, and a random throttling rate. Titan requests
+    # ("inputText") get hashed embeddings; completion prompts, text-completion or
+    # Messages API, get the reply of complete(): "unknown" for classification, an
+    # "unknown" document with no fields for the combined classify-and-extract
+    # prompt and an empty JSON object otherwise. Token-count headers are
+    # estimated from the prompt and reply lengths. Like Bedrock, a request of
+    # the wrong kind for the model (a prompt to an embedding model, inputText
+    # to a text model) fails with a ValidationException.
+
+    def __init__(self, embedding_latency=0.15, completion_latency=1.0, jitter=0.0, max_concurrency=None,
+                 throttle_rate=0.0, seed=0):
+        self.latency = {"embedding": embedding_latency, "completion": completion_latency}
+        self.jitter = jitter
+        self.max_concurrency = max_concurrency
+        self.throttle_rate = throttle_rate
+        self.calls = {}
+        self.throttled = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def invoke_model(self, modelId, body, **kwargs):
+        request = json.loads(body)
+        kind = "embedding" if "inputText" in request else "completion"
+        if (kind == "embedding") != ("embed" in modelId):
+            raise _client_error("ValidationException", "InvokeModel", f"Malformed input request for model {modelId}")
+        with self._lock:
+            self.calls[kind] = self.calls.get(kind, 0) + 1
+            throttled = (
+                (self.max_concurrency is not None and self.in_flight >= self.max_concurrency)
+                or self._random.random() < self.throttle_rate
+            )
+            if throttled:
+                self.throttled += 1
+            else:
+                self.in_flight += 1
+                self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            delay = self.latency[kind] + self._random.uniform(-self.jitter, self.jitter)
+        if throttled:
+            raise _client_error("ThrottlingException", "InvokeModel", "Too many requests, please wait before trying again.")
+        try:
+            time.sleep(max(delay, 0.0))
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+        if kind == "embedding":
+            result = {"embedding": hashed_embedding(request["inputText"]), "inputTextTokenCount": 0}
+            return {"body": io.BytesIO(json.dumps(result).encode("utf-8"))}
+        if "messages" in request:
+            prompt = "".join(block["text"] for message in request["messages"] for block in message["content"])
+        else:
+            prompt = request["prompt"]
+        completion = self.complete(prompt)
+        usage = {"input_tokens": len(prompt) // 4, "output_tokens": max(len(completion) // 4, 1)}
+        if "messages" in request:
+            result = {"content": [{"type": "text", "text": completion}], "usage": usage}
+        else:
+            result = {"completion": completion}
+        return {
+            "body": io.BytesIO(json.dumps(result).encode("utf-8")),
+            "ResponseMetadata": {"HTTPHeaders": {
+                "x-amzn-bedrock-input-token-count": str(usage["input_tokens"]),
+                "x-amzn-bedrock-output-token-count": str(usage["output_tokens"]),
+            }},
+        }
+
+    def complete(self, prompt):
+        # Reply to a completion prompt; override for smarter answers
+        if "document_type" in prompt:
+            return json.dumps({"document_type": "unknown", "fields": {}})
+        return "unknown" if "Classify this document" in prompt else "{}"
+
+
+class LocalContext:
+    def __init__(self, function_name):
+        self.function_name = function_name
+        self.aws_request_id = str(uuid.uuid4())
+
+
+class LocalLambda:
+    # Asynchronous ("Event") invocations only. Each registered function has a
+    # queue and one worker thread per handler; pass one handler per concurrent
+    # execution environment. Failed invocations are retried up to max_retries
+    # times like async Lambda invocations, without the back-off delay. Every
+    # attempt is recorded in `invocations`.
+
+    def __init__(self, max_retries=2):
+        self.max_retries = max_retries
+        self.invocations = []
+        self.peak_queue_depth = {}
+        self._functions = {}
+        self._pending = 0
+        self._condition = threading.Condition()
+
+    def register(self, function_name, handlers, describe=None):
+        # describe(event) labels the invocation records, e.g. with the document key
+        work = queue.Queue()
+        self._functions[function_name] = (work, describe)
+        self.peak_queue_depth[function_name] = 0
+        for handler in handlers:
+            threading.Thread(target=self._worker, args=(function_name, handler, work), daemon=True).start()
+
+    def invoke(self, FunctionName, Payload=b"", InvocationType="RequestResponse", **kwargs):
+        if InvocationType != "Event":
+            raise _client_error("InvalidParameterValueException", "Invoke", "only Event invocations are supported")
+        if FunctionName not in self._functions:
+            raise _client_error("ResourceNotFoundException", "Invoke", f"Function not found: {FunctionName}")
+        work, _ = self._functions[FunctionName]
+        with self._condition:
+            self._pending += 1
+        work.put((Payload, time.perf_counter(), 0))
+        with self._condition:
+            self.peak_queue_depth[FunctionName] = max(self.peak_queue_depth[FunctionName], work.qsize())
+        return {"StatusCode": 202}
+
+    def wait(self, timeout=None):
+        # Blocks until every queued invocation, including retries, has finished
+        with self._condition:
+            return self._condition.wait_for(lambda: self._pending == 0, timeout)
+
+    def _worker(self, function_name, handler, work):
+        _, describe = self._functions[function_name]
+        while True:
+            payload, enqueued_at, attempt = work.get()
+            event = json.loads(payload)
+            started = time.perf_counter()
+            error, retry = None, False
+            try:
+                result = handler(event, LocalContext(function_name))
+                # Some handlers report failures as a 5xx response instead of raising
+                if isinstance(result, dict) and result.get("statusCode", 200) >= 500:
+                    error = str(result.get("body"))
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+                retry = attempt < self.max_retries
+            finished = time.perf_counter()
+            with self._condition:
+                self.invocations.append({
+                    "function": function_name,
+                    "key": describe(event) if describe else None,
+                    "attempt": attempt,
+                    "enqueued_at": enqueued_at,
+                    "started_at": started,
+                    "finished_at": finished,
+                    "error": error,
+                })
+                if not retry:
+                    self._pending -= 1
+                    self._condition.notify_all()
+            if retry:
+                work.put((payload, finished, attempt + 1))
+
+
+def install_clients(module, clients):
+    # Replaces a Lambda module's boto3 clients, lazy (aws_clients.LazyClient)
+    # or built at import time, with stand-ins matched by service name ("s3",
+    # "bedrock-runtime", "lambda", ...). Lazy clients are matched without being built.
+    for name, value in list(vars(module).items()):
+        if type(value).__name__ == "LazyClient":
+            service_name = value.service_name
+        elif type(getattr(value, "client", None)).__name__ == "LazyClient":
+            # Wrappers such as bedrock_runtime.BedrockRuntime hold their client in .client
+            install_clients(value, clients)
+            continue
+        else:
+            service_model = getattr(getattr(value, "meta", None), "service_model", None)
+            service_name = service_model.service_name if service_model is not None else None
+        if service_name in clients:
+            setattr(module, name, clients[service_name])
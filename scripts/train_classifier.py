@@ -0,0 +1,208 @@
+"""Train the local document classifier and report how much Bedrock it saves.
+
+Trains lambda/classifier/local_classifier.py on data/company-document-text.csv,
+evaluates it on a deterministic 20% hold-out split and writes the artifact
+shipped with the classifier Lambda.
+
+The CSV only holds the four templated types, so the out-of-domain guard is
+checked on generated documents of types the model never saw (receipts,
+contracts, memos, bank statements, CVs): every one of them should go to
+Bedrock. The report gives the share each type would keep locally with and
+without the vocabulary-coverage guard.
+
+    python scripts/train_classifier.py [--threshold 0.9] [--min-coverage 0.4] [--report report.json]
+"""
+import argparse
+import csv
+import hashlib
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "lambda", "classifier"))
+
+from local_classifier import CSV_LABELS, LocalClassifier, train  # noqa: E402
+
+DEFAULT_CSV = os.path.join(ROOT, "data", "company-document-text.csv")
+DEFAULT_MODEL = os.path.join(ROOT, "lambda", "classifier", "classifier_model.json")
+
+
+def load_samples(path):
+    with open(path, newline="") as f:
+        return [(row["text"], CSV_LABELS[row["label"]]) for row in csv.DictReader(f)]
+
+
+def receipt(rng):
+    items = "\n".join(
+        f"{rng.choice(['coffee', 'bagel', 'sandwich', 'water', 'salad', 'muffin'])} {rng.randint(1, 3)} x {rng.randint(1, 20)}.{rng.randint(0, 99):02d}"
+        for _ in range(rng.randint(2, 6))
+    )
+    return (
+        f"{rng.choice(['Corner Cafe', 'QuickMart', 'Fresh Foods', 'City Diner'])}\nReceipt #{rng.randint(1000, 99999)}\n"
+        f"Date: 2023-0{rng.randint(1, 9)}-1{rng.randint(0, 9)} Time: 1{rng.randint(0, 9)}:{rng.randint(10, 59)}\n"
+        f"Cashier: {rng.choice(['Ann', 'Bob', 'Lee'])}\n{items}\nSubtotal {rng.randint(10, 90)}.{rng.randint(10, 99)}\n"
+        f"Tax {rng.randint(1, 9)}.{rng.randint(10, 99)}\nTotal {rng.randint(10, 99)}.{rng.randint(10, 99)}\n"
+        f"Paid by {rng.choice(['VISA', 'Mastercard', 'Cash'])} ****{rng.randint(1000, 9999)}\nThank you for shopping with us!"
+    )
+
+
+def contract(rng):
+    provider = rng.choice(["Acme Corp", "Globex Ltd", "Initech LLC"])
+    customer = rng.choice(["Northwind Traders", "Contoso Inc", "Fabrikam"])
+    return (
+        f"SERVICE AGREEMENT\nThis Agreement is entered into on 2023-0{rng.randint(1, 9)}-0{rng.randint(1, 9)} by and between "
+        f"{provider} (the \"Provider\") and {customer} (the \"Customer\").\n"
+        f"1. Term. This Agreement shall commence on the Effective Date and continue for {rng.randint(1, 5)} years.\n"
+        f"2. Payment. Customer shall pay Provider ${rng.randint(1, 90)},000 per month within 30 days of invoice.\n"
+        "3. Confidentiality. Each party shall keep confidential all information disclosed by the other party.\n"
+        "4. Governing Law. This Agreement shall be governed by the laws of the State of New York.\n"
+        "5. Termination. Either party may terminate this Agreement upon 60 days written notice.\n"
+        f"IN WITNESS WHEREOF the parties have executed this Agreement.\nSigned: {provider} Signed: {customer}"
+    )
+
+
+def memo(rng):
+    return (
+        f"MEMORANDUM\nTo: All staff\nFrom: {rng.choice(['HR', 'Facilities', 'IT Department'])}\n"
+        f"Date: 2023-1{rng.randint(0, 2)}-0{rng.randint(1, 9)}\n"
+        f"Subject: {rng.choice(['Office closure', 'Password reset policy', 'Holiday schedule'])}\n"
+        "Please be advised that the office will be closed for maintenance. Employees should save their work and "
+        "shut down their computers before leaving. Contact your manager with any questions regarding this notice."
+    )
+
+
+def bank_statement(rng):
+    rows = "\n".join(
+        f"2023-05-{day:02d} {rng.choice(['ATM withdrawal', 'Deposit', 'Transfer', 'Card payment'])} "
+        f"{rng.randint(10, 900)}.{rng.randint(10, 99)}"
+        for day in range(1, rng.randint(5, 12))
+    )
+    return (
+        f"Bank Statement\nAccount holder: {rng.choice(['John Smith', 'Maria Garcia'])}\n"
+        f"Account number {rng.randint(10 ** 7, 10 ** 8)}\nStatement period 2023-05-01 to 2023-05-31\n"
+        f"Opening balance {rng.randint(100, 9000)}.00\n{rows}\nClosing balance {rng.randint(100, 9000)}.00"
+    )
+
+
+def cv(rng):
+    return (
+        f"{rng.choice(['Jane Doe', 'Sam Lee'])}\nCurriculum Vitae\nEmail: someone@example.com Phone: 555-{rng.randint(1000, 9999)}\n"
+        "Experience\nSoftware Engineer, Example Company, 2018-2023\nDesigned and maintained web services.\n"
+        "Education\nBSc Computer Science, State University, 2017\nSkills: Python, SQL, cloud infrastructure"
+    )
+
+
+# Document types outside the training CSV, generated for the out-of-domain check
+OUT_OF_DOMAIN = {"receipt": receipt, "contract": contract, "memo": memo, "bank_statement": bank_statement, "cv": cv}
+
+
+def out_of_domain_samples(per_type, seed=11):
+    rng = random.Random(seed)
+    return [(kind, generate(rng)) for kind, generate in OUT_OF_DOMAIN.items() for _ in range(per_type)]
+
+
+def evaluate_out_of_domain(model, samples, threshold, min_coverage):
+    # Share of documents the classifier would label locally instead of sending to Bedrock
+    report = {}
+    for name, coverage in (("with_guard", min_coverage), ("without_guard", 0.0)):
+        classifier = LocalClassifier(model, min_coverage=coverage)
+        kept = {}
+        for kind, text in samples:
+            label, confidence = classifier.predict(text)
+            kept.setdefault(kind, []).append(label if confidence >= threshold else None)
+        report[name] = {
+            "kept_locally": round(sum(label is not None for labels in kept.values() for label in labels) / len(samples), 4),
+            "per_type": {
+                kind: {
+                    "kept_locally": round(sum(label is not None for label in labels) / len(labels), 4),
+                    "labels": {label: labels.count(label) for label in sorted(set(labels) - {None})},
+                }
+                for kind, labels in sorted(kept.items())
+            },
+        }
+    return {"samples": len(samples), **report}
+
+
+def is_holdout(text):
+    return hashlib.sha1(text.encode("utf-8")).digest()[0] % 5 == 0
+
+
+def evaluate(classifier, samples, threshold):
+    latencies = []
+    correct = confident = confident_correct = 0
+    per_label = {}
+    for text, label in samples:
+        started = time.perf_counter()
+        predicted, confidence = classifier.predict(text)
+        latencies.append((time.perf_counter() - started) * 1000)
+
+        stats = per_label.setdefault(label, {"total": 0, "correct": 0})
+        stats["total"] += 1
+        if predicted == label:
+            correct += 1
+            stats["correct"] += 1
+        if confidence >= threshold:
+            confident += 1
+            confident_correct += predicted == label
+
+    latencies.sort()
+    return {
+        "samples": len(samples),
+        "threshold": threshold,
+        "accuracy": round(correct / len(samples), 4),
+        "accuracy_when_confident": round(confident_correct / confident, 4) if confident else None,
+        "bedrock_calls_avoided": round(confident / len(samples), 4),
+        "latency_ms": {
+            "mean": round(statistics.mean(latencies), 3),
+            "p50": round(latencies[len(latencies) // 2], 3),
+            "p95": round(latencies[int(len(latencies) * 0.95)], 3),
+        },
+        "per_label_accuracy": {
+            label: round(stats["correct"] / stats["total"], 4) for label, stats in sorted(per_label.items())
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--csv", default=DEFAULT_CSV)
+    parser.add_argument("--model", default=DEFAULT_MODEL, help="where to write the trained artifact")
+    parser.add_argument("--threshold", type=float, default=0.9)
+    parser.add_argument("--min-coverage", type=float, default=0.4,
+                        help="known-feature share below which a document is out of domain")
+    parser.add_argument("--out-of-domain-per-type", type=int, default=40,
+                        help="generated documents per out-of-domain type")
+    parser.add_argument("--max-features", type=int, default=400)
+    parser.add_argument("--report", help="also write the evaluation report to this JSON file")
+    args = parser.parse_args()
+
+    samples = load_samples(args.csv)
+    training = [sample for sample in samples if not is_holdout(sample[0])]
+    holdout = [sample for sample in samples if is_holdout(sample[0])]
+
+    trained = train(training, args.max_features)
+    report = evaluate(LocalClassifier(trained, min_coverage=args.min_coverage), holdout, args.threshold)
+    report["train_samples"] = len(training)
+    report["min_coverage"] = args.min_coverage
+    report["out_of_domain"] = evaluate_out_of_domain(
+        trained, out_of_domain_samples(args.out_of_domain_per_type), args.threshold, args.min_coverage
+    )
+
+    # The shipped artifact is trained on the whole corpus
+    model = train(samples, args.max_features)
+    with open(args.model, "w") as f:
+        json.dump(model, f, separators=(",", ":"))
+    report["model_bytes"] = os.path.getsize(args.model)
+
+    print(json.dumps(report, indent=2))
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -19,12 +19,18 @@ function App() {
     conversations,
     activeConversationId,
     activeConversation,
+    hasMoreConversations,
+    hasOlderMessages,
     createConversation,
+    linkServerConversation,
     deleteConversation,
     addMessage,
+    updateMessage,
     updateUploadState,
     updateMultiUploadState,
-    switchConversation
+    switchConversation,
+    loadMoreConversations,
+    loadOlderMessages
   } = useConversationHistory();
 
   const [sidebarOpen, setSidebarOpen] = useState(false);
@@ -79,8 +85,11 @@ function App() {
 
     await sendMessage(
       content,
+      activeConversation?.serverId,
+      (serverId) => linkServerConversation(activeConversationId, serverId),
       (userMessage) => addMessage(activeConversationId, userMessage),
-      (assistantMessage) => addMessage(activeConversationId, assistantMessage)
+      (assistantMessage) => addMessage(activeConversationId, assistantMessage),
+      (messageId, content) => updateMessage(activeConversationId, messageId, content)
     );
   };
 
@@ -130,6 +139,8 @@ function App() {
         onSelectConversation={handleSelectConversation}
         onNewConversation={handleNewConversation}
         onDeleteConversation={handleDeleteConversation}
+        hasMoreConversations={hasMoreConversations}
+        onLoadMoreConversations={loadMoreConversations}
         isOpen={sidebarOpen}
         onToggle={() => setSidebarOpen(!sidebarOpen)}
       />
@@ -250,6 +261,8 @@ function App() {
             <ChatInterface
               messages={activeConversation!.messages}
               onSendMessage={handleSendMessage}
+              hasOlderMessages={hasOlderMessages}
+              onLoadOlderMessages={() => loadOlderMessages(activeConversation!.id)}
               isTyping={isTyping}
               conversationLocked={conversationLocked}
               fileName={activeConversation!.uploadState.file?.name}
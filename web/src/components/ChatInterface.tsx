@@ -12,6 +12,8 @@ interface Message {
 interface ChatInterfaceProps {
   messages: Message[];
   onSendMessage: (message: string) => void;
+  hasOlderMessages?: boolean;
+  onLoadOlderMessages?: () => void;
   isTyping: boolean;
   conversationLocked: boolean;
   fileName?: string;
@@ -21,6 +23,8 @@ interface ChatInterfaceProps {
 export default function ChatInterface({ 
   messages, 
   onSendMessage, 
+  hasOlderMessages,
+  onLoadOlderMessages,
   isTyping, 
   conversationLocked,
   fileName,
@@ -34,9 +38,11 @@ export default function ChatInterface({
     messagesEndRef.current?.scrollIntoView({ behavior: 'smooth' });
   };
 
+  // Follow new and streaming messages; loading older ones keeps the last message
+  const lastMessage = messages[messages.length - 1];
   useEffect(() => {
     scrollToBottom();
-  }, [messages, isTyping]);
+  }, [lastMessage, isTyping]);
 
   const handleSubmit = (e: React.FormEvent) => {
     e.preventDefault();
@@ -106,6 +112,17 @@ export default function ChatInterface({
           </div>
         )}
         
+        {hasOlderMessages && onLoadOlderMessages && (
+          <div className="text-center">
+            <button
+              onClick={onLoadOlderMessages}
+              className="px-4 py-1 text-sm text-blue-600 hover:text-blue-700 hover:bg-white rounded-lg transition-colors"
+            >
+              Load earlier messages
+            </button>
+          </div>
+        )}
+
         {messages.map((message) => (
           <MessageBubble key={message.id} message={message} />
         ))}
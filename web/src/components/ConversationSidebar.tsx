@@ -18,6 +18,8 @@ interface ConversationSidebarProps {
   onSelectConversation: (id: string) => void;
   onNewConversation: () => void;
   onDeleteConversation: (id: string) => void;
+  hasMoreConversations: boolean;
+  onLoadMoreConversations: () => void;
   isOpen: boolean;
   onToggle: () => void;
 }
@@ -28,6 +30,8 @@ export default function ConversationSidebar({
   onSelectConversation,
   onNewConversation,
   onDeleteConversation,
+  hasMoreConversations,
+  onLoadMoreConversations,
   isOpen,
   onToggle
 }: ConversationSidebarProps) {
@@ -177,9 +181,11 @@ export default function ConversationSidebar({
                           <span className="text-xs text-gray-400">
                             {formatDate(conversation.updatedAt)}
                           </span>
-                          <span className="text-xs text-gray-400">
-                            • {conversation.messages.length} messages
-                          </span>
+                          {conversation.messagesLoaded !== false && (
+                            <span className="text-xs text-gray-400">
+                              • {conversation.messages.length} messages
+                            </span>
+                          )}
                         </div>
                       </div>
                     </div>
@@ -197,6 +203,16 @@ export default function ConversationSidebar({
                     </button>
                   </div>
                 ))}
+
+                {/* Next page of conversations stored by the chat API */}
+                {hasMoreConversations && !searchQuery && (
+                  <button
+                    onClick={onLoadMoreConversations}
+                    className="w-full py-2 text-sm text-blue-600 hover:text-blue-700 hover:bg-gray-50 rounded-lg transition-colors"
+                  >
+                    Load more conversations
+                  </button>
+                )}
               </div>
             )}
           </div>
@@ -77,8 +77,10 @@ export default function MultiFileUpload({
         return `Processing documents... (${uploadState.completedCount}/${uploadState.totalCount})`;
       case 'ready':
         return `Ready to chat with ${uploadState.totalCount} document${uploadState.totalCount > 1 ? 's' : ''}`;
-      case 'error':
-        return 'Some files failed to upload';
+      case 'error': {
+        const failedCount = uploadState.files.filter(item => item.status === 'error').length;
+        return `${failedCount} of ${uploadState.totalCount} file${uploadState.totalCount > 1 ? 's' : ''} failed to upload`;
+      }
       default:
         return selectedFiles.length > 0 
           ? `${selectedFiles.length} file${selectedFiles.length > 1 ? 's' : ''} selected`
@@ -0,0 +1,133 @@
+// Browser-to-S3 uploads: the upload API hands out presigned URLs and the file
+// bytes never pass through API Gateway or Lambda
+const UPLOADS_API_URL = import.meta.env.VITE_UPLOADS_API_URL || '/api/uploads';
+
+// Files, and parts of one multipart upload, sent at the same time
+export const FILE_CONCURRENCY = 3;
+const PART_CONCURRENCY = 4;
+
+interface UploadPart {
+  part_number: number;
+  url: string;
+}
+
+export interface UploadTarget {
+  name: string;
+  key: string;
+  method: 'PUT' | 'MULTIPART';
+  url?: string;
+  headers?: Record<string, string>;
+  upload_id?: string;
+  part_size?: number;
+  parts?: UploadPart[];
+}
+
+async function postJson<T>(url: string, body: unknown): Promise<T> {
+  const response = await fetch(url, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify(body),
+  });
+  const data = await response.json().catch(() => ({}));
+  if (!response.ok) {
+    throw new Error(data.message || `Request to ${url} failed`);
+  }
+  return data as T;
+}
+
+// One request for the upload targets of every file
+export async function requestUploads(files: File[]): Promise<UploadTarget[]> {
+  const data = await postJson<{ uploads: UploadTarget[] }>(UPLOADS_API_URL, {
+    files: files.map(file => ({
+      name: file.name,
+      size: file.size,
+      content_type: file.type || 'application/pdf',
+    })),
+  });
+  return data.uploads;
+}
+
+// fetch() cannot report upload progress, so PUTs go through XMLHttpRequest.
+// Resolves with the ETag, which the bucket's CORS rule must expose.
+function putWithProgress(
+  url: string,
+  body: Blob,
+  headers: Record<string, string>,
+  onProgress: (loaded: number) => void
+): Promise<string> {
+  return new Promise((resolve, reject) => {
+    const request = new XMLHttpRequest();
+    request.open('PUT', url);
+    Object.entries(headers).forEach(([name, value]) => request.setRequestHeader(name, value));
+    request.upload.onprogress = event => onProgress(event.loaded);
+    request.onload = () => {
+      if (request.status >= 200 && request.status < 300) {
+        onProgress(body.size);
+        resolve(request.getResponseHeader('ETag') || '');
+      } else {
+        reject(new Error(`Upload failed with status ${request.status}`));
+      }
+    };
+    request.onerror = () => reject(new Error('Upload failed: network error'));
+    request.send(body);
+  });
+}
+
+// Runs worker over items with at most `limit` in flight; rejects with the first error
+export async function runPool<T>(
+  items: T[],
+  limit: number,
+  worker: (item: T, index: number) => Promise<void>
+): Promise<void> {
+  let next = 0;
+  const lanes = Array.from({ length: Math.min(limit, items.length) }, async () => {
+    while (next < items.length) {
+      const index = next++;
+      await worker(items[index], index);
+    }
+  });
+  await Promise.all(lanes);
+}
+
+// Uploads one file to its target; onProgress receives the fraction sent (0-1).
+// A multipart upload is completed through the API, which creates the object
+// and so starts processing; on failure it is aborted.
+export async function uploadToTarget(
+  file: File,
+  target: UploadTarget,
+  onProgress: (fraction: number) => void
+): Promise<void> {
+  const report = (loaded: number) => onProgress(file.size ? Math.min(loaded / file.size, 1) : 1);
+
+  if (target.method === 'PUT') {
+    await putWithProgress(target.url!, file, target.headers || {}, report);
+    return;
+  }
+
+  const parts = target.parts!;
+  const partSize = target.part_size!;
+  const loadedByPart = parts.map(() => 0);
+  const etags: { part_number: number; etag: string }[] = [];
+  const upload = { key: target.key, upload_id: target.upload_id };
+
+  try {
+    await runPool(parts, PART_CONCURRENCY, async (part, index) => {
+      const start = (part.part_number - 1) * partSize;
+      const etag = await putWithProgress(part.url, file.slice(start, start + partSize), {}, loaded => {
+        loadedByPart[index] = loaded;
+        report(loadedByPart.reduce((sum, value) => sum + value, 0));
+      });
+      etags[index] = { part_number: part.part_number, etag };
+    });
+
+    const result = await postJson<{ failed: { message: string }[] }>(`${UPLOADS_API_URL}/complete`, {
+      uploads: [{ ...upload, parts: etags }],
+    });
+    if (result.failed.length > 0) {
+      throw new Error(result.failed[0].message);
+    }
+  } catch (error) {
+    await postJson(`${UPLOADS_API_URL}/abort`, { uploads: [upload] }).catch(() => undefined);
+    throw error;
+  }
+}
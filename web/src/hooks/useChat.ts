@@ -1,14 +1,67 @@
 import { useState, useCallback } from 'react';
 import { Message } from '../types';
 
+const CHAT_API_URL = import.meta.env.VITE_CHAT_API_URL || '/api/chat';
+// Function URL of the streaming ChatQueryHandler; falls back to the buffered API when unset
+const CHAT_STREAM_URL = import.meta.env.VITE_CHAT_STREAM_URL;
+
+interface StreamEvent {
+  event: string;
+  data: Record<string, string>;
+}
+
+function parseEvent(block: string): StreamEvent | null {
+  let event = 'message';
+  const dataLines: string[] = [];
+  for (const line of block.split('\n')) {
+    if (line.startsWith('event:')) {
+      event = line.slice(6).trim();
+    } else if (line.startsWith('data:')) {
+      dataLines.push(line.slice(5).trim());
+    }
+  }
+  if (dataLines.length === 0) {
+    return null;
+  }
+  return { event, data: JSON.parse(dataLines.join('\n')) };
+}
+
+async function* readEvents(response: Response): AsyncGenerator<StreamEvent> {
+  const reader = response.body!.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) {
+      break;
+    }
+    buffer += decoder.decode(value, { stream: true });
+
+    let boundary = buffer.indexOf('\n\n');
+    while (boundary !== -1) {
+      const parsed = parseEvent(buffer.slice(0, boundary));
+      buffer = buffer.slice(boundary + 2);
+      if (parsed) {
+        yield parsed;
+      }
+      boundary = buffer.indexOf('\n\n');
+    }
+  }
+}
+
 export function useChat() {
   const [isTyping, setIsTyping] = useState(false);
-  const [conversationId, setConversationId] = useState<string | null>(null);
 
+  // conversationId is the chat API's ID for the conversation, undefined for its
+  // first message; onConversationStarted receives the ID the API assigns then
   const sendMessage = useCallback(async (
     content: string,
+    conversationId: string | undefined,
+    onConversationStarted: (conversationId: string) => void,
     onMessageSent: (userMessage: Message) => void,
-    onResponseReceived: (assistantMessage: Message) => void
+    onResponseReceived: (assistantMessage: Message) => void,
+    onResponseUpdated?: (messageId: string, content: string) => void
   ) => {
     const userMessage: Message = {
       id: Date.now().toString(),
@@ -21,11 +74,53 @@ export function useChat() {
     setIsTyping(true);
 
     try {
-      let url = import.meta.env.VITE_CHAT_API_URL || '/api/chat';
-      if (conversationId) {
-        url = `${import.meta.env.VITE_CHAT_API_URL || '/api/chat'}/${conversationId}`;
+      if (CHAT_STREAM_URL && onResponseUpdated) {
+        const url = conversationId
+          ? `${CHAT_STREAM_URL}/chat/${conversationId}/stream`
+          : `${CHAT_STREAM_URL}/chat/stream`;
+
+        const response = await fetch(url, {
+          method: 'POST',
+          headers: {
+            'Content-Type': 'application/json',
+          },
+          body: JSON.stringify({ query: content }),
+        });
+
+        if (!response.ok || !response.body) {
+          throw new Error('Failed to send message');
+        }
+
+        const messageId = (Date.now() + 1).toString();
+        let text = '';
+        let received = false;
+
+        for await (const { event, data } of readEvents(response)) {
+          if (event === 'start' && !conversationId) {
+            onConversationStarted(data.conversation_id);
+          } else if (event === 'token') {
+            text += data.text;
+            if (!received) {
+              received = true;
+              setIsTyping(false);
+              onResponseReceived({
+                id: messageId,
+                content: text,
+                sender: 'assistant',
+                timestamp: new Date()
+              });
+            } else {
+              onResponseUpdated(messageId, text);
+            }
+          } else if (event === 'error') {
+            throw new Error(data.message);
+          }
+        }
+        return;
       }
 
+      const url = conversationId ? `${CHAT_API_URL}/${conversationId}` : CHAT_API_URL;
+
       const response = await fetch(url, {
         method: 'POST',
         headers: {
@@ -41,7 +136,7 @@ export function useChat() {
       const data = await response.json();
 
       if (!conversationId) {
-        setConversationId(data.conversation_id);
+        onConversationStarted(data.conversation_id);
       }
 
       const assistantMessage: Message = {
@@ -57,11 +152,10 @@ export function useChat() {
     } finally {
       setIsTyping(false);
     }
-  }, [conversationId]);
+  }, []);
 
   return {
     isTyping,
-    sendMessage,
-    conversationId
+    sendMessage
   };
 }
@@ -1,13 +1,117 @@
-import { useState, useCallback, useEffect } from 'react';
+import { useState, useCallback, useEffect, useRef } from 'react';
 import { Conversation, Message, FileUploadState, MultiFileUploadState } from '../types';
 
 const STORAGE_KEY = 'docChat_conversations';
+const CHAT_API_URL = import.meta.env.VITE_CHAT_API_URL || '/api/chat';
+// GET /conversations and GET /conversations/{id}/messages sit next to POST /chat
+const HISTORY_API_URL = import.meta.env.VITE_HISTORY_API_URL || CHAT_API_URL.replace(/\/chat\/?$/, '');
+const CONVERSATIONS_PAGE_SIZE = 20;
+const MESSAGES_PAGE_SIZE = 50;
+
+interface StoredConversation {
+  conversation_id: string;
+  topic: string | null;
+  status: string;
+  created_at: string;
+  updated_at: string;
+}
+
+interface StoredMessage {
+  message_id: string;
+  role: string;
+  content: string;
+  token_count: number | null;
+  created_at: string;
+}
+
+interface ConversationPage {
+  conversations: StoredConversation[];
+  next_cursor: string | null;
+}
+
+interface MessagePage {
+  conversation_id: string;
+  messages: StoredMessage[];
+  next_cursor: string | null;
+}
+
+async function fetchPage<T>(path: string, limit: number, cursor?: string | null): Promise<T> {
+  const params = new URLSearchParams({ limit: String(limit) });
+  if (cursor) {
+    params.set('cursor', cursor);
+  }
+  const response = await fetch(`${HISTORY_API_URL}${path}?${params}`);
+  if (!response.ok) {
+    throw new Error(`Failed to load ${path}`);
+  }
+  return response.json();
+}
+
+function toMessage(message: StoredMessage): Message {
+  return {
+    id: message.message_id,
+    content: message.content,
+    sender: message.role === 'user' ? 'user' : 'assistant',
+    timestamp: new Date(message.created_at)
+  };
+}
+
+// A conversation known only to the chat API; its messages are fetched when it is opened
+function fromStored(stored: StoredConversation): Conversation {
+  return {
+    id: stored.conversation_id,
+    serverId: stored.conversation_id,
+    title: stored.topic || 'Conversation',
+    messages: [],
+    uploadState: {
+      file: null,
+      status: 'ready',
+      progress: 0
+    },
+    multiUploadState: {
+      files: [],
+      overallStatus: 'idle',
+      overallProgress: 0,
+      completedCount: 0,
+      totalCount: 0
+    },
+    createdAt: new Date(stored.created_at),
+    updatedAt: new Date(stored.updated_at),
+    messagesLoaded: false,
+    olderMessagesCursor: null
+  };
+}
 
 export function useConversationHistory() {
   const [conversations, setConversations] = useState<Conversation[]>([]);
   const [activeConversationId, setActiveConversationId] = useState<string | null>(null);
+  // Cursor of the next page of GET /conversations; null once every page is loaded
+  const [conversationsCursor, setConversationsCursor] = useState<string | null>(null);
+  const loadingMessages = useRef(new Set<string>());
 
-  // Load conversations from localStorage on mount
+  const mergeStoredConversations = useCallback((stored: StoredConversation[]) => {
+    setConversations(prev => {
+      const byServerId = new Map(stored.map(conv => [conv.conversation_id, conv]));
+      const known = new Set(prev.map(conv => conv.serverId));
+      const updated = prev.map(conv => {
+        const match = conv.serverId ? byServerId.get(conv.serverId) : undefined;
+        return match ? { ...conv, updatedAt: new Date(match.updated_at) } : conv;
+      });
+      return [...updated, ...stored.filter(conv => !known.has(conv.conversation_id)).map(fromStored)];
+    });
+  }, []);
+
+  const loadConversations = useCallback(async (cursor: string | null) => {
+    try {
+      const page = await fetchPage<ConversationPage>('/conversations', CONVERSATIONS_PAGE_SIZE, cursor);
+      mergeStoredConversations(page.conversations);
+      setConversationsCursor(page.next_cursor);
+    } catch (error) {
+      console.error('Failed to load conversations from the chat API:', error);
+    }
+  }, [mergeStoredConversations]);
+
+  // Load conversations from localStorage on mount, then the first page from the chat API
   useEffect(() => {
     const stored = localStorage.getItem(STORAGE_KEY);
     if (stored) {
@@ -23,10 +127,10 @@ export function useConversationHistory() {
           }))
         }));
         setConversations(conversationsWithDates);
-        
+
         // Set active conversation to the most recent one
         if (conversationsWithDates.length > 0) {
-          const mostRecent = conversationsWithDates.sort((a: Conversation, b: Conversation) => 
+          const mostRecent = conversationsWithDates.sort((a: Conversation, b: Conversation) =>
             b.updatedAt.getTime() - a.updatedAt.getTime()
           )[0];
           setActiveConversationId(mostRecent.id);
@@ -35,21 +139,69 @@ export function useConversationHistory() {
         console.error('Failed to load conversations from localStorage:', error);
       }
     }
-  }, []);
+    loadConversations(null);
+  }, [loadConversations]);
 
-  // Save conversations to localStorage whenever they change
+  // Save conversations to localStorage whenever they change. Conversations
+  // listed by the chat API are not stored; they are listed again on the next load.
   useEffect(() => {
-    if (conversations.length > 0) {
-      localStorage.setItem(STORAGE_KEY, JSON.stringify(conversations));
+    const local = conversations.filter(conv => conv.id !== conv.serverId);
+    if (local.length > 0) {
+      localStorage.setItem(STORAGE_KEY, JSON.stringify(local));
+    }
+  }, [conversations]);
+
+  const loadMoreConversations = useCallback(() => {
+    if (conversationsCursor) {
+      loadConversations(conversationsCursor);
+    }
+  }, [conversationsCursor, loadConversations]);
+
+  // Fetches the newest page of a stored conversation's messages, or the next
+  // older page once the newest is loaded
+  const loadMessages = useCallback(async (conversationId: string) => {
+    const conversation = conversations.find(conv => conv.id === conversationId);
+    if (!conversation?.serverId || loadingMessages.current.has(conversationId)) {
+      return;
+    }
+    const older = conversation.messagesLoaded !== false;
+    if (older && !conversation.olderMessagesCursor) {
+      return;
+    }
+
+    loadingMessages.current.add(conversationId);
+    try {
+      const page = await fetchPage<MessagePage>(
+        `/conversations/${encodeURIComponent(conversation.serverId)}/messages`,
+        MESSAGES_PAGE_SIZE,
+        older ? conversation.olderMessagesCursor : null
+      );
+      const messages = page.messages
+        .filter(message => message.role === 'user' || message.role === 'assistant')
+        .map(toMessage);
+      setConversations(prev => prev.map(conv =>
+        conv.id === conversationId
+          ? {
+              ...conv,
+              messages: older ? [...messages, ...conv.messages] : messages,
+              messagesLoaded: true,
+              olderMessagesCursor: page.next_cursor
+            }
+          : conv
+      ));
+    } catch (error) {
+      console.error('Failed to load messages from the chat API:', error);
+    } finally {
+      loadingMessages.current.delete(conversationId);
     }
   }, [conversations]);
 
   const createConversation = useCallback((fileName?: string, fileNames?: string[]): string => {
     const now = new Date();
     let title = 'New Conversation';
-    
+
     if (fileNames && fileNames.length > 0) {
-      title = fileNames.length === 1 
+      title = fileNames.length === 1
         ? `Chat with ${fileNames[0]}`
         : `Chat with ${fileNames.length} files`;
     } else if (fileName) {
@@ -84,19 +236,25 @@ export function useConversationHistory() {
   }, []);
 
   const updateConversation = useCallback((
-    conversationId: string, 
+    conversationId: string,
     updates: Partial<Omit<Conversation, 'id' | 'createdAt'>>
   ) => {
-    setConversations(prev => prev.map(conv => 
-      conv.id === conversationId 
+    setConversations(prev => prev.map(conv =>
+      conv.id === conversationId
         ? { ...conv, ...updates, updatedAt: new Date() }
         : conv
     ));
   }, []);
 
+  // Links a local conversation to the conversation_id the chat API assigned
+  // to its first message; every message since then is already in `messages`
+  const linkServerConversation = useCallback((conversationId: string, serverId: string) => {
+    updateConversation(conversationId, { serverId, messagesLoaded: true, olderMessagesCursor: null });
+  }, [updateConversation]);
+
   const deleteConversation = useCallback((conversationId: string) => {
     setConversations(prev => prev.filter(conv => conv.id !== conversationId));
-    
+
     // If we're deleting the active conversation, switch to another one
     if (activeConversationId === conversationId) {
       setConversations(current => {
@@ -112,10 +270,24 @@ export function useConversationHistory() {
   }, [activeConversationId]);
 
   const addMessage = useCallback((conversationId: string, message: Message) => {
-    updateConversation(conversationId, {
-      messages: [...(conversations.find(c => c.id === conversationId)?.messages || []), message]
-    });
-  }, [conversations, updateConversation]);
+    setConversations(prev => prev.map(conv =>
+      conv.id === conversationId
+        ? { ...conv, messages: [...conv.messages, message], updatedAt: new Date() }
+        : conv
+    ));
+  }, []);
+
+  const updateMessage = useCallback((conversationId: string, messageId: string, content: string) => {
+    setConversations(prev => prev.map(conv =>
+      conv.id === conversationId
+        ? {
+            ...conv,
+            messages: conv.messages.map(msg => msg.id === messageId ? { ...msg, content } : msg),
+            updatedAt: new Date()
+          }
+        : conv
+    ));
+  }, []);
 
   const updateUploadState = useCallback((conversationId: string, uploadState: FileUploadState) => {
     updateConversation(conversationId, { uploadState });
@@ -133,16 +305,31 @@ export function useConversationHistory() {
     setActiveConversationId(conversationId);
   }, []);
 
+  const activeConversation = getActiveConversation();
+
+  // Fetch the newest messages of a stored conversation when it is opened
+  useEffect(() => {
+    if (activeConversation?.serverId && activeConversation.messagesLoaded === false) {
+      loadMessages(activeConversation.id);
+    }
+  }, [activeConversation, loadMessages]);
+
   return {
     conversations,
     activeConversationId,
-    activeConversation: getActiveConversation(),
+    activeConversation,
+    hasMoreConversations: conversationsCursor !== null,
+    hasOlderMessages: Boolean(activeConversation?.olderMessagesCursor),
     createConversation,
     updateConversation,
+    linkServerConversation,
     deleteConversation,
     addMessage,
+    updateMessage,
     updateUploadState,
     updateMultiUploadState,
-    switchConversation
+    switchConversation,
+    loadMoreConversations,
+    loadOlderMessages: loadMessages
   };
-}
\ No newline at end of file
+}
@@ -1,4 +1,5 @@
 import { useCallback } from 'react';
+import { requestUploads, uploadToTarget } from './directUpload';
 
 interface FileUploadState {
   file: File | null;
@@ -19,19 +20,16 @@ export function useFileUpload() {
     });
 
     try {
-      const response = await fetch(import.meta.env.VITE_UPLOAD_API_URL || '/api/upload', {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/octet-stream',
-          'X-File-Name': file.name, // Send file name in header
-        },
-        body: file,
+      // Presigned upload straight to S3; the upload is the first half of the progress bar
+      const [target] = await requestUploads([file]);
+      await uploadToTarget(file, target, fraction => {
+        onStateChange({
+          file,
+          status: 'uploading',
+          progress: Math.round(fraction * 50)
+        });
       });
 
-      if (!response.ok) {
-        throw new Error('File upload failed');
-      }
-
       onStateChange({
         file,
         status: 'processing',
@@ -1,5 +1,6 @@
 import { useCallback } from 'react';
 import { MultiFileUploadState, FileUploadItem } from '../types';
+import { FILE_CONCURRENCY, requestUploads, runPool, uploadToTarget } from './directUpload';
 
 export function useMultiFileUpload() {
   const uploadFiles = useCallback(async (
@@ -13,75 +14,62 @@ export function useMultiFileUpload() {
       progress: 0
     }));
 
-    const initialState: MultiFileUploadState = {
-      files: fileItems,
-      overallStatus: 'uploading',
-      overallProgress: 0,
-      completedCount: 0,
-      totalCount: files.length
+    const emit = () => {
+      const completedCount = fileItems.filter(item => item.status === 'ready').length;
+      const settled = fileItems.every(item => item.status === 'ready' || item.status === 'error');
+      const failed = fileItems.some(item => item.status === 'error');
+      onStateChange({
+        files: [...fileItems],
+        overallStatus: settled
+          ? (failed ? 'error' : 'ready')
+          : fileItems.some(item => item.status === 'pending' || item.status === 'uploading') ? 'uploading' : 'processing',
+        overallProgress: Math.round(fileItems.reduce((sum, item) => sum + item.progress, 0) / files.length),
+        completedCount,
+        totalCount: files.length
+      });
     };
 
-    onStateChange(initialState);
+    const update = (index: number, changes: Partial<FileUploadItem>) => {
+      fileItems[index] = { ...fileItems[index], ...changes };
+      emit();
+    };
 
-    try {
-      for (let i = 0; i < fileItems.length; i++) {
-        const fileItem = fileItems[i];
-        
-        fileItems[i] = { ...fileItem, status: 'uploading' };
-        onStateChange({
-          ...initialState,
-          files: [...fileItems],
-          overallProgress: Math.round((i / files.length) * 100)
-        });
+    emit();
 
-        const response = await fetch(import.meta.env.VITE_UPLOAD_API_URL || '/api/upload', {
-          method: 'POST',
-          headers: {
-            'Content-Type': 'application/octet-stream',
-            'X-File-Name': fileItem.file.name,
-          },
-          body: fileItem.file,
-        });
+    try {
+      // One batch request for every file's presigned URLs, then the files go
+      // straight to S3, a few at a time
+      const targets = await requestUploads(files);
 
-        if (!response.ok) {
-          throw new Error(`File ${fileItem.file.name} upload failed`);
+      await runPool(fileItems, FILE_CONCURRENCY, async (fileItem, i) => {
+        update(i, { status: 'uploading' });
+        try {
+          // Upload is the first half of the progress bar, processing the second
+          await uploadToTarget(fileItem.file, targets[i], fraction => {
+            update(i, { progress: Math.round(fraction * 50) });
+          });
+        } catch (error) {
+          update(i, { status: 'error', error: error instanceof Error ? error.message : 'Upload failed' });
+          return;
         }
 
-        fileItems[i] = { ...fileItem, status: 'processing', progress: 50 };
-        onStateChange({
-          ...initialState,
-          files: [...fileItems],
-          overallStatus: 'processing'
-        });
+        update(i, { status: 'processing', progress: 50 });
 
-        await new Promise(resolve => setTimeout(resolve, 1000)); 
+        await new Promise(resolve => setTimeout(resolve, 1000));
 
-        fileItems[i] = { ...fileItem, status: 'ready', progress: 100 };
-        initialState.completedCount = i + 1;
-        
-        onStateChange({
-          ...initialState,
-          files: [...fileItems],
-          overallProgress: Math.round(((i + 1) / files.length) * 100),
-          overallStatus: i === files.length - 1 ? 'ready' : 'processing'
-        });
-      }
+        update(i, { status: 'ready', progress: 100 });
+      });
 
     } catch (error) {
-      const errorState: MultiFileUploadState = {
-        ...initialState,
-        overallStatus: 'error',
-        files: fileItems.map(item => 
-          item.status === 'uploading' || item.status === 'processing'
-            ? { ...item, status: 'error', error: error instanceof Error ? error.message : 'Upload failed' } // Use error from catch block
-            : item
-        )
-      };
-      onStateChange(errorState);
+      // The batch request itself failed; no file was sent
+      fileItems.forEach((item, i) => {
+        fileItems[i] = { ...item, status: 'error', error: error instanceof Error ? error.message : 'Upload failed' };
+      });
+      emit();
     }
   }, []);
 
   return {
     uploadFiles
   };
-}
\ No newline at end of file
+}
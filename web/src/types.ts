@@ -38,6 +38,12 @@ export interface Conversation {
   multiUploadState?: MultiFileUploadState;
   createdAt: Date;
   updatedAt: Date;
+  // conversation_id of the chat API, set once the first message is answered
+  serverId?: string;
+  // false until the stored messages of a conversation listed by the API are fetched
+  messagesLoaded?: boolean;
+  // Cursor of the next page of older messages; null when there are none
+  olderMessagesCursor?: string | null;
 }
 
 export interface AppState {